@@ -1,2 +1,30 @@
-from covid_shared import cli_tools, paths, shell_tools
+import importlib
+from typing import Any, List
+
 from covid_shared.__about__ import *
+
+# Subpackages and modules are imported on first access so that importing
+# the package doesn't pull in their dependencies.
+_SUBMODULES = frozenset(
+    [
+        "aggregation",
+        "cache",
+        "cli_tools",
+        "hierarchy",
+        "ihme_deps",
+        "parallel",
+        "paths",
+        "shell_tools",
+        "workflow",
+    ]
+)
+
+
+def __getattr__(name: str) -> Any:
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | _SUBMODULES)
@@ -0,0 +1,183 @@
+"""Batched aggregation of location level results up a location hierarchy.
+
+Results are usually computed for most detailed locations and then summed
+(or population-weighted averaged) up to regions and the globe.
+:class:`HierarchyAggregator` does this for every aggregate location at
+once on arrays shaped like (locations x draws x dates), using the
+level-wise kernel in :meth:`LocationHierarchy.aggregate
+<covid_shared.hierarchy.LocationHierarchy.aggregate>` rather than a
+pandas groupby per level.
+
+Large draw sets can be aggregated in chunks to bound memory, either by
+passing ``chunk_size`` or by streaming chunks through
+:meth:`HierarchyAggregator.aggregate_chunks`.
+
+"""
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from covid_shared.hierarchy import LocationHierarchy
+
+AGGREGATION_METHODS = ("sum", "mean")
+
+
+class HierarchyAggregator:
+    """Aggregates arrays of most detailed location values to all locations.
+
+    Parameters
+    ----------
+    hierarchy
+        The location hierarchy to aggregate over.
+    location_ids
+        The locations along the first axis of the arrays to aggregate.
+        These must be exactly the most detailed locations of the
+        hierarchy, in any order.
+
+    Attributes
+    ----------
+    location_ids
+        The locations along the first axis of aggregated arrays, in
+        hierarchy order.
+
+    """
+
+    def __init__(self, hierarchy: LocationHierarchy, location_ids: np.ndarray):
+        location_ids = np.asarray(location_ids, dtype=np.int64)
+        positions = hierarchy.index(location_ids)
+        if len(np.unique(positions)) != len(positions):
+            raise ValueError("Locations to aggregate must be unique.")
+        not_most_detailed = ~hierarchy.most_detailed[positions]
+        if np.any(not_most_detailed):
+            raise ValueError(
+                f"Only most detailed locations can be aggregated. "
+                f"Locations {location_ids[not_most_detailed].tolist()} are not most detailed."
+            )
+        missing = np.setdiff1d(hierarchy.most_detailed_ids, location_ids)
+        if len(missing):
+            raise ValueError(
+                f"Aggregates would be incomplete. Missing most detailed "
+                f"locations {missing.tolist()}."
+            )
+
+        self.hierarchy = hierarchy
+        self.location_ids = hierarchy.location_ids
+        self._positions = positions
+
+    def aggregate(
+        self,
+        values: np.ndarray,
+        how: str = "sum",
+        weights: np.ndarray = None,
+        chunk_size: int = None,
+        axis: int = 1,
+    ) -> np.ndarray:
+        """Aggregate values to all locations in the hierarchy.
+
+        Parameters
+        ----------
+        values
+            An array whose first axis is aligned with the aggregator's
+            input locations, typically shaped (locations x draws x dates).
+        how
+            ``"sum"`` for (weighted) sums or ``"mean"`` for weighted means.
+        weights
+            Weights (e.g. population) aligned with the input locations on
+            their first axis. Trailing axes are broadcast against
+            ``values`` after padding with singleton axes, so weights shaped
+            (locations,) apply to all draws and dates. Required for means.
+        chunk_size
+            If provided, aggregate this many entries of ``axis`` at a
+            time to bound the size of intermediate arrays.
+        axis
+            The axis to chunk over. Defaults to the draw axis.
+
+        Returns
+        -------
+        np.ndarray
+            Values for every location in the hierarchy, in the order of
+            :attr:`location_ids`.
+
+        """
+        values = np.asarray(values)
+        if chunk_size is None or values.ndim < 2:
+            return self._aggregate(values, how, weights)
+
+        if axis == 0:
+            raise ValueError("Can't chunk over the location axis.")
+        if weights is not None:
+            weights = self._pad(np.asarray(weights), values.ndim)
+        result = None
+        for start in range(0, values.shape[axis], chunk_size):
+            chunk = slice(start, start + chunk_size)
+            chunk_weights = weights
+            if weights is not None and weights.shape[axis] > 1:
+                chunk_weights = _take(weights, chunk, axis)
+            aggregated = self._aggregate(_take(values, chunk, axis), how, chunk_weights)
+            if result is None:
+                shape = list(aggregated.shape)
+                shape[axis] = values.shape[axis]
+                result = np.empty(shape, dtype=aggregated.dtype)
+            result[(slice(None),) * axis + (chunk,)] = aggregated
+        return result
+
+    def aggregate_chunks(
+        self,
+        chunks: Iterable[np.ndarray],
+        how: str = "sum",
+        weights: np.ndarray = None,
+    ) -> Iterator[np.ndarray]:
+        """Aggregate a stream of chunks (e.g. draws read a few at a time).
+
+        Each chunk is aggregated with the same ``how`` and ``weights`` as
+        :meth:`aggregate` and yielded before the next chunk is read.
+
+        """
+        for chunk in chunks:
+            yield self._aggregate(np.asarray(chunk), how, weights)
+
+    def _aggregate(
+        self, values: np.ndarray, how: str, weights: Optional[np.ndarray]
+    ) -> np.ndarray:
+        if how not in AGGREGATION_METHODS:
+            raise ValueError(
+                f"Unknown aggregation {how}. Aggregation must be one of {AGGREGATION_METHODS}."
+            )
+        if values.shape[0] != len(self._positions):
+            raise ValueError(
+                f"Values have {values.shape[0]} rows but the aggregator "
+                f"has {len(self._positions)} locations."
+            )
+        if how == "mean" and weights is None:
+            raise ValueError("Weights are required to aggregate means.")
+
+        if weights is None:
+            return self._sum(values)
+        weights = self._pad(np.asarray(weights), values.ndim)
+        weighted_sum = self._sum(values * weights)
+        if how == "sum":
+            return weighted_sum
+
+        total_weight = self._sum(np.broadcast_to(weights, values.shape))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = weighted_sum / total_weight
+        # Don't round trip most detailed values through the weights.
+        result[self._positions] = values
+        return result
+
+    def _sum(self, values: np.ndarray) -> np.ndarray:
+        full = np.zeros((len(self.location_ids),) + values.shape[1:], dtype=values.dtype)
+        full[self._positions] = values
+        return self.hierarchy.aggregate(full)
+
+    def _pad(self, weights: np.ndarray, ndim: Union[int, np.integer]) -> np.ndarray:
+        if weights.shape[0] != len(self._positions):
+            raise ValueError(
+                f"Weights have {weights.shape[0]} rows but the aggregator "
+                f"has {len(self._positions)} locations."
+            )
+        return weights.reshape(weights.shape + (1,) * (ndim - weights.ndim))
+
+
+def _take(array: np.ndarray, index: slice, axis: int) -> np.ndarray:
+    return array[(slice(None),) * axis + (index,)]
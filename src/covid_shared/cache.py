@@ -0,0 +1,145 @@
+"""Local on-disk caching of expensive inputs.
+
+Cached data frames are stored in the feather (arrow IPC) format when
+``pyarrow`` is installed, which is fast to read. Otherwise they are
+pickled.
+
+"""
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
+
+from covid_shared import paths
+from covid_shared.shell_tools import mkdir
+
+if TYPE_CHECKING:
+    # Pandas is slow to import and only needed here for annotations.
+    import pandas as pd
+
+CACHE_DIR_ENV_VAR = "COVID_SHARED_CACHE_DIR"
+XDG_CACHE_HOME_ENV_VAR = "XDG_CACHE_HOME"
+FEATHER_SUFFIX = ".feather"
+PICKLE_SUFFIX = ".pkl"
+
+_HASH_CHUNK_SIZE = 2**20
+
+
+def get_cache_root() -> Path:
+    """Get the root directory of the local cache.
+
+    The cache root can be set with the ``COVID_SHARED_CACHE_DIR``
+    environment variable. Otherwise it is a ``covid_shared`` directory in
+    ``XDG_CACHE_HOME`` if that is set, or in ``~/.cache``.
+
+    """
+    if os.environ.get(CACHE_DIR_ENV_VAR):
+        return Path(os.environ[CACHE_DIR_ENV_VAR])
+    if os.environ.get(XDG_CACHE_HOME_ENV_VAR):
+        return Path(os.environ[XDG_CACHE_HOME_ENV_VAR]) / paths.DEFAULT_CACHE_ROOT.name
+    return paths.DEFAULT_CACHE_ROOT
+
+
+def get_cache_dir(name: str, cache_root: Union[str, Path] = None) -> Path:
+    """Get (and create if necessary) a named directory in the cache root."""
+    cache_root = Path(cache_root) if cache_root is not None else get_cache_root()
+    cache_dir = cache_root / name
+    mkdir(cache_dir, exists_ok=True, parents=True)
+    return cache_dir
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """Hash the contents of a file."""
+    digest = hashlib.sha1()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_frame(data: "pd.DataFrame", path_stem: Path) -> Path:
+    """Write a data frame to the cache.
+
+    The frame is written to a temporary file and moved into place so that
+    concurrent readers never see a partially written file.
+
+    Parameters
+    ----------
+    data
+        The data frame to cache.
+    path_stem
+        The path of the cached file without a suffix.
+
+    Returns
+    -------
+    Path
+        The path of the cached file.
+
+    """
+    import pandas as pd
+
+    # Feather can only store frames with a default index.
+    use_feather = _import_pyarrow_feather() is not None and data.index.equals(
+        pd.RangeIndex(len(data))
+    )
+    path = path_stem.with_suffix(FEATHER_SUFFIX if use_feather else PICKLE_SUFFIX)
+
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    try:
+        if use_feather:
+            data.to_feather(tmp_path)
+        else:
+            data.to_pickle(tmp_path)
+        tmp_path.replace(path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return path
+
+
+def read_frame(path_stem: Path) -> Optional["pd.DataFrame"]:
+    """Read a data frame from the cache.
+
+    Parameters
+    ----------
+    path_stem
+        The path of the cached file without a suffix.
+
+    Returns
+    -------
+    Optional[pd.DataFrame]
+        The cached data frame or None if nothing has been cached at the path.
+
+    """
+    feather_path = path_stem.with_suffix(FEATHER_SUFFIX)
+    pyarrow_feather = _import_pyarrow_feather()
+    if pyarrow_feather is not None and feather_path.exists():
+        table = pyarrow_feather.read_table(str(feather_path), memory_map=True)
+        return table.to_pandas()
+
+    pickle_path = path_stem.with_suffix(PICKLE_SUFFIX)
+    if pickle_path.exists():
+        import pandas as pd
+
+        return pd.read_pickle(pickle_path)
+    return None
+
+
+def categorize(data: "pd.DataFrame", max_unique_fraction: float = 0.5) -> "pd.DataFrame":
+    """Convert low cardinality string columns to categoricals."""
+    data = data.copy()
+    if not len(data):
+        return data
+    for column in data.select_dtypes(include=["object", "string"]).columns:
+        if data[column].nunique(dropna=False) <= max_unique_fraction * len(data):
+            data[column] = data[column].astype("category")
+    return data
+
+
+def _import_pyarrow_feather():
+    try:
+        from pyarrow import feather
+    except ModuleNotFoundError:
+        return None
+    return feather
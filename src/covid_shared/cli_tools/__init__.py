@@ -1,49 +1,97 @@
-from covid_shared.cli_tools.cleanup import finish_application
-from covid_shared.cli_tools.decorators import (
-    add_mobility_gpr_dependency_option,
-    add_model_inputs_dependency_option,
-    add_output_options,
-    add_r_singularity_option,
-    add_seir_covariates_dependency_option,
-    add_snapshot_dependency_option,
-    add_verbose,
-    add_verbose_and_with_debugger,
-    add_with_debugger,
-    pass_run_metadata,
-    with_mark_best,
-    with_output_root,
-    with_production_tag,
-)
-from covid_shared.cli_tools.logging import (
-    DEFAULT_LOG_MESSAGING_FORMAT,
-    LOG_FORMATS,
-    add_logging_sink,
-    configure_logging_to_files,
-    configure_logging_to_terminal,
-)
-from covid_shared.cli_tools.metadata import (
-    Metadata,
-    RunMetadata,
-    YamlIOMixin,
-    get_function_full_argument_mapping,
-    handle_exceptions,
-    monitor_application,
-    update_with_previous_metadata,
-)
-from covid_shared.cli_tools.run_directory import (
-    get_current_previous_version,
-    get_last_stage_directory,
-    get_run_directory,
-    make_links,
-    make_run_directory,
-    mark_best,
-    mark_best_explicit,
-    mark_explicit,
-    mark_latest,
-    mark_latest_explicit,
-    mark_production,
-    mark_production_explicit,
-    move_link,
-    setup_directory_structure,
-)
-from covid_shared.cli_tools.validation import validate_best_and_production_tags
+"""Shared tools for building command line applications for pipeline stages.
+
+Names are imported from their submodules on first access so that
+importing this package stays cheap.
+
+"""
+import importlib
+from typing import Any, List
+
+_EXPORTS = {
+    # cleanup
+    "finish_application": "cleanup",
+    # decorators
+    "add_mobility_gpr_dependency_option": "decorators",
+    "add_model_inputs_dependency_option": "decorators",
+    "add_output_options": "decorators",
+    "add_profile": "decorators",
+    "add_profiler": "decorators",
+    "add_r_singularity_option": "decorators",
+    "add_seir_covariates_dependency_option": "decorators",
+    "add_snapshot_dependency_option": "decorators",
+    "add_verbose": "decorators",
+    "add_verbose_and_with_debugger": "decorators",
+    "add_with_debugger": "decorators",
+    "pass_run_metadata": "decorators",
+    "with_mark_best": "decorators",
+    "with_output_root": "decorators",
+    "with_production_tag": "decorators",
+    # log_files
+    "LogFile": "log_files",
+    "LogReader": "log_files",
+    # logging
+    "DEFAULT_LOG_MESSAGING_FORMAT": "logging",
+    "LOG_FORMATS": "logging",
+    "QueuedFileSink": "logging",
+    "add_logging_sink": "logging",
+    "configure_logging_to_files": "logging",
+    "configure_logging_to_terminal": "logging",
+    "flush_logging_sinks": "logging",
+    # metadata
+    "Metadata": "metadata",
+    "RunMetadata": "metadata",
+    "YamlIOMixin": "metadata",
+    "get_function_full_argument_mapping": "metadata",
+    "handle_exceptions": "metadata",
+    "monitor_application": "metadata",
+    "update_with_previous_metadata": "metadata",
+    # profiling
+    "ApplicationProfiler": "profiling",
+    "get_active_profiler": "profiling",
+    # run_directory
+    "get_current_previous_version": "run_directory",
+    "get_last_stage_directory": "run_directory",
+    "get_run_directory": "run_directory",
+    "make_links": "run_directory",
+    "make_run_directory": "run_directory",
+    "mark_best": "run_directory",
+    "mark_best_explicit": "run_directory",
+    "mark_explicit": "run_directory",
+    "mark_latest": "run_directory",
+    "mark_latest_explicit": "run_directory",
+    "mark_production": "run_directory",
+    "mark_production_explicit": "run_directory",
+    "move_link": "run_directory",
+    "setup_directory_structure": "run_directory",
+    # timing
+    "SpanRecorder": "timing",
+    "get_span_summary": "timing",
+    "reset_spans": "timing",
+    "span": "timing",
+    "timed": "timing",
+    # tracing
+    "get_trace_context": "tracing",
+    "write_trace_report": "tracing",
+    # validation
+    "validate_best_and_production_tags": "validation",
+}
+_SUBMODULES = frozenset(_EXPORTS.values())
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name in _EXPORTS:
+        module = importlib.import_module(f"{__name__}.{_EXPORTS[name]}")
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f"{__name__}.{name}")
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Cache the value so we only pay the lookup cost once.
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__) | _SUBMODULES)
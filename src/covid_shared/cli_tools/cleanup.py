@@ -1,8 +1,13 @@
 from pathlib import Path
 from typing import Optional
 
+from loguru import logger
+
+from covid_shared.cli_tools.logging import flush_logging_sinks
 from covid_shared.cli_tools.metadata import Metadata, RunMetadata
+from covid_shared.cli_tools.profiling import finish_profiling
 from covid_shared.cli_tools.run_directory import make_links
+from covid_shared.cli_tools.timing import get_span_summary
 
 
 def finish_application(
@@ -15,9 +20,12 @@ def finish_application(
 ) -> None:
     """
     Every cli tool should do the following:
-        1. serialize metadata to disk
-        2. update symlinks (if successful application)
-        3. raise exception (if not sucessful)
+        1. write profile results (if the application is being profiled)
+        2. summarize timed spans (if any were recorded)
+        3. flush asynchronous log files (if logging asynchronously)
+        4. serialize metadata to disk
+        5. update symlinks (if successful application)
+        6. raise exception (if not sucessful)
 
     Parameters
     ------------
@@ -27,6 +35,19 @@ def finish_application(
         mark_as_best: whether to update 'best' symlink
         production_tag: what string to tag prod run, if any
     """
+    profile_summary = finish_profiling(run_directory)
+    if profile_summary is not None:
+        run_metadata["profile"] = profile_summary
+
+    span_summary = get_span_summary()
+    if span_summary:
+        logger.info(f"Application spans: {span_summary}")
+        run_metadata["spans"] = span_summary
+
+    logging_summary = flush_logging_sinks()
+    if logging_summary is not None:
+        run_metadata["logging"] = logging_summary
+
     run_metadata["app_metadata"] = app_metadata.to_dict()
     run_metadata.dump(run_directory / "metadata.yaml")
 
@@ -3,11 +3,15 @@ import types
 from pathlib import Path
 
 import click
+from loguru import logger
 
+from covid_shared.cli_tools.logging import get_log_directory
 from covid_shared.cli_tools.metadata import (
     RunMetadata,
     get_function_full_argument_mapping,
+    start_memory_sampler,
 )
+from covid_shared.cli_tools.profiling import PROFILE_MODES, ApplicationProfiler
 from covid_shared.paths import BEST_LINK, R_SINGULARITY_IMAGE_PATH
 
 add_verbose = click.option("-v", "verbose", count=True, help="Configure logging verbosity.")
@@ -26,6 +30,58 @@ def add_verbose_and_with_debugger(func: types.FunctionType):
     return func
 
 
+add_profile = click.option(
+    "--profile",
+    "profile",
+    type=click.Choice(PROFILE_MODES),
+    default=None,
+    help=(
+        "Run the application under a profiler and write the results to the run's logs "
+        "directory. 'sample' uses a low overhead stack sampler and writes collapsed "
+        "stacks and a pstats file estimated from the samples. 'cprofile' additionally "
+        "runs the deterministic profiler for an exact pstats file."
+    ),
+)
+
+
+def add_profiler(entry_point: types.FunctionType):
+    """Add a profile option and run the entry point under the requested profiler.
+
+    The profiler is stopped and its results are written by
+    :func:`finish_application` so that a summary of the profile ends up
+    in the run metadata. The entry point does not receive the profile
+    option as an argument.
+
+    """
+
+    @functools.wraps(entry_point)
+    def _wrapped(*args, **kwargs):
+        profile_mode = kwargs.pop("profile", None)
+        if profile_mode is None:
+            return entry_point(*args, **kwargs)
+
+        profiler = ApplicationProfiler(profile_mode)
+        try:
+            with profiler:
+                return entry_point(*args, **kwargs)
+        finally:
+            if profiler.summary is None:
+                output_dir = get_log_directory()
+                if output_dir is None:
+                    logger.warning(
+                        "Application exited without calling finish_application or "
+                        "logging to files. Discarding profile results."
+                    )
+                else:
+                    logger.warning(
+                        f"Application exited without calling finish_application. "
+                        f"Writing profile results to {output_dir}."
+                    )
+                    profiler.finish(output_dir)
+
+    return add_profile(_wrapped)
+
+
 with_production_tag = click.option(
     "-p",
     "--production-tag",
@@ -84,6 +140,9 @@ def pass_run_metadata(run_metadata: RunMetadata = RunMetadata()):
     def _pass_run_metadata(app_entry_point: types.FunctionType):
         @functools.wraps(app_entry_point)
         def _wrapped(*args, **kwargs):
+            # Started here rather than with the metadata, which is created
+            # when this module is imported.
+            start_memory_sampler()
             # Record arguments for the run and inject the metadata.
             run_metadata[
                 "tool_name"
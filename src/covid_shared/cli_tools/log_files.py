@@ -0,0 +1,403 @@
+"""Log files with size based rotation, compression, and a segment index.
+
+Log files written by :class:`LogFile` may be split into segments. The
+active segment keeps the original file name and rotated segments are
+renamed with a sequence number and optionally compressed. A small json
+index next to the log file records the time range and level counts of
+every segment so that :class:`LogReader` only has to open (and
+decompress) the segments that can contain the records being looked for.
+
+"""
+import atexit
+import datetime
+import gzip
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Union
+
+from loguru import logger
+
+COMPRESSION_SUFFIXES = {"gz": ".gz", "zst": ".zst"}
+
+_SEQUENCE_RE = re.compile(r"\.(\d{5})\.")
+
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?B)?\s*$", re.IGNORECASE)
+_SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+_TEXT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+_Time = Union[datetime.datetime, float]
+
+
+def parse_size(size: Union[int, str]) -> int:
+    """Parse a size like ``"500 MB"`` into a number of bytes."""
+    if isinstance(size, int):
+        return size
+    match = _SIZE_RE.match(size)
+    if not match:
+        raise ValueError(f'Invalid size {size}. Sizes should look like "500 MB" or "2 GB".')
+    value, unit = match.groups()
+    return int(float(value) * _SIZE_UNITS[(unit or "B").upper()])
+
+
+def get_index_path(log_path: Union[str, Path]) -> Path:
+    """Get the path of the segment index for a log file."""
+    log_path = Path(log_path)
+    return log_path.with_name(f"{log_path.name}.index")
+
+
+def _open_compressed(path: Path, mode: str) -> IO:
+    if path.suffix == COMPRESSION_SUFFIXES["gz"]:
+        return gzip.open(path, mode)
+    elif path.suffix == COMPRESSION_SUFFIXES["zst"]:
+        zstandard = _import_zstandard()
+        return zstandard.open(path, mode)
+    else:
+        return path.open(mode)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError(
+            "zstd compression of log files requires the 'zstandard' package. "
+            "Run 'pip install zstandard' or use 'gz' compression."
+        )
+    return zstandard
+
+
+class _Segment:
+    """Time range and level counts for the records in a log segment."""
+
+    __slots__ = ("file", "start", "end", "levels", "records", "size")
+
+    def __init__(
+        self,
+        file: str,
+        start: float = None,
+        end: float = None,
+        levels: Dict[int, int] = None,
+        records: int = 0,
+        size: int = 0,
+    ):
+        self.file = file
+        self.start = start
+        self.end = end
+        self.levels = {int(k): v for k, v in (levels or {}).items()}
+        self.records = records
+        self.size = size
+
+    def add(self, timestamp: float, level: int, size: int) -> None:
+        if self.start is None:
+            self.start = timestamp
+        self.end = timestamp
+        self.levels[level] = self.levels.get(level, 0) + 1
+        self.records += 1
+        self.size += size
+
+    def to_dict(self) -> Dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class LogFile:
+    """A log file that can be rotated, compressed, and pruned as it grows.
+
+    Messages are expected to be loguru messages, which carry the record
+    they were formatted from. The time and level of each record are used
+    to maintain the segment index when the file is rotated.
+
+    Parameters
+    ----------
+    path
+        The log file path.
+    rotation
+        The size at which the active segment is rotated, either in bytes
+        or as a string like ``"500 MB"``. If not provided, the file is
+        never rotated.
+    compression
+        Compression for rotated segments. One of ``"gz"`` or ``"zst"``.
+        ``"zst"`` requires the ``zstandard`` package.
+    retention
+        The maximum number of rotated segments to keep. The oldest
+        segments are deleted first.
+
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        rotation: Union[int, str] = None,
+        compression: str = None,
+        retention: int = None,
+    ):
+        if compression is not None and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(
+                f"Unknown log compression {compression}. "
+                f"Compression must be one of {list(COMPRESSION_SUFFIXES)}."
+            )
+        if compression == "zst":
+            # Fail now rather than on the first rotation.
+            _import_zstandard()
+        if retention is not None and retention < 1:
+            raise ValueError("Log retention must keep at least one rotated segment.")
+
+        self.path = Path(path)
+        self.rotation = parse_size(rotation) if rotation is not None else None
+        self.compression = compression
+        self.retention = retention
+        self.indexed = any(
+            option is not None for option in (rotation, compression, retention)
+        )
+
+        self._segments: List[_Segment] = []
+        self._active = _Segment(self.path.name)
+        if self.indexed:
+            self._load_index()
+        self._file = self.path.open("a", encoding="utf8")
+        self._closed = False
+        _LOG_FILES.append(self)
+
+    def write(self, message: str) -> None:
+        """Write a single message and flush it to disk.
+
+        Used as a synchronous logging sink, so messages reach the disk
+        even if the process is killed before the file is closed.
+
+        """
+        self.write_messages([message])
+        self._file.flush()
+
+    def write_messages(self, messages: List[str]) -> None:
+        """Write a batch of messages, rotating the file as needed."""
+        if not self.indexed:
+            self._file.write("".join(messages))
+            return
+        for message in messages:
+            record = getattr(message, "record", None)
+            if record is not None:
+                self._active.add(record["time"].timestamp(), record["level"].no, len(message))
+            else:
+                self._active.add(self._active.end or 0.0, 0, len(message))
+            self._file.write(message)
+            if self.rotation is not None and self._active.size >= self.rotation:
+                self.rotate()
+
+    def flush(self) -> None:
+        """Flush buffered messages to disk."""
+        if not self._closed:
+            self._file.flush()
+
+    def sync(self) -> None:
+        """Flush buffered messages to disk and update the segment index.
+
+        The index is otherwise only updated on rotation and when the
+        file is closed.
+
+        """
+        self.flush()
+        if self.indexed and not self._closed:
+            self._write_index()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.sync()
+        self._file.close()
+        self._closed = True
+        if self in _LOG_FILES:
+            _LOG_FILES.remove(self)
+
+    def rotate(self) -> None:
+        """Close the active segment and start a new one."""
+        self._file.close()
+        sequence = (
+            int(_SEQUENCE_RE.search(self._segments[-1].file).group(1)) + 1
+            if self._segments
+            else 1
+        )
+        segment_path = self.path.with_name(
+            f"{self.path.stem}.{sequence:05d}{self.path.suffix}"
+        )
+        self.path.rename(segment_path)
+        if self.compression is not None:
+            compressed_path = segment_path.with_name(
+                segment_path.name + COMPRESSION_SUFFIXES[self.compression]
+            )
+            with segment_path.open("rb") as infile, _open_compressed(
+                compressed_path, "wb"
+            ) as outfile:
+                shutil.copyfileobj(infile, outfile)
+            segment_path.unlink()
+            segment_path = compressed_path
+
+        self._active.file = segment_path.name
+        self._segments.append(self._active)
+        self._active = _Segment(self.path.name)
+
+        if self.retention is not None:
+            while len(self._segments) > self.retention:
+                expired = self._segments.pop(0)
+                try:
+                    (self.path.parent / expired.file).unlink()
+                except FileNotFoundError:
+                    pass
+
+        self._file = self.path.open("a", encoding="utf8")
+        self._write_index()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rotated_segments": len(self._segments),
+            "rotated_bytes": sum(s.size for s in self._segments),
+        }
+
+    def _load_index(self) -> None:
+        index_path = get_index_path(self.path)
+        if not index_path.exists():
+            return
+        with index_path.open() as index_file:
+            index = json.load(index_file)
+        self._segments = [_Segment(**segment) for segment in index["segments"][:-1]]
+        # We don't know what's already in the active segment, so leave its
+        # time range open so readers always look at it.
+        previous_active = index["segments"][-1]
+        self._active.records = previous_active["records"]
+        self._active.size = previous_active["size"]
+        self._active.levels = {int(k): v for k, v in previous_active["levels"].items()}
+
+    def _write_index(self) -> None:
+        index = {"segments": [s.to_dict() for s in self._segments + [self._active]]}
+        index_path = get_index_path(self.path)
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        with tmp_path.open("w") as index_file:
+            json.dump(index, index_file)
+        tmp_path.replace(index_path)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+
+_LOG_FILES: List[LogFile] = []
+
+
+def sync_log_files() -> None:
+    """Flush all open log files and update their segment indices."""
+    for log_file in _LOG_FILES:
+        log_file.sync()
+
+
+@atexit.register
+def _close_log_files() -> None:
+    for log_file in list(_LOG_FILES):
+        log_file.close()
+
+
+class LogReader:
+    """Reads records from a log file and its rotated segments.
+
+    The segment index is used to skip segments that can't contain
+    records in the requested time range or at the requested level.
+    Serialized (json) logs are filtered record by record. Text logs are
+    filtered by time using the timestamp at the start of each line, but
+    can only be filtered by level at the segment level as the default
+    message format does not include the level.
+
+    Parameters
+    ----------
+    path
+        The path of the (active) log file.
+
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.serialized = self.path.suffix == ".json"
+
+    def segments(
+        self, start: _Time = None, end: _Time = None, level: Union[int, str] = None
+    ) -> List[Path]:
+        """Get the paths of segments that may contain matching records, oldest first."""
+        start, end, level = self._normalize(start, end, level)
+        index_path = get_index_path(self.path)
+        if not index_path.exists():
+            return [self.path] if self.path.exists() else []
+        with index_path.open() as index_file:
+            segments = [_Segment(**s) for s in json.load(index_file)["segments"]]
+
+        matching = []
+        for segment in segments:
+            if segment.file == self.path.name:
+                # The active segment may have been written to since the
+                # index was last updated, so only its start time is reliable.
+                if segment.start is not None and end is not None and segment.start > end:
+                    continue
+            elif segment.start is not None:
+                if start is not None and segment.end < start:
+                    continue
+                if end is not None and segment.start > end:
+                    continue
+                if level is not None and max(segment.levels) < level:
+                    continue
+            segment_path = self.path.parent / segment.file
+            if segment_path.exists():
+                matching.append(segment_path)
+        return matching
+
+    def read(
+        self, start: _Time = None, end: _Time = None, level: Union[int, str] = None
+    ) -> Iterator[Union[Dict, str]]:
+        """Iterate over matching records, oldest first.
+
+        Parameters
+        ----------
+        start
+            Only yield records logged at or after this time.
+        end
+            Only yield records logged at or before this time.
+        level
+            Only yield records at or above this level.
+
+        Yields
+        ------
+        Union[Dict, str]
+            Parsed records for serialized logs and lines for text logs.
+
+        """
+        start, end, level = self._normalize(start, end, level)
+        for segment_path in self.segments(start, end, level):
+            with _open_compressed(segment_path, "rt") as segment:
+                for line in segment:
+                    if self.serialized:
+                        record = json.loads(line)
+                        timestamp = record["record"]["time"]["timestamp"]
+                        if level is not None and record["record"]["level"]["no"] < level:
+                            continue
+                    else:
+                        record = line
+                        timestamp = _parse_text_timestamp(line)
+                    if timestamp is not None:
+                        if start is not None and timestamp < start:
+                            continue
+                        if end is not None and timestamp > end:
+                            continue
+                    yield record
+
+    @staticmethod
+    def _normalize(start: Optional[_Time], end: Optional[_Time], level):
+        if isinstance(start, datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end, datetime.datetime):
+            end = end.timestamp()
+        if isinstance(level, str):
+            level = logger.level(level).no
+        return start, end, level
+
+
+def _parse_text_timestamp(line: str) -> Optional[float]:
+    try:
+        return datetime.datetime.strptime(line[:23], _TEXT_TIME_FORMAT).timestamp()
+    except ValueError:
+        # Continuation lines, e.g. tracebacks.
+        return None
@@ -1,11 +1,16 @@
+import atexit
 import logging
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
-from typing import TextIO, Tuple, Union
+from typing import Callable, Dict, List, Optional, TextIO, Tuple, Union
 
 from loguru import logger
 
 from covid_shared import paths
+from covid_shared.cli_tools.log_files import LogFile, sync_log_files
 from covid_shared.shell_tools import mkdir
 
 JOBMON_LOGGING_LEVEL = 5  # A lower level than logging.DEBUG.
@@ -21,9 +26,22 @@ LOG_FORMATS = {
     2: ("DEBUG", DEFAULT_LOG_MESSAGING_FORMAT),
     3: (JOBMON_LOGGING_LEVEL, DEFAULT_LOG_MESSAGING_FORMAT),
 }
+DEFAULT_LOG_QUEUE_SIZE = 10_000
+DEFAULT_LOG_BATCH_SIZE = 500
+DEFAULT_LOG_FLUSH_INTERVAL = 1.0  # seconds
 
+# The log directory of the run, once logging to files is configured.
+_LOG_DIRECTORY: Optional[Path] = None
 
-def configure_logging_to_terminal(verbose: int) -> None:
+
+def get_log_directory() -> Optional[Path]:
+    """Get the directory log files are written to, if logging to files."""
+    return _LOG_DIRECTORY
+
+
+def configure_logging_to_terminal(
+    verbose: int, jobmon_summary_interval: Optional[float] = None
+) -> None:
     """Setup logging to sys.stdout.
 
     This is presumed to be one of the first calls made in an
@@ -31,40 +49,88 @@ def configure_logging_to_terminal(verbose: int) -> None:
     call won't be intercepted or handled with the standard
     logging configuration.
 
+    Parameters
+    ----------
+    verbose
+        The logging verbosity.
+    jobmon_summary_interval
+        If provided, uninteresting jobmon messages are summarized at most
+        once per this many seconds rather than logged individually.
+
     """
     logger.remove(0)  # Clear default configuration
     level = LOG_FORMATS.get(verbose, LOG_FORMATS[max(LOG_FORMATS.keys())])[0]
-    intercept_jobmon_logs(level)
+    intercept_jobmon_logs(level, jobmon_summary_interval)
     add_logging_sink(sys.stdout, verbose, colorize=True)
 
 
-def configure_logging_to_files(output_path: Path) -> None:
+def configure_logging_to_files(
+    output_path: Path,
+    asynchronous: bool = False,
+    max_queue_size: int = DEFAULT_LOG_QUEUE_SIZE,
+    drop_on_overflow: bool = False,
+    rotation: Union[int, str] = None,
+    compression: str = None,
+    retention: int = None,
+) -> None:
     """Sets up logging to a file in an output directory.
 
     Logs to files are done with the highest verbosity to allow
     for debugging if necessary.
 
+    Parameters
+    ----------
+    output_path
+        The run directory. Logs are written to its log subdirectory.
+    asynchronous
+        Whether to write log files from a background thread so that
+        logging calls don't block on file system writes. Queued messages
+        are flushed by :func:`finish_application`.
+    max_queue_size
+        The maximum number of messages waiting to be written per log
+        file when logging asynchronously.
+    drop_on_overflow
+        Whether to drop new messages when the queue is full rather than
+        blocking until there is space when logging asynchronously.
+    rotation
+        The size at which log files are rotated, in bytes or as a string
+        like ``"500 MB"``. Log files are never rotated by default.
+    compression
+        Compression for rotated log files, either ``"gz"`` or ``"zst"``.
+    retention
+        The maximum number of rotated segments of each log file to keep.
+
     """
+    global _LOG_DIRECTORY
     log_path = output_path / paths.LOG_DIR
     mkdir(log_path, exists_ok=True)
-    add_logging_sink(
-        output_path / paths.LOG_DIR / paths.DETAILED_LOG_FILE_NAME,
-        verbose=3,
-        serialize=True,
-    )
-    add_logging_sink(
-        output_path / paths.LOG_DIR / paths.LOG_FILE_NAME,
-        verbose=3,
-    )
+    _LOG_DIRECTORY = log_path
+    sinks = [
+        (log_path / paths.DETAILED_LOG_FILE_NAME, True),
+        (log_path / paths.LOG_FILE_NAME, False),
+    ]
+    managed_file = any(option is not None for option in (rotation, compression, retention))
+    for sink_path, serialize in sinks:
+        if asynchronous or managed_file:
+            log_file = LogFile(sink_path, rotation, compression, retention)
+            if asynchronous:
+                sink = QueuedFileSink(log_file, max_queue_size, drop_on_overflow)
+            else:
+                sink = _ClosingSink(log_file.write, log_file.close)
+        else:
+            sink = sink_path
+        add_logging_sink(sink, verbose=3, serialize=serialize)
 
 
 def add_logging_sink(
-    sink: Union[TextIO, Path],
+    sink: Union[TextIO, Path, Callable[[str], None]],
     verbose: int,
     colorize: bool = False,
     serialize: bool = False,
 ) -> None:
     """Add a new output file handle for logging."""
+    if isinstance(sink, QueuedFileSink):
+        sink = _ClosingSink(sink, sink.close)
     level, message_format = LOG_FORMATS.get(verbose, LOG_FORMATS[max(LOG_FORMATS.keys())])
     logger.add(
         sink,
@@ -79,6 +145,191 @@ def add_logging_sink(
     )
 
 
+class _ClosingSink:
+    """Closes a sink when it's removed from the logger.
+
+    Loguru only stops sinks with a ``write`` method, so this wraps
+    callable sinks that hold files or threads.
+
+    """
+
+    def __init__(self, write: Callable[[str], None], close: Callable[[], None]):
+        self.write = write
+        self.stop = close
+
+
+class QueuedFileSink:
+    """Loguru sink that writes messages to a file from a background thread.
+
+    Logging calls only put the formatted message on a bounded queue. A
+    writer thread drains the queue and writes messages in batches,
+    flushing the file once per batch rather than once per message.
+
+    Parameters
+    ----------
+    path
+        The file to append log messages to. May also be a
+        :class:`LogFile` to write to a rotating log file.
+    max_queue_size
+        The maximum number of messages waiting to be written.
+    drop_on_overflow
+        If True, new messages are dropped when the queue is full. Otherwise
+        the logging call blocks until there is room in the queue.
+    batch_size
+        The maximum number of messages to write per flush.
+    flush_interval
+        The maximum time in seconds a message waits before being written.
+
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path, LogFile],
+        max_queue_size: int = DEFAULT_LOG_QUEUE_SIZE,
+        drop_on_overflow: bool = False,
+        batch_size: int = DEFAULT_LOG_BATCH_SIZE,
+        flush_interval: float = DEFAULT_LOG_FLUSH_INTERVAL,
+    ):
+        self._file = path if isinstance(path, LogFile) else LogFile(path)
+        self.path = self._file.path
+        self.drop_on_overflow = drop_on_overflow
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._batches = 0
+        self._enqueue_seconds = 0.0
+        self._blocked_seconds = 0.0
+        self._write_seconds = 0.0
+
+        self._writer = threading.Thread(
+            target=self._write_forever, name=f"log-writer-{self.path.name}", daemon=True
+        )
+        self._writer.start()
+        _QUEUED_SINKS.append(self)
+
+    def __call__(self, message: str) -> None:
+        if self._closed:
+            self._dropped += 1
+            return
+        start = time.perf_counter()
+        try:
+            self._queue.put_nowait(message)
+            self._enqueued += 1
+        except queue.Full:
+            if self.drop_on_overflow:
+                self._dropped += 1
+            else:
+                self._queue.put(message)
+                self._enqueued += 1
+                self._blocked_seconds += time.perf_counter() - start
+        self._enqueue_seconds += time.perf_counter() - start
+
+    def flush(self) -> None:
+        """Block until all messages queued so far are written to disk."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self) -> None:
+        """Write all queued messages and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+        if self in _QUEUED_SINKS:
+            _QUEUED_SINKS.remove(self)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Summarize the work done and the overhead imposed by the sink."""
+        return {
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "dropped": self._dropped,
+            "batches": self._batches,
+            "enqueue_seconds": round(self._enqueue_seconds, 4),
+            "blocked_seconds": round(self._blocked_seconds, 4),
+            "write_seconds": round(self._write_seconds, 4),
+        }
+
+    def _write_forever(self) -> None:
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch, waiting = [], []
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiting.append(item)
+                else:
+                    batch.append(item)
+                if not running or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+            for event in waiting:
+                event.set()
+
+    def _write_batch(self, batch: List[str]) -> None:
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            self._file.write_messages(batch)
+            self._file.flush()
+        except Exception as e:  # Don't let the writer thread die.
+            print(f"Failed to write log messages to {self.path}: {e}", file=sys.stderr)
+        self._written += len(batch)
+        self._batches += 1
+        self._write_seconds += time.perf_counter() - start
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+
+_QUEUED_SINKS: List[QueuedFileSink] = []
+
+
+def flush_logging_sinks() -> Optional[Dict[str, Dict[str, Union[int, float]]]]:
+    """Flush all asynchronous logging sinks and managed log files.
+
+    Returns
+    -------
+    Optional[Dict[str, Dict[str, Union[int, float]]]]
+        Sink statistics keyed by log file path or None if there are no
+        asynchronous logging sinks.
+
+    """
+    for sink in _QUEUED_SINKS:
+        sink.flush()
+    sync_log_files()
+    if not _QUEUED_SINKS:
+        return None
+    return {str(sink.path): sink.stats() for sink in _QUEUED_SINKS}
+
+
+@atexit.register
+def _close_logging_sinks() -> None:
+    for sink in list(_QUEUED_SINKS):
+        sink.close()
+
+
 class JobmonInterceptHandler(logging.Handler):
     """Intercepts and handles logging messages from jobmon.
 
@@ -89,14 +340,27 @@ class JobmonInterceptHandler(logging.Handler):
     of jobmon log messages in order to suppress uninteresting
     messages and to summarize status information.
 
-    The original messages are still emitted at the
-    JOBMON_LOGGING_LEVEL for debugging purposes.
+    Messages are routed by the logger name and the function that logged
+    them. Routes are looked up once per (logger name, function) pair and
+    then cached, so the handler does very little work per message.
+
+    The original messages of filtered and summarized records are still
+    emitted at the JOBMON_LOGGING_LEVEL for debugging purposes. If a
+    ``summary_interval`` is provided, they are instead counted and a
+    summary of the filtered messages is emitted at most once per interval.
 
-    As the core loop of jobmon is multithreaded, there is technically
-    a race condition here as we could be asked to process a second
-    message before we've finished the first. In practice, the
-    processing here is so fast and the core jobmon loop sleeps
-    so long that we'll never have an issue.
+    As the core loop of jobmon is multithreaded, we may be asked to
+    process a second message before we've finished the first. The
+    ``logging.Handler`` lock serializes calls to ``emit`` so the routing
+    cache and summary counts are safe to update.
+
+    Parameters
+    ----------
+    level
+        The minimum level of messages to handle.
+    summary_interval
+        If provided, the minimum number of seconds between summaries of
+        filtered messages.
 
     """
 
@@ -104,97 +368,160 @@ class JobmonInterceptHandler(logging.Handler):
     _FILTER = 0
     _LIFT = 1
     _RE_EMIT = 2
+    _PARSE = 3  # Strategy depends on the message content.
+
+    _DISTRIBUTOR_LOGGER = "jobmon.client.distributor.distributor_service"
+    # Mapping of logger_name to the functions whose messages we drop, where
+    # logger_name is usually the name of the module being logged from
+    # (though occasionally a module higher in the call stack) and each
+    # function is the function or method that is logging a message.
+    _DROP_FUNCTIONS = {
+        "jobmon.client.workflow": frozenset(["add_task", "_distributor_alive"]),
+        _DISTRIBUTOR_LOGGER: frozenset(
+            [
+                "_create_task_instance",
+                "_keep_distributing",
+                "heartbeat",
+                "_get_lost_task_instances",
+                "_distribute_forever",
+            ]
+        ),
+    }
+    # Drop any messages from these functions regardless of where they're
+    # called from.
+    _DROP_ANYWHERE = frozenset(["_send_request", "is_5XX"])
+    # Loggers whose messages we need to look at to decide what to do.
+    _PARSE_LOGGERS = frozenset([_DISTRIBUTOR_LOGGER])
+
+    def __init__(
+        self,
+        level: Union[str, int] = logging.NOTSET,
+        summary_interval: Optional[float] = None,
+    ):
+        super().__init__(level)
+        self.summary_interval = summary_interval
+        self._routes: Dict[Tuple[str, str], int] = {}
+        self._levels: Dict[str, Union[int, str]] = {}
+        self._suppressed: Dict[Tuple[str, str], int] = {}
+        self._last_summary = time.monotonic()
 
     def emit(self, record: logging.LogRecord) -> None:
-        # Grab some metadata about the record.
-        level, depth = self._get_level_and_depth(record)
+        # If it's more important than an INFO message just re-emit.
+        if record.levelno > logging.INFO:
+            strategy = self._RE_EMIT
+        else:
+            key = (record.name, record.funcName)
+            strategy = self._routes.get(key)
+            if strategy is None:
+                strategy = self._routes[key] = self._route(*key)
+
+        original_message = record.getMessage()
+        if strategy == self._PARSE:
+            message, strategy = self._parse_message(record.name, original_message)
+        else:
+            message = original_message
 
-        # Parse/filter the message. Filtered messages
-        message, log_strategy = self._get_message_and_strategy(record)
+        if strategy == self._RE_EMIT:
+            # The re-emitted message is the original, so there is no need
+            # to log it again at the jobmon logging level.
+            logger.opt(depth=self._get_depth(), exception=record.exc_info).log(
+                self._get_level(record), message
+            )
+            return
 
-        if log_strategy == self._FILTER:
-            pass
-        elif log_strategy == self._LIFT:
+        if strategy == self._LIFT:
             logger.info(message)
-        else:  # log_strategy == self._RE_EMIT
-            logger.opt(depth=depth, exception=record.exc_info).log(level, message)
-
-        # Finally, relog the original at the jobmon logging level.
-        original_message = record.getMessage()
-        logger.opt(depth=depth, exception=record.exc_info).log(
-            JOBMON_LOGGING_LEVEL, original_message
-        )
 
-    def _get_message_and_strategy(self, record: logging.LogRecord) -> Tuple[str, int]:
-        # If it's more important than an INFO message just re-emit.
-        if record.levelno > logging.INFO:
-            return record.getMessage(), self._RE_EMIT
-        elif self._should_drop(record):
-            return record.getMessage(), self._FILTER
+        if self.summary_interval is None:
+            logger.opt(depth=self._get_depth(), exception=record.exc_info).log(
+                JOBMON_LOGGING_LEVEL, original_message
+            )
+        else:
+            key = (record.name, record.funcName)
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            if time.monotonic() - self._last_summary >= self.summary_interval:
+                self._emit_summary()
+
+    def close(self) -> None:
+        if self._suppressed:
+            self._emit_summary()
+        super().close()
+
+    def _route(self, logger_name: str, function_name: str) -> int:
+        if function_name in self._DROP_ANYWHERE:
+            return self._FILTER
+        elif function_name in self._DROP_FUNCTIONS.get(logger_name, ()):
+            return self._FILTER
+        elif logger_name in self._PARSE_LOGGERS:
+            return self._PARSE
         else:
-            return self._parse_record(record)
-
-    def _should_drop(self, record: logging.LogRecord) -> bool:
-        # drop_list is tuples of (logger_name, [ignore_functions])
-        # where logger_name is usually the name of the module
-        # being logged from (though occasionally a module
-        # higher in the call stack) and each ignore_function is
-        # the function or method that is logging a message.
-        drop_list = (
-            ("jobmon.client.workflow", ["add_task", "_distributor_alive"]),
-            (
-                "jobmon.client.distributor.distributor_service",
-                [
-                    "_create_task_instance",
-                    "_keep_distributing",
-                    "heartbeat",
-                    "_get_lost_task_instances",
-                    "_distribute_forever",
-                ],
-            ),
-            # Finally, drop any messages from these functions
-            # regardless of where they're called from.
-            (record.name, ["_send_request", "is_5XX"]),
+            return self._RE_EMIT
+
+    def _parse_message(self, logger_name: str, msg: str) -> Tuple[str, int]:
+        # We only parse distributor messages right now. We don't want these
+        # messages, but we want what's in some of them.
+        if "active distributor_ids:" in msg:
+            # This updates every 30s, which is a reasonable
+            # frequency to log the workflow status.
+            queued_or_running = msg.count(",") + 1
+            # Imported here as only workflow runs produce these messages.
+            from covid_shared.workflow.progress import get_active_reporter
+
+            reporter = get_active_reporter()
+            if reporter is not None:
+                reporter.set_active(queued_or_running)
+            return f"Queued or running: {queued_or_running}", self._LIFT
+        return msg, self._FILTER
+
+    def _emit_summary(self) -> None:
+        total = sum(self._suppressed.values())
+        counts = ", ".join(
+            f"{name}:{function}={count}"
+            for (name, function), count in sorted(
+                self._suppressed.items(), key=lambda item: item[1], reverse=True
+            )
         )
-        for logger_name, ignore_functions in drop_list:
-            if record.name == logger_name and record.funcName in ignore_functions:
-                return True
-        return False
-
-    def _parse_record(self, record: logging.LogRecord) -> Tuple[str, int]:
-        msg = record.getMessage()
-        strategy = self._RE_EMIT
-
-        if record.name == "jobmon.client.distributor.distributor_service":
-            # Couldn't filter these before without looking in the message.
-            strategy = self._FILTER
-            # We don't want these messages, but we want what's in them.
-            if "active distributor_ids:" in msg:
-                queued_or_running = str(len(msg.split(",")))
-                # This updates every 30s, which is a reasonable
-                # frequency to log the workflow status.
-                msg = f"Queued or running: {queued_or_running}"
-                strategy = self._LIFT
-
-        return msg, strategy
+        logger.log(JOBMON_LOGGING_LEVEL, f"Suppressed {total} jobmon messages: {counts}")
+        self._suppressed = {}
+        self._last_summary = time.monotonic()
+
+    def _get_level(self, record: logging.LogRecord) -> Union[int, str]:
+        level = self._levels.get(record.levelname)
+        if level is None:
+            try:
+                level = logger.level(record.levelname).name
+            except ValueError:
+                level = record.levelno
+            self._levels[record.levelname] = level
+        return level
 
     @staticmethod
-    def _get_level_and_depth(record: logging.LogRecord) -> Tuple[Union[int, str], int]:
-        try:
-            level = logger.level(record.levelname).name
-        except ValueError:
-            level = record.levelno
-
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
+    def _get_depth() -> int:
+        # Walk from the caller of emit out of the logging module to find
+        # the frame that made the original logging call. Depth is relative
+        # to emit, which is where we call into loguru.
+        frame, depth = sys._getframe(2), 1
+        while frame is not None and frame.f_code.co_filename == logging.__file__:
             frame = frame.f_back
             depth += 1
-        return level, depth
+        return depth
+
 
+def intercept_jobmon_logs(
+    level: Union[str, int], summary_interval: Optional[float] = None
+) -> None:
+    """Add a handler to all the jobmon loggers to intercept and filter/parse the messages.
+
+    Parameters
+    ----------
+    level
+        The minimum level of messages to handle.
+    summary_interval
+        If provided, filtered messages are summarized at most once per
+        this many seconds instead of being logged individually.
 
-def intercept_jobmon_logs(level: Union[str, int]) -> None:
-    """Add a handler to all the jobmon loggers to intercept and filter/parse the messages."""
-    handler = JobmonInterceptHandler(level)
+    """
+    handler = JobmonInterceptHandler(level, summary_interval)
     for name, logger_ in logging.Logger.manager.loggerDict.items():
         if "jobmon" in name and not isinstance(logger_, logging.PlaceHolder):
             logger_.handlers = [handler]
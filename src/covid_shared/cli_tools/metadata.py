@@ -1,20 +1,27 @@
 import datetime
 import functools
+import hashlib
+import inspect
 import sys
+import threading
 import time
 import traceback
 import types
 import typing
 from bdb import BdbQuit
-from pathlib import Path
+from pathlib import Path, PurePath
 from pprint import pformat
-from typing import Any, Callable, Dict, Mapping, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Mapping, Optional, Union
 
-import click
-import yaml
 from loguru import logger
 
 from covid_shared import paths
+from covid_shared.cli_tools import tracing
+from covid_shared.parallel import get_memory_peak_gb, get_process_tree_rss_gb
+
+if TYPE_CHECKING:
+    # NumPy is only needed here for annotations.
+    import numpy as np
 
 
 class YamlIOMixin:
@@ -22,10 +29,14 @@ class YamlIOMixin:
 
     @staticmethod
     def _load(in_file: typing.TextIO) -> Dict:
+        import yaml
+
         return yaml.load(in_file)
 
     @staticmethod
     def _write(data: Dict[str, Any], out_file: typing.TextIO):
+        import yaml
+
         yaml.dump(data, out_file)
 
 
@@ -59,6 +70,10 @@ class Metadata:
         """Give back a dict version of the metadata."""
         return self._metadata.copy()
 
+    def get(self, metadata_key: str, default: Any = None):
+        """Dictionary style lookup of metadata with a default."""
+        return self._metadata.get(metadata_key, default)
+
     def __getitem__(self, metadata_key: str):
         return self._metadata[metadata_key]
 
@@ -105,20 +120,113 @@ class RunMetadata(Metadata, YamlIOMixin):
 
     def update_from_file(self, metadata_key: str, metadata_file: typing.TextIO):
         """Loads a metadata file from disk and stores it in the key."""
+        import yaml
+
         self._metadata[metadata_key] = yaml.full_load(metadata_file)
 
     def dump(self, metadata_file_path: Union[str, Path]):
         self._metadata["run_time"] = f"{time.time() - self._start:.2f} seconds"
+        resource_usage = get_resource_usage(self._start)
+        if resource_usage is not None:
+            self._metadata["resource_usage"] = resource_usage
         try:
             with Path(metadata_file_path).open("w") as metadata_file:
                 self._write(self._metadata, metadata_file)
         except FileNotFoundError:
+            import click
+
             logger.warning(
                 f"Output directory for {metadata_file.name} does not exist. Dumping metadata to console."
             )
             click.echo(pformat(self._metadata))
 
 
+MEMORY_SAMPLE_INTERVAL = 5.0  # seconds
+
+
+class _MemorySampler:
+    """Tracks the peak resident memory of this process and its children."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.peak_gb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+        self._thread.start()
+
+    def sample(self) -> float:
+        """Take a sample and return the peak memory so far, in GB."""
+        self.peak_gb = max(self.peak_gb, get_process_tree_rss_gb())
+        return self.peak_gb
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+_MEMORY_SAMPLER: Optional[_MemorySampler] = None
+
+
+def start_memory_sampler(interval: float = MEMORY_SAMPLE_INTERVAL) -> None:
+    """Sample the memory of this process and its children in the background.
+
+    Only needed where the peak memory of the job can't be read from its
+    cgroup (see :func:`get_resource_usage`). Safe to call more than once.
+
+    """
+    global _MEMORY_SAMPLER
+    if _MEMORY_SAMPLER is None and get_memory_peak_gb() is None:
+        _MEMORY_SAMPLER = _MemorySampler(interval)
+
+
+def get_resource_usage(start_time: float) -> Optional[Dict[str, Any]]:
+    """Get the wall time, cpu time, and peak memory of this process and its
+    children since a start time.
+
+    The peak memory is that of the job's cgroup when available, which
+    covers concurrent worker processes. Otherwise it is the larger of the
+    peak of any single process and the sampled memory of the whole process
+    tree (see :func:`start_memory_sampler`). Sampling can miss short
+    spikes, so the fallback is flagged as a lower bound.
+
+    Returns None on platforms without the ``resource`` module.
+
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = [
+        resource.getrusage(resource.RUSAGE_SELF),
+        resource.getrusage(resource.RUSAGE_CHILDREN),
+    ]
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere.
+    max_rss_bytes = max(u.ru_maxrss for u in usage) * (
+        1 if sys.platform == "darwin" else 1024
+    )
+    max_rss_gb = get_memory_peak_gb()
+    if max_rss_gb is not None:
+        max_rss_source = "cgroup"
+    else:
+        max_rss_source = "process_tree_samples"
+        sampled_gb = (
+            _MEMORY_SAMPLER.sample()
+            if _MEMORY_SAMPLER is not None
+            else get_process_tree_rss_gb()
+        )
+        max_rss_gb = max(max_rss_bytes / 1024**3, sampled_gb)
+    return {
+        "wall_seconds": round(time.time() - start_time, 2),
+        "cpu_seconds": round(sum(u.ru_utime + u.ru_stime for u in usage), 2),
+        "max_rss_gb": round(max_rss_gb, 4),
+        "max_rss_source": max_rss_source,
+        "max_rss_lower_bound": max_rss_source != "cgroup",
+    }
+
+
 def monitor_application(
     func: types.FunctionType,
     logger_: Any,
@@ -130,6 +238,10 @@ def monitor_application(
     Catches records them if they occur. Can also be configured to drop
     a user into an interactive debugger on failure.
 
+    If the application runs as a traced workflow task, its start, end,
+    and resource usage are recorded in the trace (see
+    :mod:`covid_shared.cli_tools.tracing`).
+
     Parameters
     ----------
     func
@@ -149,6 +261,14 @@ def monitor_application(
     @functools.wraps(func)
     def _wrapped(*args, **kwargs):
         result = None
+        start = time.time()
+        trace_context = tracing.get_trace_context()
+        trace_path = None
+        if trace_context is not None:
+            start_memory_sampler()
+            if not trace_context["task_name"]:
+                trace_context = {**trace_context, "task_name": func.__name__}
+            trace_path = _record_trace(trace_context, {"start": start}, func)
         try:
             # Record arguments for the run and inject the metadata
             app_metadata["main_function"] = f"{func.__module__}:{func.__name__}"
@@ -176,11 +296,33 @@ def monitor_application(
                 traceback.print_exc()
                 pdb.post_mortem()
         finally:
+            if trace_context is not None:
+                record = {
+                    "start": start,
+                    "end": time.time(),
+                    "success": app_metadata.get("success", False),
+                    **(get_resource_usage(start) or {}),
+                }
+                _record_trace(trace_context, record, func, trace_path)
             return app_metadata, result
 
     return _wrapped
 
 
+def _record_trace(
+    trace_context: Dict[str, str],
+    record: Dict[str, Any],
+    func: types.FunctionType,
+    path: Optional[Path] = None,
+) -> Optional[Path]:
+    record = {"main_function": f"{func.__module__}:{func.__name__}", **record}
+    try:
+        return tracing.record_task_trace(trace_context, record, path)
+    except OSError as e:
+        logger.warning(f"Could not record task trace: {e}")
+        return None
+
+
 def handle_exceptions(func: Callable, logger_: Any, with_debugger: bool) -> Callable:
     """Drops a user into an interactive debugger if func raises an error."""
 
@@ -213,13 +355,119 @@ def update_with_previous_metadata(run_metadata: RunMetadata, input_root: Path) -
 
 
 def get_function_full_argument_mapping(func: types.FunctionType, *args, **kwargs) -> Dict:
-    """Get a dict representation of all args and kwargs for a function."""
+    """Get a dict representation of all args and kwargs for a function.
+
+    Arguments are recorded with :func:`summarize_argument` so that large
+    data arguments don't bloat the metadata.
+
+    """
+    # Look through decorators like `add_profiler` that wrap the function.
+    func = inspect.unwrap(func)
     # Grab all variables in the enclosing namespace.  Args will be first.
     # Note: This may rely on the CPython implementation.  Not sure.
     arg_names = func.__code__.co_varnames
-    arg_vals = [str(arg) for arg in args]
+    arg_vals = [summarize_argument(arg) for arg in args]
     # Zip ignores extra items in the second arg.  Use that property to catch
     # all positional args and ignore kwargs.
     run_args = dict(zip(arg_names, arg_vals))
-    run_args.update({k: str(v) for k, v in kwargs.items()})
+    run_args.update({k: summarize_argument(v) for k, v in kwargs.items()})
     return run_args
+
+
+# Caps that keep argument summaries cheap regardless of the argument size.
+MAX_ARGUMENT_LENGTH = 1000
+MAX_SUMMARY_ITEMS = 100
+MAX_HASHED_VALUES = 4096
+
+
+def summarize_argument(value: Any) -> str:
+    """Summarize a function argument for provenance.
+
+    Paths are resolved. NumPy arrays and pandas objects are summarized by
+    their type, shape, dtypes, and a hash of a fixed size sample of their
+    values rather than rendered in full. Large containers are summarized
+    by their length. Everything else is converted to a string and
+    truncated to ``MAX_ARGUMENT_LENGTH`` characters.
+
+    Hashes use ``xxhash`` if it is installed and ``blake2b`` otherwise.
+    As only a sample of the values is hashed, different data can share a
+    hash, but a changed hash always means changed data.
+
+    """
+    module = type(value).__module__.split(".")[0]
+    if isinstance(value, PurePath):
+        return str(Path(value).resolve())
+    elif module == "numpy" and hasattr(value, "shape"):
+        return (
+            f"ndarray(shape={value.shape}, dtype={value.dtype}, "
+            f"hash={_hash_sample(value, [_sample_array(value)])})"
+        )
+    elif module == "pandas" and hasattr(value, "shape"):
+        return _summarize_pandas(value)
+    elif isinstance(value, (list, tuple, set, frozenset, dict)) and (
+        len(value) > MAX_SUMMARY_ITEMS
+    ):
+        return f"{type(value).__name__}(len={len(value)})"
+
+    summary = str(value)
+    if len(summary) > MAX_ARGUMENT_LENGTH:
+        summary = f"{summary[:MAX_ARGUMENT_LENGTH]}... ({len(summary)} characters)"
+    return summary
+
+
+def _summarize_pandas(value: Any) -> str:
+    name = type(value).__name__
+    positions = _sample_positions(len(value))
+    if hasattr(value, "columns"):
+        num_columns = min(len(value.columns), MAX_SUMMARY_ITEMS)
+        dtypes = {
+            str(column): str(dtype)
+            for column, dtype in zip(value.columns[:num_columns], value.dtypes)
+        }
+        if len(value.columns) > num_columns:
+            dtypes["..."] = f"{len(value.columns) - num_columns} more columns"
+        samples = [_sample_array(value.index[positions].to_numpy())]
+        samples.extend(
+            _sample_array(value.iloc[positions, i].to_numpy()) for i in range(num_columns)
+        )
+        description = f"dtypes={dtypes}"
+    elif hasattr(value, "index"):
+        samples = [
+            _sample_array(value.index[positions].to_numpy()),
+            _sample_array(value.iloc[positions].to_numpy()),
+        ]
+        description = f"dtype={value.dtype}"
+    else:
+        samples = [_sample_array(value[positions].to_numpy())]
+        description = f"dtype={value.dtype}"
+    return f"{name}(shape={value.shape}, {description}, hash={_hash_sample(value, samples)})"
+
+
+def _sample_positions(size: int) -> "np.ndarray":
+    import numpy as np
+
+    if size <= MAX_HASHED_VALUES:
+        return np.arange(size)
+    return np.linspace(0, size - 1, MAX_HASHED_VALUES).astype(np.int64)
+
+
+def _sample_array(array: "np.ndarray") -> bytes:
+    """Get the bytes of an evenly spaced sample of an array's values."""
+    sample = array.flat[_sample_positions(array.size)]
+    if sample.dtype.hasobject:
+        # Object arrays hold pointers, so hash the values instead.
+        return repr(sample.tolist()).encode()
+    return sample.tobytes()
+
+
+def _hash_sample(value: Any, samples: List[bytes]) -> str:
+    try:
+        import xxhash
+
+        digest = xxhash.xxh3_64()
+    except ImportError:
+        digest = hashlib.blake2b(digest_size=8)
+    digest.update(repr((type(value).__name__, value.shape)).encode())
+    for sample in samples:
+        digest.update(sample)
+    return digest.hexdigest()
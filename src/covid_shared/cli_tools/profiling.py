@@ -0,0 +1,302 @@
+"""Tools for profiling application entry points.
+
+The default profiler is a statistical sampler that periodically snapshots
+the stack of the thread that started it from a background thread. This
+keeps overhead low enough to leave on for full production-sized runs.
+The samples are written as collapsed stacks for flamegraph tools and as a
+pstats file for ``pstats``/snakeviz, with times estimated from the sample
+counts. ``cProfile`` can additionally be enabled when exact call counts
+and times are needed at the cost of much higher overhead.
+
+"""
+import collections
+import cProfile
+import marshal
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Counter, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from covid_shared import paths
+from covid_shared.shell_tools import mkdir
+
+PROFILE_MODES = ("sample", "cprofile")
+DEFAULT_SAMPLE_INTERVAL = 0.01  # seconds
+DEFAULT_TOP_FUNCTIONS = 25
+
+_Stack = Tuple[Tuple[str, str, int], ...]
+
+_ACTIVE_PROFILER: Optional["ApplicationProfiler"] = None
+
+
+class _StackSampler(threading.Thread):
+    """Background thread that periodically records the stack of another thread.
+
+    Stacks are recorded as tuples of code objects and only rendered into
+    strings once sampling is finished so each sample is cheap.
+
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="covid-shared-stack-sampler", daemon=True)
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.samples: Counter[tuple] = collections.Counter()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def rendered_samples(self) -> Counter[_Stack]:
+        rendered = collections.Counter()
+        for stack, count in self.samples.items():
+            rendered[tuple(_describe_code(code) for code in stack)] += count
+        return rendered
+
+
+def _describe_code(code) -> Tuple[str, str, int]:
+    name = getattr(code, "co_qualname", code.co_name)
+    return code.co_filename, name, code.co_firstlineno
+
+
+class ApplicationProfiler:
+    """Profiles the thread that starts it.
+
+    Parameters
+    ----------
+    mode
+        One of ``"sample"`` or ``"cprofile"``. The stack sampler runs in
+        both modes. In ``"sample"`` mode the pstats file is estimated from
+        the samples. In ``"cprofile"`` mode the deterministic profiler is
+        enabled as well and writes the pstats file instead.
+    interval
+        Time in seconds between stack samples.
+
+    """
+
+    def __init__(self, mode: str = "sample", interval: float = DEFAULT_SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(
+                f"Unknown profile mode {mode}. Mode must be one of {PROFILE_MODES}."
+            )
+        self.mode = mode
+        self.interval = interval
+        self._sampler = None
+        self._cprofile = None
+        self._start = None
+        self._wall_time = None
+        self.summary = None
+
+    @property
+    def running(self) -> bool:
+        return self._sampler is not None and self._wall_time is None
+
+    def start(self) -> None:
+        """Begin profiling the calling thread."""
+        global _ACTIVE_PROFILER
+        if _ACTIVE_PROFILER is not None:
+            raise RuntimeError("An application profiler is already running.")
+        _ACTIVE_PROFILER = self
+        self._start = time.perf_counter()
+        self._sampler = _StackSampler(threading.get_ident(), self.interval)
+        self._sampler.start()
+        if self.mode == "cprofile":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self) -> None:
+        """Stop profiling. Safe to call more than once."""
+        global _ACTIVE_PROFILER
+        if not self.running:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._sampler.stop()
+        self._wall_time = time.perf_counter() - self._start
+        if _ACTIVE_PROFILER is self:
+            _ACTIVE_PROFILER = None
+
+    def finish(
+        self, output_dir: Path, top_n: int = DEFAULT_TOP_FUNCTIONS
+    ) -> Dict[str, object]:
+        """Stop profiling, write profile files, and summarize the results.
+
+        Parameters
+        ----------
+        output_dir
+            Directory to write profile output files to.
+        top_n
+            Number of functions to include in the summary.
+
+        Returns
+        -------
+        Dict[str, object]
+            A summary of the profile suitable for recording in metadata.
+
+        """
+        self.stop()
+        if self.summary is not None:
+            return self.summary
+        output_dir = Path(output_dir)
+        mkdir(output_dir, exists_ok=True, parents=True)
+
+        samples = self._sampler.rendered_samples()
+        stacks_path = output_dir / paths.PROFILE_STACKS_FILE_NAME
+        write_collapsed_stacks(samples, stacks_path)
+        files = {"collapsed_stacks": str(stacks_path)}
+
+        stats_path = output_dir / paths.PROFILE_STATS_FILE_NAME
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(str(stats_path))
+        else:
+            write_sampled_pstats(samples, self.interval, stats_path)
+        files["pstats"] = str(stats_path)
+
+        self.summary = {
+            "mode": self.mode,
+            "wall_time": f"{self._wall_time:.2f} seconds",
+            "sample_interval": self.interval,
+            "samples": sum(samples.values()),
+            "files": files,
+            "top_functions": summarize_samples(samples, top_n),
+        }
+        return self.summary
+
+    def __enter__(self) -> "ApplicationProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+
+def get_active_profiler() -> Optional[ApplicationProfiler]:
+    """Get the currently running application profiler, if any."""
+    return _ACTIVE_PROFILER
+
+
+def write_collapsed_stacks(samples: Counter[_Stack], output_path: Path) -> None:
+    """Write stack samples in the collapsed format used by flamegraph tools.
+
+    Each line is a semicolon-separated stack, outermost frame first, followed
+    by a space and the number of times the stack was sampled. The output can
+    be passed directly to ``flamegraph.pl`` or loaded into speedscope.
+
+    """
+    with Path(output_path).open("w") as stacks_file:
+        for stack, count in samples.most_common():
+            frames = ";".join(_format_frame(frame) for frame in stack)
+            stacks_file.write(f"{frames} {count}\n")
+
+
+def write_sampled_pstats(
+    samples: Counter[_Stack], interval: float, output_path: Path
+) -> None:
+    """Write stack samples as a file readable by :class:`pstats.Stats`.
+
+    Times are the sample counts multiplied by the sampling interval. The
+    samples don't record calls, so call counts are sample counts too and
+    only show how often a function or call edge was seen.
+
+    """
+    # pstats keys functions by (filename, line, name) and maps each to
+    # (primitive calls, calls, self time, total time, callers).
+    self_counts = collections.Counter()
+    total_counts = collections.Counter()
+    edge_self_counts = collections.Counter()
+    edge_total_counts = collections.Counter()
+    for stack, count in samples.items():
+        functions = [(filename, line, name) for filename, name, line in stack]
+        self_counts[functions[-1]] += count
+        for function in set(functions):
+            total_counts[function] += count
+        if len(functions) > 1:
+            edge_self_counts[functions[-2], functions[-1]] += count
+        for edge in set(zip(functions, functions[1:])):
+            edge_total_counts[edge] += count
+
+    callers = collections.defaultdict(dict)
+    for (caller, callee), count in edge_total_counts.items():
+        callers[callee][caller] = (
+            count,
+            count,
+            edge_self_counts[caller, callee] * interval,
+            count * interval,
+        )
+    stats = {
+        function: (
+            count,
+            count,
+            self_counts[function] * interval,
+            count * interval,
+            callers[function],
+        )
+        for function, count in total_counts.items()
+    }
+    with Path(output_path).open("wb") as stats_file:
+        marshal.dump(stats, stats_file)
+
+
+def summarize_samples(samples: Counter[_Stack], top_n: int) -> List[Dict[str, object]]:
+    """Summarize the functions that show up most often in the stack samples.
+
+    Self time counts the samples where a function was executing. Total
+    time counts the samples where a function was anywhere on the stack.
+
+    """
+    total_samples = sum(samples.values())
+    if not total_samples:
+        return []
+    self_counts = collections.Counter()
+    total_counts = collections.Counter()
+    for stack, count in samples.items():
+        self_counts[stack[-1]] += count
+        for frame in set(stack):
+            total_counts[frame] += count
+
+    summary = []
+    for frame, count in total_counts.items():
+        summary.append(
+            {
+                "function": _format_frame(frame),
+                "self_pct": round(100 * self_counts[frame] / total_samples, 2),
+                "total_pct": round(100 * count / total_samples, 2),
+            }
+        )
+    summary = sorted(summary, key=lambda f: (f["self_pct"], f["total_pct"]), reverse=True)
+    return summary[:top_n]
+
+
+def _format_frame(frame: Tuple[str, str, int]) -> str:
+    filename, name, line = frame
+    return f"{filename}:{name}:{line}".replace(";", ":").replace(" ", "_")
+
+
+def finish_profiling(run_directory: Path) -> Optional[Dict[str, object]]:
+    """Write the results of the active profiler to the run's log directory.
+
+    Returns
+    -------
+    Optional[Dict[str, object]]
+        A profile summary, or None if no profiler is running.
+
+    """
+    profiler = get_active_profiler()
+    if profiler is None:
+        return None
+    logger.info("Writing application profile.")
+    return profiler.finish(Path(run_directory) / paths.LOG_DIR)
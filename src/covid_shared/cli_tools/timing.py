@@ -0,0 +1,271 @@
+"""Lightweight timing of named and nested sections of an application.
+
+Sections are timed with the :func:`span` context manager or the
+:func:`timed` decorator. Spans nest within a thread, so a span named
+``"fit"`` opened inside a span named ``"model"`` is recorded under the
+path ``"model/fit"``.
+
+Timings are aggregated per span path rather than stored individually,
+so spans are safe to use inside loops. Only the first few occurrences of
+each span path are logged. For very hot loops, ``sample_every`` can be
+used to time only a fraction of the iterations.
+
+"""
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from loguru import logger
+
+DEFAULT_LOGGED_PER_SPAN = 5
+
+_Number = Union[int, float]
+
+
+class _SpanStats:
+    """Aggregate statistics for a single span path."""
+
+    __slots__ = ("calls", "timed", "total", "min", "max", "counters")
+
+    def __init__(self):
+        self.calls = 0
+        self.timed = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.counters: Dict[str, _Number] = {}
+
+    def to_dict(self) -> Dict[str, object]:
+        mean = self.total / self.timed if self.timed else 0.0
+        summary = {
+            "calls": self.calls,
+            "total_seconds": round(mean * self.calls, 4),
+            "mean_seconds": round(mean, 6),
+            "min_seconds": round(self.min, 6) if self.timed else 0.0,
+            "max_seconds": round(self.max, 6),
+        }
+        if self.timed != self.calls:
+            summary["timed_calls"] = self.timed
+        if self.counters:
+            summary["counters"] = dict(self.counters)
+        return summary
+
+
+class Span:
+    """A single timed section. Produced by :meth:`SpanRecorder.span`."""
+
+    __slots__ = ("_recorder", "name", "path", "counters", "_start")
+
+    def __init__(self, recorder: "SpanRecorder", name: str, counters: Dict[str, _Number]):
+        self._recorder = recorder
+        self.name = name
+        self.path = name
+        self.counters = counters
+        self._start = 0.0
+
+    def add(self, counter: str, value: _Number = 1) -> None:
+        """Increment a counter attached to this span."""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def __enter__(self) -> "Span":
+        stack = self._recorder._stack()
+        if stack:
+            self.path = f"{stack[-1].path}/{self.name}"
+        stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        elapsed = time.perf_counter() - self._start
+        self._recorder._stack().pop()
+        self._recorder._record(self, elapsed)
+
+
+class _UntimedSpan:
+    """Stand-in for spans skipped by sampling.
+
+    Untimed spans still go on the stack so that spans nested in them are
+    recorded under the same path as when they are timed.
+
+    """
+
+    __slots__ = ("_recorder", "path")
+
+    def __init__(self, recorder: "SpanRecorder", path: str):
+        self._recorder = recorder
+        self.path = path
+
+    def add(self, counter: str, value: _Number = 1) -> None:
+        pass
+
+    def __enter__(self) -> "_UntimedSpan":
+        self._recorder._stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._recorder._stack().pop()
+
+
+class SpanRecorder:
+    """Collects and aggregates span timings.
+
+    Parameters
+    ----------
+    logged_per_span
+        The number of occurrences of each span path to log. Later
+        occurrences are only aggregated.
+
+    """
+
+    def __init__(self, logged_per_span: int = DEFAULT_LOGGED_PER_SPAN):
+        self.logged_per_span = logged_per_span
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _SpanStats] = {}
+        self._sample_counts: Dict[str, int] = {}
+
+    def span(
+        self, name: str, sample_every: int = 1, **counters: _Number
+    ) -> Union[Span, _UntimedSpan]:
+        """Time a section of code.
+
+        Parameters
+        ----------
+        name
+            The name of the span. Nested spans are recorded under the
+            slash-separated path of their parents' names.
+        sample_every
+            Only time one in every ``sample_every`` entries of this span
+            path. Total times are extrapolated from the timed entries.
+            Counters are only recorded for timed entries.
+        counters
+            Initial values of counters to attach to the span.
+
+        """
+        if sample_every > 1:
+            stack = self._stack()
+            path = f"{stack[-1].path}/{name}" if stack else name
+            with self._lock:
+                count = self._sample_counts.get(path, 0) + 1
+                self._sample_counts[path] = count
+                if count % sample_every != 1:
+                    self._get_stats(path).calls += 1
+                    return _UntimedSpan(self, path)
+        return Span(self, name, counters)
+
+    def timed(
+        self, name: Optional[str] = None, sample_every: int = 1
+    ) -> Callable[[Callable], Callable]:
+        """Decorator that times every call of a function as a span.
+
+        Parameters
+        ----------
+        name
+            The name of the span. Defaults to the qualified name of the
+            function.
+        sample_every
+            Only time one in every ``sample_every`` calls.
+
+        """
+
+        def _timed(func: Callable) -> Callable:
+            span_name = name if name is not None else func.__qualname__
+
+            @functools.wraps(func)
+            def _wrapped(*args, **kwargs):
+                with self.span(span_name, sample_every=sample_every):
+                    return func(*args, **kwargs)
+
+            return _wrapped
+
+        return _timed
+
+    def summary(self) -> Dict[str, Dict[str, object]]:
+        """Summarize all recorded spans keyed by span path."""
+        with self._lock:
+            return {path: stats.to_dict() for path, stats in sorted(self._stats.items())}
+
+    def reset(self) -> None:
+        """Discard all recorded spans."""
+        with self._lock:
+            self._stats = {}
+            self._sample_counts = {}
+
+    def _stack(self) -> List[Union[Span, _UntimedSpan]]:
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _get_stats(self, path: str) -> _SpanStats:
+        stats = self._stats.get(path)
+        if stats is None:
+            stats = self._stats[path] = _SpanStats()
+        return stats
+
+    def _record(self, span: Span, elapsed: float) -> None:
+        with self._lock:
+            stats = self._get_stats(span.path)
+            stats.calls += 1
+            stats.timed += 1
+            stats.total += elapsed
+            stats.min = min(stats.min, elapsed)
+            stats.max = max(stats.max, elapsed)
+            for counter, value in span.counters.items():
+                stats.counters[counter] = stats.counters.get(counter, 0) + value
+            should_log = stats.timed <= self.logged_per_span
+
+        if should_log:
+            counters = dict(span.counters)
+            logger.bind(span=span.path, duration=elapsed, counters=counters).debug(
+                f"Span {span.path} finished in {elapsed:.3f} seconds."
+            )
+
+
+_RECORDER = SpanRecorder()
+
+
+def span(name: str, sample_every: int = 1, **counters: _Number) -> Union[Span, _UntimedSpan]:
+    """Time a section of code with the application span recorder.
+
+    Parameters
+    ----------
+    name
+        The name of the span. Nested spans are recorded under the
+        slash-separated path of their parents' names.
+    sample_every
+        Only time one in every ``sample_every`` entries of this span.
+        Totals are extrapolated from the timed entries.
+    counters
+        Initial values of counters to attach to the span.
+
+    Examples
+    --------
+    >>> with span("load_data") as s:
+    ...     data = load()
+    ...     s.add("rows", len(data))
+
+    """
+    return _RECORDER.span(name, sample_every, **counters)
+
+
+def timed(
+    name: Optional[str] = None, sample_every: int = 1
+) -> Callable[[Callable], Callable]:
+    """Decorator that times every call of a function with the application
+    span recorder.
+
+    """
+    return _RECORDER.timed(name, sample_every)
+
+
+def get_span_summary() -> Dict[str, Dict[str, object]]:
+    """Summarize all spans recorded by the application span recorder."""
+    return _RECORDER.summary()
+
+
+def reset_spans() -> None:
+    """Discard all spans recorded by the application span recorder."""
+    _RECORDER.reset()
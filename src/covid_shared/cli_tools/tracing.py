@@ -0,0 +1,218 @@
+"""Tracing the tasks of a workflow run.
+
+Workflows with tracing enabled run every task with a trace id and a trace
+directory in its environment (see
+:class:`~covid_shared.workflow.template.WorkflowTemplate`). Applications
+wrapped with :func:`~covid_shared.cli_tools.metadata.monitor_application`
+then record when they ran, on which host, and what resources they used
+as a small json file in the trace directory. A record without an ``end``
+is written when the task starts, so running tasks can be seen while the
+workflow runs. After the run, the records are merged into a timeline that
+can be loaded in ``chrome://tracing`` or Perfetto and a per-task summary
+table.
+
+"""
+import json
+import os
+import shlex
+import socket
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Union
+
+from loguru import logger
+
+TRACE_ID_ENV_VAR = "COVID_SHARED_TRACE_ID"
+TRACE_DIR_ENV_VAR = "COVID_SHARED_TRACE_DIR"
+TASK_NAME_ENV_VAR = "COVID_SHARED_TASK_NAME"
+# Slurm job names, which jobmon sets to task names.
+_SCHEDULER_TASK_NAME_ENV_VAR = "SLURM_JOB_NAME"
+
+TRACE_FILE_NAME = "trace.json"
+TRACE_SUMMARY_FILE_NAME = "trace_summary"
+
+
+def get_trace_env(trace_id: str, trace_dir: Union[str, Path]) -> Dict[str, str]:
+    """Get the environment variables that put a task in a trace."""
+    return {TRACE_ID_ENV_VAR: trace_id, TRACE_DIR_ENV_VAR: str(trace_dir)}
+
+
+def get_trace_command_prefix(trace_env: Mapping[str, str]) -> str:
+    """Get a shell command prefix that runs a command with a trace environment."""
+    assignments = " ".join(f"{key}={shlex.quote(value)}" for key, value in trace_env.items())
+    return f"env {assignments} "
+
+
+def get_trace_context() -> Optional[Dict[str, str]]:
+    """Get the trace this process belongs to, if any.
+
+    Returns
+    -------
+    Optional[Dict[str, str]]
+        The ``trace_id``, ``trace_dir``, and ``task_name`` of the process,
+        or None if it isn't being traced.
+
+    """
+    trace_id = os.environ.get(TRACE_ID_ENV_VAR)
+    trace_dir = os.environ.get(TRACE_DIR_ENV_VAR)
+    if not (trace_id and trace_dir):
+        return None
+    task_name = os.environ.get(TASK_NAME_ENV_VAR) or os.environ.get(
+        _SCHEDULER_TASK_NAME_ENV_VAR, ""
+    )
+    return {"trace_id": trace_id, "trace_dir": trace_dir, "task_name": task_name}
+
+
+def record_task_trace(
+    trace_context: Mapping[str, str], record: Mapping[str, Any], path: Path = None
+) -> Path:
+    """Write the trace record of a task.
+
+    Parameters
+    ----------
+    trace_context
+        The trace the task belongs to, from :func:`get_trace_context`.
+    record
+        What to record. Should include the ``start`` of the task and, once
+        it has finished, its ``end`` as unix timestamps.
+    path
+        A record to replace, like the one written when the task started.
+
+    Returns
+    -------
+    Path
+        The path of the record.
+
+    """
+    host = socket.gethostname()
+    pid = os.getpid()
+    record = {
+        "trace_id": trace_context["trace_id"],
+        "task_name": trace_context["task_name"],
+        "host": host,
+        "pid": pid,
+        **record,
+    }
+    if path is None:
+        trace_dir = Path(trace_context["trace_dir"])
+        file_name = trace_context["task_name"].replace(os.sep, "_") or "task"
+        path = trace_dir / f"{file_name}.{host}.{pid}.{uuid.uuid4().hex[:8]}.json"
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("w") as record_file:
+        json.dump(record, record_file, default=str)
+    tmp_path.replace(path)
+    return path
+
+
+def read_task_traces(trace_dir: Union[str, Path], trace_id: str) -> List[Dict[str, Any]]:
+    """Read the task records of a trace, ordered by start time."""
+    records = []
+    for path in Path(trace_dir).glob("*.json"):
+        try:
+            with path.open() as record_file:
+                record = json.load(record_file)
+        except (OSError, ValueError):
+            logger.warning(f"Could not read trace record {path}.")
+            continue
+        if record.get("trace_id") == trace_id:
+            records.append(record)
+    return sorted(records, key=lambda r: r["start"])
+
+
+def write_trace_report(
+    trace_dir: Union[str, Path],
+    trace_id: str,
+    output_dir: Union[str, Path],
+    upstream: Mapping[str, Sequence[str]] = None,
+    run_start: float = None,
+) -> Optional[Path]:
+    """Merge the task records of a trace into a timeline and a summary.
+
+    The timeline is written to ``trace.json`` in the Chrome trace event
+    format, with a row per process on each host. The summary is written
+    to ``trace_summary.parquet``, or ``trace_summary.csv`` if no parquet
+    engine is installed.
+
+    Parameters
+    ----------
+    trace_dir
+        The directory holding the task records.
+    trace_id
+        The trace to report.
+    output_dir
+        Where to write the timeline and summary.
+    upstream
+        The names of the upstream tasks of each task. Used with
+        ``run_start`` to work out how long each task waited to start
+        after it became ready to run.
+    run_start
+        When the run started, as a unix timestamp. Records of tasks that
+        started before the run, e.g. from earlier runs of a resumed
+        workflow sharing its trace id, are left out of the report, as are
+        tasks that never finished.
+
+    Returns
+    -------
+    Optional[Path]
+        The path of the timeline, or None if there are no records.
+
+    """
+    records = [r for r in read_task_traces(trace_dir, trace_id) if "end" in r]
+    if run_start is not None:
+        records = [r for r in records if r["start"] >= run_start]
+    if not records:
+        logger.info(f"No task trace records found in {trace_dir}.")
+        return None
+    upstream = upstream if upstream is not None else {}
+    ends = {r["task_name"]: r["end"] for r in records}
+    for record in records:
+        upstream_ends = [ends.get(name) for name in upstream.get(record["task_name"], [])]
+        if None in upstream_ends or (not upstream_ends and run_start is None):
+            record["queue_wait_seconds"] = None
+        else:
+            ready = max(upstream_ends, default=run_start)
+            record["queue_wait_seconds"] = round(max(record["start"] - ready, 0.0), 3)
+
+    output_dir = Path(output_dir)
+    origin = min(r["start"] for r in records)
+    hosts = {host: i for i, host in enumerate(sorted({r["host"] for r in records}))}
+    events = [
+        {"name": "process_name", "ph": "M", "pid": i, "args": {"name": host}}
+        for host, i in hosts.items()
+    ]
+    for record in records:
+        events.append(
+            {
+                "name": record["task_name"],
+                "cat": "task" if record.get("success", True) else "failed",
+                "ph": "X",
+                "ts": round((record["start"] - origin) * 1e6),
+                "dur": round((record["end"] - record["start"]) * 1e6),
+                "pid": hosts[record["host"]],
+                "tid": record["pid"],
+                "args": {
+                    k: v
+                    for k, v in record.items()
+                    if k not in ("task_name", "start", "end", "host", "pid")
+                },
+            }
+        )
+    trace_path = output_dir / TRACE_FILE_NAME
+    with trace_path.open("w") as trace_file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+    import pandas as pd
+
+    summary = pd.DataFrame(records)
+    summary["runtime_seconds"] = summary["end"] - summary["start"]
+    summary_path = output_dir / f"{TRACE_SUMMARY_FILE_NAME}.parquet"
+    try:
+        summary.to_parquet(summary_path, index=False)
+    except ImportError:
+        summary_path = summary_path.with_suffix(".csv")
+        summary.to_csv(summary_path, index=False)
+    logger.info(
+        f"Wrote a timeline of {len(records)} traced tasks to {trace_path} and a "
+        f"summary to {summary_path}."
+    )
+    return trace_path
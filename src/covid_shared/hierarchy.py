@@ -0,0 +1,279 @@
+"""Array-backed index over a location hierarchy.
+
+The flat hierarchy frames returned by
+:func:`covid_shared.ihme_deps.load_location_hierarchy` make parent, child,
+and descendant lookups expensive, usually requiring ``path_to_top_parent``
+to be parsed. :class:`LocationHierarchy` is built once from such a frame
+and answers these questions with array operations.
+
+Locations are stored in depth-first preorder. In that order every subtree
+is a contiguous block, so the subtree of the location at position ``i``
+is the range ``[i, subtree_end[i])``. Ancestor and descendant tests are
+then just interval comparisons.
+
+"""
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # Pandas is slow to import and only needed here for annotations.
+    import pandas as pd
+
+_Ids = Union[int, List[int], np.ndarray]
+
+
+class LocationHierarchy:
+    """A compact, picklable index over a location hierarchy.
+
+    Parameters
+    ----------
+    location_ids
+        The ids of all locations in the hierarchy.
+    parent_ids
+        The parent id of each location. The root location is its own
+        parent (or has a parent that is not in the hierarchy).
+    most_detailed
+        Whether each location is most detailed. Defaults to the leaves of
+        the hierarchy.
+    sort_order
+        The order in which to visit siblings. Defaults to the input order.
+
+    Attributes
+    ----------
+    location_ids
+        Location ids in depth-first preorder.
+    parent
+        The position of each location's parent. The root's parent is -1.
+    level
+        The depth of each location. The root is at level 0.
+    subtree_end
+        One past the position of the last descendant of each location.
+    most_detailed
+        Boolean mask of most detailed locations.
+
+    """
+
+    def __init__(
+        self,
+        location_ids: np.ndarray,
+        parent_ids: np.ndarray,
+        most_detailed: np.ndarray = None,
+        sort_order: np.ndarray = None,
+    ):
+        location_ids = np.asarray(location_ids, dtype=np.int64)
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)
+        if len(np.unique(location_ids)) != len(location_ids):
+            raise ValueError("Location ids in a hierarchy must be unique.")
+
+        if sort_order is not None:
+            visit_order = np.argsort(np.asarray(sort_order), kind="stable")
+        else:
+            visit_order = np.arange(len(location_ids))
+
+        is_root = (parent_ids == location_ids) | ~np.isin(parent_ids, location_ids)
+        if is_root.sum() != 1:
+            raise ValueError(
+                f"A location hierarchy must have exactly one root location. "
+                f"Found roots {location_ids[is_root].tolist()}."
+            )
+
+        children: Dict[int, List[int]] = {}
+        for i in visit_order:
+            if not is_root[i]:
+                children.setdefault(parent_ids[i], []).append(i)
+
+        # Iterative depth first traversal to get the preorder.
+        input_position = {}
+        preorder = []
+        stack = [int(np.flatnonzero(is_root)[0])]
+        while stack:
+            i = stack.pop()
+            input_position[location_ids[i]] = len(preorder)
+            preorder.append(i)
+            stack.extend(reversed(children.get(location_ids[i], [])))
+        if len(preorder) != len(location_ids):
+            raise ValueError(
+                "Location hierarchy contains locations not connected to the root."
+            )
+        preorder = np.array(preorder, dtype=np.int64)
+
+        self.location_ids = location_ids[preorder]
+        self.parent = np.array(
+            [input_position.get(p, -1) for p in parent_ids[preorder]], dtype=np.int64
+        )
+        self.parent[0] = -1
+
+        n = len(self.location_ids)
+        self.level = np.zeros(n, dtype=np.int64)
+        for i in range(1, n):
+            self.level[i] = self.level[self.parent[i]] + 1
+
+        # Walk backwards so children are done before their parents.
+        subtree_size = np.ones(n, dtype=np.int64)
+        for i in range(n - 1, 0, -1):
+            subtree_size[self.parent[i]] += subtree_size[i]
+        self.subtree_end = np.arange(n) + subtree_size
+
+        if most_detailed is None:
+            self.most_detailed = subtree_size == 1
+        else:
+            self.most_detailed = np.asarray(most_detailed, dtype=bool)[preorder]
+
+        self._sorter = np.argsort(self.location_ids)
+        self._plan = None
+
+    @classmethod
+    def from_frame(cls, hierarchy: "pd.DataFrame") -> "LocationHierarchy":
+        """Build a hierarchy index from a flat location hierarchy frame.
+
+        The frame must have ``location_id`` and ``parent_id`` columns. The
+        ``most_detailed`` and ``sort_order`` columns are used if present.
+
+        """
+        return cls(
+            hierarchy["location_id"].to_numpy(),
+            hierarchy["parent_id"].to_numpy(),
+            hierarchy["most_detailed"].to_numpy() if "most_detailed" in hierarchy else None,
+            hierarchy["sort_order"].to_numpy() if "sort_order" in hierarchy else None,
+        )
+
+    def __len__(self) -> int:
+        return len(self.location_ids)
+
+    @property
+    def max_level(self) -> int:
+        return int(self.level.max())
+
+    @property
+    def most_detailed_ids(self) -> np.ndarray:
+        return self.location_ids[self.most_detailed]
+
+    def index(self, location_ids: _Ids) -> np.ndarray:
+        """Get the positions of locations in the hierarchy order.
+
+        Raises
+        ------
+        KeyError
+            If any of the locations are not in the hierarchy.
+
+        """
+        location_ids = np.asarray(location_ids, dtype=np.int64)
+        sorted_position = np.searchsorted(
+            self.location_ids, location_ids, sorter=self._sorter
+        )
+        sorted_position = np.minimum(sorted_position, len(self) - 1)
+        positions = self._sorter[sorted_position]
+        missing = self.location_ids[positions] != location_ids
+        if np.any(missing):
+            raise KeyError(
+                f"Locations {np.unique(location_ids[missing]).tolist()} not in hierarchy."
+            )
+        return positions
+
+    def level_mask(self, level: int) -> np.ndarray:
+        """Boolean mask of the locations at a level."""
+        return self.level == level
+
+    def parent_ids(self, location_ids: _Ids) -> np.ndarray:
+        """Get the parents of locations. The root is its own parent."""
+        positions = self.index(location_ids)
+        parents = self.parent[positions]
+        return self.location_ids[np.where(parents < 0, positions, parents)]
+
+    def child_ids(self, location_id: int) -> np.ndarray:
+        """Get the children of a location in sort order."""
+        position = self.index(location_id)
+        return self.location_ids[self.parent == position]
+
+    def descendant_ids(
+        self, location_id: int, most_detailed_only: bool = False
+    ) -> np.ndarray:
+        """Get all descendants of a location (excluding the location itself)."""
+        position = int(self.index(location_id))
+        block = slice(position + 1, self.subtree_end[position])
+        descendants = self.location_ids[block]
+        if most_detailed_only:
+            descendants = descendants[self.most_detailed[block]]
+        return descendants
+
+    def ancestor_ids(self, location_id: int) -> np.ndarray:
+        """Get the ancestors of a location from the root down (excluding the
+        location itself).
+
+        """
+        position = int(self.parent[self.index(location_id)])
+        ancestors = []
+        while position >= 0:
+            ancestors.append(position)
+            position = self.parent[position]
+        return self.location_ids[ancestors[::-1]]
+
+    def is_ancestor(self, ancestor_ids: _Ids, descendant_ids: _Ids) -> np.ndarray:
+        """Whether each ancestor is an ancestor of (or equal to) each descendant.
+
+        Inputs are broadcast against each other.
+
+        """
+        ancestors = self.index(ancestor_ids)
+        descendants = self.index(descendant_ids)
+        return (ancestors <= descendants) & (descendants < self.subtree_end[ancestors])
+
+    def aggregate(self, values: np.ndarray) -> np.ndarray:
+        """Sum values from most detailed locations up to all their ancestors.
+
+        Parameters
+        ----------
+        values
+            An array whose first axis is aligned with ``location_ids``.
+            Values of locations that are not most detailed are ignored.
+
+        Returns
+        -------
+        np.ndarray
+            An array with the same shape as the input where every location
+            that is not most detailed holds the sum of its most detailed
+            descendants. Children of most detailed locations are not
+            aggregated.
+
+        """
+        values = np.asarray(values)
+        if values.shape[0] != len(self):
+            raise ValueError(
+                f"Values have {values.shape[0]} rows but the hierarchy has {len(self)} locations."
+            )
+        result = np.zeros_like(values)
+        result[self.most_detailed] = values[self.most_detailed]
+        for children, group_starts, parents in self._aggregation_plan():
+            result[parents] = np.add.reduceat(result[children], group_starts, axis=0)
+        return result
+
+    def _aggregation_plan(self) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Get the children, sibling group starts, and parents to aggregate at
+        each level, deepest level first.
+
+        In preorder the children of each parent at a level are contiguous,
+        so each level can be summed into its parents with a single
+        ``np.add.reduceat``. Children of most detailed locations are left
+        out so most detailed values are never overwritten.
+
+        """
+        if self._plan is None:
+            plan = []
+            for level in range(self.max_level, 0, -1):
+                children = np.flatnonzero(
+                    (self.level == level) & ~self.most_detailed[self.parent]
+                )
+                if not len(children):
+                    continue
+                parents = self.parent[children]
+                group_starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+                plan.append((children, group_starts, parents[group_starts]))
+            self._plan = plan
+        return self._plan
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(locations={len(self)}, "
+            f"most_detailed={int(self.most_detailed.sum())}, levels={self.max_level + 1})"
+        )
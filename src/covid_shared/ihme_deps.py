@@ -4,11 +4,23 @@ This module explicitly declares and wraps IHME specific code bases
 to prevent CI failures at import time.
 
 """
+import hashlib
 import importlib
+import json
+import logging
+import os
 import sys
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
 
-import pandas as pd
+from loguru import logger
+
+from covid_shared import cache
+
+if TYPE_CHECKING:
+    # Pandas is slow to import and only needed here for annotations.
+    import pandas as pd
 
 
 def _lazy_import_callable(module_path: str, object_name: str):
@@ -31,46 +43,300 @@ def _lazy_import_callable(module_path: str, object_name: str):
         return f
 
 
-try:
-    from db_queries.api.internal import get_location_hierarchy_by_version
-except ModuleNotFoundError:
-    get_location_hierarchy_by_version = _lazy_import_callable(
-        "db_queries.api.internal", "get_location_hierarchy_by_version"
-    )
+LOCATION_HIERARCHY_CACHE = "location_hierarchy"
+
+DB_QUERY_CACHE = "db_queries"
+# Bump when the format of stored responses changes to invalidate the store.
+DB_QUERY_CACHE_VERSION = 1
+DB_QUERY_CACHE_MODE_ENV_VAR = "COVID_SHARED_DB_CACHE_MODE"
+DB_QUERY_CACHE_TTL_ENV_VAR = "COVID_SHARED_DB_CACHE_TTL"
+DB_QUERY_CACHE_MODES = ("off", "read_through", "replay")
+DEFAULT_DB_QUERY_CACHE_MODE = "read_through"
+
+# In-process cache of location hierarchies.
+_LOCATION_HIERARCHIES: Dict[Tuple, "pd.DataFrame"] = {}
+
+
+def load_location_hierarchy(
+    location_set_version_id: int = None,
+    location_file: Path = None,
+    use_cache: bool = True,
+    cache_root: Path = None,
+    categorical: bool = False,
+) -> "pd.DataFrame":
+    """Load a location hierarchy from the database or from a csv file.
 
+    Hierarchies are cached in process so that repeated loads are cheap.
+    Database hierarchies are stored on disk by the response store
+    described in :func:`query_db`, so they can also be loaded offline in
+    replay mode. File hierarchies are cached on disk by the hash of the
+    file contents. If the cache root isn't writable, hierarchies are only
+    cached in process.
 
-def load_location_hierarchy(location_set_version_id: int = None, location_file: Path = None):
+    Parameters
+    ----------
+    location_set_version_id
+        The location set version to load from the database.
+    location_file
+        A csv file to load the hierarchy from.
+    use_cache
+        Whether to use cached hierarchies.
+    cache_root
+        The root directory for the on-disk cache. Defaults to the cache
+        root given by :func:`covid_shared.cache.get_cache_root`.
+    categorical
+        Whether to convert low cardinality string columns to categoricals
+        to save memory. Categoricals behave differently from strings in
+        comparisons, group bys, and merges, so this is off by default.
+
+    Returns
+    -------
+    pd.DataFrame
+        The location hierarchy. The result is a copy and is safe to modify.
+
+    """
     assert (location_set_version_id and not location_file) or (
         not location_set_version_id and location_file
     )
+    if not use_cache:
+        hierarchy = _read_location_hierarchy(
+            location_set_version_id, location_file, cache_root, use_cache=False
+        )
+        return cache.categorize(hierarchy) if categorical else hierarchy
 
     if location_set_version_id:
-        return get_location_hierarchy_by_version(
+        memo_key = ("location_set_version_id", location_set_version_id)
+    else:
+        location_file = Path(location_file).resolve()
+        file_stat = location_file.stat()
+        memo_key = (
+            "location_file",
+            str(location_file),
+            file_stat.st_mtime_ns,
+            file_stat.st_size,
+        )
+
+    if memo_key not in _LOCATION_HIERARCHIES:
+        if location_set_version_id:
+            hierarchy = _read_location_hierarchy(location_set_version_id, None, cache_root)
+        else:
+            hierarchy = _load_cached_location_file(location_file, cache_root)
+        _LOCATION_HIERARCHIES[memo_key] = hierarchy
+
+    hierarchy = _LOCATION_HIERARCHIES[memo_key]
+    # Categorizing already copies.
+    return cache.categorize(hierarchy) if categorical else hierarchy.copy()
+
+
+def _load_cached_location_file(
+    location_file: Path, cache_root: Optional[Path]
+) -> "pd.DataFrame":
+    cache_stem = None
+    try:
+        cache_dir = cache.get_cache_dir(LOCATION_HIERARCHY_CACHE, cache_root)
+        cache_stem = cache_dir / f"location_file_{cache.hash_file(location_file)}"
+        hierarchy = cache.read_frame(cache_stem)
+    except OSError as e:
+        logger.warning(f"Could not read the location hierarchy cache: {e}")
+        hierarchy = None
+    if hierarchy is not None:
+        return hierarchy
+
+    hierarchy = _read_location_hierarchy(None, location_file, cache_root)
+    if cache_stem is not None:
+        try:
+            cache.write_frame(hierarchy, cache_stem)
+        except OSError as e:
+            logger.warning(f"Could not write the location hierarchy cache: {e}")
+    return hierarchy
+
+
+def _read_location_hierarchy(
+    location_set_version_id: Optional[int],
+    location_file: Optional[Path],
+    cache_root: Optional[Path],
+    use_cache: bool = True,
+) -> "pd.DataFrame":
+    if location_set_version_id:
+        return query_db(
+            "get_location_hierarchy_by_version",
+            cache_root=cache_root,
+            use_cache=use_cache,
             location_set_version_id=location_set_version_id,
         )
     else:
+        import pandas as pd
+
         return pd.read_csv(location_file)
 
 
-##############
-# GROSS HACK #
-##############
-# jobmon_uge uses structlog, a library which does an endrun around
-# python standard logging and then dumps a bunch of useless information
-# to stdout. Before we import structlog (via jobmon_uge via jobmon),
-# put the name in the system's list of imported modules as an alias
-# to the python std library logging module.
-sys.modules["structlog"] = sys.modules["logging"]
-
-try:
-    from jobmon.client.api import Tool
-    from jobmon.client.task import Task
-    from jobmon.client.workflow import WorkflowRunStatus
-    from jobmon.exceptions import WorkflowAlreadyComplete
-except ModuleNotFoundError:
-    Tool = _lazy_import_callable("jobmon.client.api", "Tool")
-    Task = _lazy_import_callable("jobmon.client.task", "Task")
-    WorkflowRunStatus = _lazy_import_callable("jobmon.client.workflow", "WorkflowRunStatus")
-    WorkflowAlreadyComplete = _lazy_import_callable(
-        "jobmon.exceptions", "WorkflowAlreadyComplete"
-    )
+def get_db_query_cache_mode() -> str:
+    """Get the database response cache mode.
+
+    The mode is set with the ``COVID_SHARED_DB_CACHE_MODE`` environment
+    variable and is one of
+
+    ``"off"``
+        Always query the database.
+    ``"read_through"``
+        Serve stored responses and store responses on a miss. This is the
+        default.
+    ``"replay"``
+        Only serve stored responses and never query the database. Misses
+        are errors. Useful for running pipelines and tests offline.
+
+    """
+    mode = os.environ.get(DB_QUERY_CACHE_MODE_ENV_VAR, DEFAULT_DB_QUERY_CACHE_MODE)
+    if mode not in DB_QUERY_CACHE_MODES:
+        raise ValueError(
+            f"Unknown database cache mode {mode} set in {DB_QUERY_CACHE_MODE_ENV_VAR}. "
+            f"Mode must be one of {DB_QUERY_CACHE_MODES}."
+        )
+    return mode
+
+
+def query_db(
+    query_name: str,
+    cache_root: Path = None,
+    ttl: float = None,
+    use_cache: bool = True,
+    **query_kwargs: Any,
+) -> "pd.DataFrame":
+    """Call a database query through the local response store.
+
+    Responses are stored in the cache root keyed by the query name and
+    arguments. Stored responses are invalid if they are older than the
+    time to live or were stored by a different version of the store.
+
+    Parameters
+    ----------
+    query_name
+        The name of a lazily imported database query in this module, e.g.
+        ``"get_location_hierarchy_by_version"``.
+    cache_root
+        The root directory for the response store. Defaults to the cache
+        root given by :func:`covid_shared.cache.get_cache_root`.
+    ttl
+        The time to live of stored responses in seconds. Defaults to the
+        value of the ``COVID_SHARED_DB_CACHE_TTL`` environment variable,
+        or no expiry if unset. Ignored in replay mode.
+    use_cache
+        Whether to use the response store. Ignored in replay mode, which
+        never queries the database.
+    query_kwargs
+        Arguments to the query.
+
+    Raises
+    ------
+    RuntimeError
+        In replay mode, if there is no stored response for the query.
+
+    """
+    mode = get_db_query_cache_mode()
+    if mode == "off" or (not use_cache and mode != "replay"):
+        return _resolve(query_name)(**query_kwargs)
+
+    call = {"query": query_name, "kwargs": query_kwargs}
+    call_key = hashlib.sha1(
+        json.dumps(call, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    try:
+        store_dir = cache.get_cache_dir(DB_QUERY_CACHE, cache_root)
+    except OSError as e:
+        if mode == "replay":
+            raise
+        logger.warning(f"Could not use the database response store: {e}")
+        return _resolve(query_name)(**query_kwargs)
+    store_stem = store_dir / f"{query_name}_{call_key}"
+    metadata_path = store_stem.with_suffix(".json")
+
+    if mode == "replay":
+        response = cache.read_frame(store_stem) if metadata_path.exists() else None
+        if response is None:
+            raise RuntimeError(
+                f"No stored response for {query_name} with arguments {query_kwargs} "
+                f"and {DB_QUERY_CACHE_MODE_ENV_VAR} is 'replay'. Run once in "
+                f"'read_through' mode with database access to record it."
+            )
+        return response
+
+    if ttl is None and DB_QUERY_CACHE_TTL_ENV_VAR in os.environ:
+        ttl = float(os.environ[DB_QUERY_CACHE_TTL_ENV_VAR])
+    if _is_fresh(metadata_path, ttl):
+        response = cache.read_frame(store_stem)
+        if response is not None:
+            return response
+
+    response = _resolve(query_name)(**query_kwargs)
+    try:
+        cache.write_frame(response, store_stem)
+        with metadata_path.open("w") as metadata_file:
+            json.dump(
+                {**call, "version": DB_QUERY_CACHE_VERSION, "stored_at": time.time()},
+                metadata_file,
+                default=str,
+            )
+    except OSError as e:
+        logger.warning(f"Could not store the response to {query_name}: {e}")
+    return response
+
+
+def _is_fresh(metadata_path: Path, ttl: Optional[float]) -> bool:
+    try:
+        with metadata_path.open() as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, ValueError):
+        return False
+    if metadata.get("version") != DB_QUERY_CACHE_VERSION:
+        return False
+    return ttl is None or time.time() - metadata["stored_at"] < ttl
+
+
+# IHME dependencies are slow to import and talk to external services
+# on import, so we resolve them on first access.
+_LAZY_IMPORTS = {
+    "get_location_hierarchy_by_version": (
+        "db_queries.api.internal",
+        "get_location_hierarchy_by_version",
+    ),
+    "Tool": ("jobmon.client.api", "Tool"),
+    "Task": ("jobmon.client.task", "Task"),
+    "WorkflowRunStatus": ("jobmon.client.workflow", "WorkflowRunStatus"),
+    "WorkflowAlreadyComplete": ("jobmon.exceptions", "WorkflowAlreadyComplete"),
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_path, object_name = _LAZY_IMPORTS[name]
+    if module_path.startswith("jobmon"):
+        _alias_structlog()
+    value = _lazy_import_callable(module_path, object_name)
+    globals()[name] = value
+    return value
+
+
+def _resolve(name: str) -> Any:
+    """Resolve a lazy import from inside this module.
+
+    Module level ``__getattr__`` is only used for attribute access from
+    outside the module, so we look in the module namespace first to respect
+    anything that has been resolved or patched.
+
+    """
+    if name in globals():
+        return globals()[name]
+    return __getattr__(name)
+
+
+def _alias_structlog() -> None:
+    ##############
+    # GROSS HACK #
+    ##############
+    # jobmon_uge uses structlog, a library which does an endrun around
+    # python standard logging and then dumps a bunch of useless information
+    # to stdout. Before we import structlog (via jobmon_uge via jobmon),
+    # put the name in the system's list of imported modules as an alias
+    # to the python std library logging module.
+    sys.modules["structlog"] = sys.modules["logging"]
@@ -1,11 +1,276 @@
-from multiprocessing import Pool as StdLibPool
-from typing import Any, Callable, List, Optional
+import functools
+import math
+import operator
+import os
+import sys
+import time
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-import pandas as pd
-import tqdm
-from pathos.multiprocessing import ProcessPool as PathosPool
+if TYPE_CHECKING:
+    # Pandas is slow to import and only needed here for annotations.
+    import pandas as pd
 
-Loader = Callable[[Any, Optional[pd.Index], int, int, bool], pd.DataFrame]
+Loader = Callable[[Any, Optional["pd.Index"], int, int, bool], "pd.DataFrame"]
+
+# Thread pools in numerical libraries default to using every core on the
+# machine, which oversubscribes the cores when several processes use them.
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+# Default fraction of the memory limit workers may use before new tasks are
+# held back, when only a memory limit is given.
+DEFAULT_MEMORY_FRACTION = 0.9
+# Seconds between memory checks and between checks for finished tasks while
+# dispatching with memory admission control.
+MEMORY_CHECK_INTERVAL = 0.5
+_POLL_INTERVAL = 0.01
+# cgroup v1 reports an unlimited memory limit as a huge page-aligned number.
+_UNLIMITED_MEMORY_BYTES = 2**60
+_BYTES_PER_GB = 1024**3
+
+# Keeps the thread limits of a worker process alive.
+_WORKER_THREAD_LIMITS = None
+
+
+def get_available_cpus(cgroup_root: Path = CGROUP_ROOT) -> int:
+    """Get the number of cpus this process can use.
+
+    This is the number of cpus in the process's affinity mask, further
+    limited by any cgroup cpu quota (e.g. from a container or a scheduler
+    that enforces cpu limits with cgroups).
+
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    quota = _get_cgroup_cpu_quota(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, max(math.ceil(quota), 1))
+    return cpus
+
+
+def _get_cgroup_cpu_quota(cgroup_root: Path) -> Optional[float]:
+    try:
+        # cgroup v2
+        quota, period = (cgroup_root / "cpu.max").read_text().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        quota = int((cgroup_root / "cpu" / "cpu.cfs_quota_us").read_text())
+        period = int((cgroup_root / "cpu" / "cpu.cfs_period_us").read_text())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def limit_threads(num_threads: int) -> None:
+    """Limit the threads used by numerical libraries in this process.
+
+    Sets the thread environment variables read by OpenMP, MKL, OpenBLAS,
+    and numexpr when they start. Libraries that have already started are
+    limited with ``threadpoolctl``. Without it, thread pools started by
+    an already imported numpy are left unlimited.
+
+    """
+    global _WORKER_THREAD_LIMITS
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(num_threads)
+    if "numexpr" in sys.modules:
+        sys.modules["numexpr"].set_num_threads(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        if "numpy" in sys.modules:
+            from loguru import logger
+
+            logger.warning(
+                "threadpoolctl is not installed and numpy is already imported, so "
+                f"numpy's thread pools can't be limited to {num_threads} threads."
+            )
+        return
+    _WORKER_THREAD_LIMITS = threadpool_limits(limits=num_threads)
+
+
+def _initialize_worker(
+    num_threads: int, cpu_sets: Optional[Sequence[Sequence[int]]], worker_counter: Any
+) -> None:
+    limit_threads(num_threads)
+    if cpu_sets:
+        with worker_counter.get_lock():
+            worker_id = worker_counter.value
+            worker_counter.value += 1
+        os.sched_setaffinity(0, cpu_sets[worker_id % len(cpu_sets)])
+
+
+def get_worker_cpu_sets(num_workers: int, threads_per_worker: int) -> List[List[int]]:
+    """Split the cpus available to this process into a set for each worker.
+
+    Workers get ``threads_per_worker`` consecutive cpus each, wrapping
+    around if there aren't enough cpus for all workers.
+
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    return [
+        [
+            cpus[(worker * threads_per_worker + i) % len(cpus)]
+            for i in range(threads_per_worker)
+        ]
+        for worker in range(num_workers)
+    ]
+
+
+def get_memory_limit_gb(cgroup_root: Path = CGROUP_ROOT) -> Optional[float]:
+    """Get the memory this process can use, in GB.
+
+    This is the cgroup memory limit (e.g. from a container or a scheduler
+    enforcing ``m_mem_free`` with cgroups), or the total memory of the
+    machine if there is no cgroup limit. Returns None if neither is known.
+
+    """
+    limits = []
+    for path in (
+        cgroup_root / "memory.max",
+        cgroup_root / "memory" / "memory.limit_in_bytes",
+    ):
+        try:
+            limit = path.read_text().strip()
+        except OSError:
+            continue
+        if limit.isdigit() and int(limit) < _UNLIMITED_MEMORY_BYTES:
+            limits.append(int(limit))
+        break
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    limits.append(int(line.split()[1]) * 1024)
+                    break
+    except (OSError, ValueError):
+        pass
+    return min(limits) / _BYTES_PER_GB if limits else None
+
+
+def get_memory_peak_gb(cgroup_root: Path = CGROUP_ROOT) -> Optional[float]:
+    """Get the peak memory use of this process's cgroup, in GB.
+
+    When a scheduler runs each job in its own cgroup, this is the peak
+    memory use of the whole job, including all worker processes. Reads
+    ``memory.peak`` (cgroup v2) or ``memory.max_usage_in_bytes``
+    (cgroup v1). Returns None if neither is available.
+
+    """
+    for path in _get_cgroup_memory_files(
+        cgroup_root, "memory.peak", "memory.max_usage_in_bytes"
+    ):
+        try:
+            return int(path.read_text()) / _BYTES_PER_GB
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def _get_cgroup_memory_files(cgroup_root: Path, v2_name: str, v1_name: str) -> List[Path]:
+    v2_dir, v1_dir = cgroup_root, cgroup_root / "memory"
+    try:
+        with open("/proc/self/cgroup") as cgroup_file:
+            lines = cgroup_file.read().splitlines()
+    except OSError:
+        lines = []
+    files = []
+    for line in lines:
+        _, controllers, cgroup_path = line.split(":", 2)
+        if controllers == "":
+            root, name = v2_dir, v2_name
+        elif "memory" in controllers.split(","):
+            root, name = v1_dir, v1_name
+        else:
+            continue
+        directory = root / cgroup_path.lstrip("/")
+        # Containers see their own cgroup mounted at the root.
+        files.append((directory if directory.exists() else root) / name)
+    return files
+
+
+def get_process_tree_rss_gb(pid: int = None) -> float:
+    """Get the resident memory of a process and all its descendants, in GB.
+
+    Uses ``psutil`` if it is installed and reads ``/proc`` otherwise.
+    Returns 0 if the memory can't be read.
+
+    """
+    pid = pid if pid is not None else os.getpid()
+    try:
+        import psutil
+    except ImportError:
+        return _get_proc_tree_rss(pid) / _BYTES_PER_GB
+
+    rss = 0
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return 0.0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.Error:
+            # The process finished while we were looking.
+            continue
+    return rss / _BYTES_PER_GB
+
+
+def _get_proc_tree_rss(pid: int) -> int:
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue
+        # The process name is in parentheses and may contain spaces.
+        parent = int(stat[stat.rindex(")") + 2 :].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    rss = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/statm") as statm_file:
+                rss += int(statm_file.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            continue
+    return rss
 
 
 def is_notebook() -> bool:
@@ -27,12 +292,37 @@ def is_notebook() -> bool:
         return False  # Probably standard Python interpreter
 
 
+def _make_pool(
+    num_cores: int, notebook_fallback: bool, threads_per_worker: int, pin_workers: bool
+) -> Any:
+    # Multiprocessing libraries are slow to import, so only import them when
+    # we need them.
+    if is_notebook() and notebook_fallback:
+        import multiprocessing as processing
+        from multiprocessing import Pool as processing_pool_class
+    else:
+        import multiprocess as processing
+        from pathos.multiprocessing import ProcessPool as processing_pool_class
+
+    cpu_sets = None
+    if pin_workers:
+        if not hasattr(os, "sched_setaffinity"):
+            raise RuntimeError("Pinning workers to cpus is not supported on this platform.")
+        cpu_sets = get_worker_cpu_sets(num_cores, threads_per_worker)
+    initargs = (threads_per_worker, cpu_sets, processing.Value("i", 0))
+    return processing_pool_class(num_cores, initializer=_initialize_worker, initargs=initargs)
+
+
 def run_parallel(
     runner: Callable,
     arg_list: List,
-    num_cores: int,
+    num_cores: int = None,
     progress_bar: bool = False,
     notebook_fallback: bool = False,
+    threads_per_worker: int = None,
+    pin_workers: bool = False,
+    memory_fraction: float = None,
+    memory_limit_gb: float = None,
 ) -> List[Any]:
     """Runs a single argument function in parallel over a list of arguments.
 
@@ -49,6 +339,8 @@ def run_parallel(
     num_cores
         Maximum number of processes to be run in parallel. If num_cores == 1,
         The jobs will be run serially without invoking multiprocessing.
+        Defaults to the number of cpus available to this process (see
+        :func:`get_available_cpus`).
     progress_bar
         Whether to display a progress bar for the running jobs.
     notebook_fallback
@@ -56,6 +348,25 @@ def run_parallel(
         for multiprocessing as it uses a more robust serialization library, but `pathos`
         has some leaky state and doesn't properly close down child processes when
         interrupted in a jupyter notebook.
+    threads_per_worker
+        The number of threads numerical libraries (BLAS, OpenMP, numexpr)
+        may use in each worker process. Defaults to an even split of the
+        available cpus between the workers so they don't oversubscribe
+        the machine.
+    pin_workers
+        Whether to pin each worker to its own set of ``threads_per_worker``
+        cpus. Only supported on platforms with cpu affinity (e.g. Linux).
+    memory_fraction
+        If provided, hold back new tasks while the memory used by this
+        process and its workers is near this fraction of the memory limit,
+        and resume once memory frees up. At least one task is always
+        running, so a single task larger than the limit still runs.
+        Defaults to ``DEFAULT_MEMORY_FRACTION`` if ``memory_limit_gb`` is
+        provided and to no memory admission control otherwise.
+    memory_limit_gb
+        The memory limit, in GB. Defaults to the cgroup memory limit of
+        this process, or the memory of the machine (see
+        :func:`get_memory_limit_gb`).
 
     Returns
     -------
@@ -63,23 +374,371 @@ def run_parallel(
         A list of the results of the parallel calls of the runner.
 
     """
+    # Progress bar libraries are slow to import, so only import them when we
+    # need them.
+    import tqdm
+
+    num_cores = num_cores if num_cores is not None else get_available_cpus()
+    if threads_per_worker is None:
+        threads_per_worker = max(get_available_cpus() // num_cores, 1)
 
     if num_cores == 1:
         result = []
         for arg in tqdm.tqdm(arg_list, disable=not progress_bar):
             result.append(runner(arg))
     else:
-        if is_notebook() and notebook_fallback:
-            processing_pool_class = StdLibPool
-        else:
-            processing_pool_class = PathosPool
+        memory_budget_gb = None
+        if memory_fraction is not None or memory_limit_gb is not None:
+            if memory_fraction is None:
+                memory_fraction = DEFAULT_MEMORY_FRACTION
+            if not 0 < memory_fraction <= 1:
+                raise ValueError(f"memory_fraction must be in (0, 1], got {memory_fraction}.")
+            if memory_limit_gb is None:
+                memory_limit_gb = get_memory_limit_gb()
+            if memory_limit_gb is None:
+                raise RuntimeError(
+                    "Could not determine the memory limit of this process. "
+                    "Provide memory_limit_gb to use memory admission control."
+                )
+            memory_budget_gb = memory_fraction * memory_limit_gb
+
+        with _make_pool(
+            num_cores, notebook_fallback, threads_per_worker, pin_workers
+        ) as pool:
+            if memory_budget_gb is None:
+                result = list(
+                    tqdm.tqdm(
+                        pool.imap(runner, arg_list),
+                        total=len(arg_list),
+                        disable=not progress_bar,
+                    )
+                )
+            else:
+                with tqdm.tqdm(total=len(arg_list), disable=not progress_bar) as bar:
+                    result = _run_with_memory_admission(
+                        pool, runner, arg_list, num_cores, memory_budget_gb, bar.update
+                    )
+    return result
+
+
+def _submit(pool: Any, func: Callable, *args: Any) -> Any:
+    """Run a function in a pool without waiting for the result."""
+    if hasattr(pool, "apipe"):
+        # pathos pools
+        return pool.apipe(func, *args)
+    return pool.apply_async(func, args)
+
+
+def _run_with_memory_admission(
+    pool: Any,
+    runner: Callable,
+    arg_list: List,
+    num_workers: int,
+    memory_budget_gb: float,
+    on_done: Callable[[int], Any],
+) -> List[Any]:
+    """Dispatch tasks to a pool one at a time while there's memory for them.
 
-        with processing_pool_class(num_cores) as pool:
-            result = list(
+    A task is dispatched when a worker is free and the memory used by this
+    process and its workers, plus an estimate of the memory of a task,
+    fits in the budget. Workers don't report their memory per task, so
+    the estimate is the largest average memory per running task seen at
+    any check, which may undercount tasks that use more memory than
+    their siblings. Until the first check with tasks running, only one
+    task runs.
+
+    Memory is only measured every ``MEMORY_CHECK_INTERVAL`` seconds, so
+    dispatched tasks are counted at the estimate until the next check.
+    Running tasks are always counted at the estimate or more, as tasks
+    that have only just started may not have allocated their memory yet.
+
+    """
+    from loguru import logger
+
+    results: List[Any] = [None] * len(arg_list)
+    running: Dict[int, Any] = {}
+    next_arg = 0
+    baseline_gb = get_process_tree_rss_gb()
+    usage_gb = baseline_gb
+    task_estimate_gb: Optional[float] = None
+    last_check = time.monotonic()
+    holding = False
+    while next_arg < len(arg_list) or running:
+        now = time.monotonic()
+        if now - last_check >= MEMORY_CHECK_INTERVAL:
+            last_check = now
+            usage_gb = get_process_tree_rss_gb()
+            if running:
+                task_estimate_gb = max(
+                    task_estimate_gb or 0.0, (usage_gb - baseline_gb) / len(running)
+                )
+                usage_gb = max(usage_gb, baseline_gb + task_estimate_gb * len(running))
+
+        while next_arg < len(arg_list) and len(running) < num_workers:
+            if running and task_estimate_gb is None:
+                # Wait to see how much memory a task uses.
+                break
+            if running and usage_gb + task_estimate_gb > memory_budget_gb:
+                if not holding:
+                    logger.info(
+                        f"Holding back tasks: using {usage_gb:.2f} GB of a "
+                        f"{memory_budget_gb:.2f} GB budget with {len(running)} "
+                        f"tasks running."
+                    )
+                    holding = True
+                break
+            if holding:
+                logger.info(f"Resuming tasks: using {usage_gb:.2f} GB.")
+                holding = False
+            running[next_arg] = _submit(pool, runner, arg_list[next_arg])
+            next_arg += 1
+            usage_gb += task_estimate_gb or 0.0
+
+        finished = [i for i, async_result in running.items() if async_result.ready()]
+        for i in finished:
+            results[i] = running.pop(i).get()
+            on_done(1)
+        if finished and holding:
+            # Memory may have freed up, so check again right away.
+            last_check = -math.inf
+        if not finished:
+            time.sleep(_POLL_INTERVAL)
+    return results
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+class Reducer(NamedTuple):
+    """How to reduce the results of a runner to a single result.
+
+    Attributes
+    ----------
+    combine
+        Combines a list of partial results into a single partial result.
+        Partial results are always combined in the order of the arguments
+        that produced them, so ``combine`` must be associative but need not
+        be commutative.
+    lift
+        Turns the result of a single runner call into a partial result.
+    finalize
+        Turns the combined partial result of all calls into the final result.
+    grows
+        Whether partial results grow as they are combined, as with
+        concatenation. Combining these in workers would send the same data
+        back and forth between processes at every level of the reduction,
+        so the reduced chunks are combined in the calling process instead.
+
+    """
+
+    combine: Callable[[List[Any]], Any]
+    lift: Callable[[Any], Any] = _identity
+    finalize: Callable[[Any], Any] = _identity
+    grows: bool = False
+
+
+def _concat(values: List[Any]) -> Any:
+    if hasattr(values[0], "iloc"):
+        import pandas as pd
+
+        return pd.concat(values)
+    import numpy as np
+
+    return np.concatenate(values)
+
+
+def _sum(values: List[Any]) -> Any:
+    if hasattr(values[0], "iloc"):
+        return functools.reduce(lambda a, b: a.add(b, fill_value=0), values)
+    return functools.reduce(operator.add, values)
+
+
+def _lift_mean(value: Any) -> Tuple[Any, int]:
+    return value, 1
+
+
+def _combine_mean(values: List[Tuple[Any, int]]) -> Tuple[Any, int]:
+    totals, counts = zip(*values)
+    return _sum(list(totals)), sum(counts)
+
+
+def _finalize_mean(value: Tuple[Any, int]) -> Any:
+    total, count = value
+    return total / count
+
+
+def _combine_with(combine: Callable[[Any, Any], Any], values: List[Any]) -> Any:
+    return functools.reduce(combine, values)
+
+
+# Concatenates DataFrames, Series, or NumPy arrays along the first axis.
+CONCAT = Reducer(_concat, grows=True)
+# Element-wise sum. Pandas objects are aligned on their index and columns.
+SUM = Reducer(_sum)
+# Element-wise mean.
+MEAN = Reducer(_combine_mean, lift=_lift_mean, finalize=_finalize_mean)
+REDUCERS = {"concat": CONCAT, "sum": SUM, "mean": MEAN}
+
+
+def _reduce_chunk(runner: Callable, reducer: Reducer, args: List) -> Any:
+    return reducer.combine([reducer.lift(runner(arg)) for arg in args])
+
+
+def reduce_parallel(
+    runner: Callable,
+    arg_list: List,
+    reducer: Union[str, Reducer, Callable[[Any, Any], Any]],
+    num_cores: int = None,
+    progress_bar: bool = False,
+    notebook_fallback: bool = False,
+    threads_per_worker: int = None,
+    pin_workers: bool = False,
+    chunk_size: int = None,
+) -> Any:
+    """Runs a single argument function in parallel and reduces the results.
+
+    Like :func:`run_parallel` followed by something like ``pd.concat``, but
+    the reduction happens in the workers. The arguments are split into
+    contiguous chunks, each worker reduces the results of its chunk, and
+    neighbouring partial results are then combined pairwise in the workers
+    as soon as both are done, until a single result is left. Partial
+    results still travel between workers through this process, but this
+    process only holds those waiting on a neighbour and never does the
+    combining itself.
+
+    Reducers whose partial results grow as they are combined (see
+    :attr:`Reducer.grows`), like ``"concat"``, are the exception. Their
+    reduced chunks are combined once in this process, so each result
+    is only sent between processes once, as with :func:`run_parallel`.
+
+    Parameters
+    ----------
+    runner
+        A single argument function to be run in parallel.
+    arg_list
+        A list of arguments to be run over in parallel.
+    reducer
+        How to reduce the results. One of ``"concat"``, ``"sum"``, or
+        ``"mean"`` (see :data:`REDUCERS`), a :class:`Reducer`, or a
+        function combining two results into one. Results are combined in
+        the order of ``arg_list``.
+    num_cores
+        Maximum number of processes to be run in parallel. If num_cores == 1,
+        The jobs will be run serially without invoking multiprocessing.
+        Defaults to the number of cpus available to this process (see
+        :func:`get_available_cpus`).
+    progress_bar
+        Whether to display a progress bar for the running chunks.
+    notebook_fallback
+        Whether to fallback to standard multiprocessing in a notebook. See
+        :func:`run_parallel`.
+    threads_per_worker
+        The number of threads numerical libraries may use in each worker
+        process. See :func:`run_parallel`.
+    pin_workers
+        Whether to pin each worker to its own set of ``threads_per_worker``
+        cpus. See :func:`run_parallel`.
+    chunk_size
+        The number of arguments each worker runs and reduces at a time.
+        Defaults to an even split of the arguments between the workers.
+        Smaller chunks balance uneven runtimes better at the cost of more
+        partial results to combine.
+
+    Returns
+    -------
+    Any
+        The reduced result of the parallel calls of the runner.
+
+    """
+    import tqdm
+
+    if not arg_list:
+        raise ValueError("Cannot reduce the results of an empty argument list.")
+    if isinstance(reducer, str):
+        if reducer not in REDUCERS:
+            raise ValueError(
+                f"Unknown reducer {reducer}. Reducer must be one of {list(REDUCERS)}, "
+                "a Reducer, or a function combining two results."
+            )
+        reducer = REDUCERS[reducer]
+    elif not isinstance(reducer, Reducer):
+        reducer = Reducer(functools.partial(_combine_with, reducer))
+
+    num_cores = num_cores if num_cores is not None else get_available_cpus()
+    if threads_per_worker is None:
+        threads_per_worker = max(get_available_cpus() // num_cores, 1)
+    if chunk_size is None:
+        chunk_size = math.ceil(len(arg_list) / num_cores)
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}.")
+    chunks = [arg_list[i : i + chunk_size] for i in range(0, len(arg_list), chunk_size)]
+
+    if num_cores == 1:
+        partials = [
+            _reduce_chunk(runner, reducer, chunk)
+            for chunk in tqdm.tqdm(chunks, disable=not progress_bar)
+        ]
+        return reducer.finalize(reducer.combine(partials))
+
+    with _make_pool(num_cores, notebook_fallback, threads_per_worker, pin_workers) as pool:
+        if reducer.grows:
+            partials = list(
                 tqdm.tqdm(
-                    pool.imap(runner, arg_list),
-                    total=len(arg_list),
+                    pool.imap(functools.partial(_reduce_chunk, runner, reducer), chunks),
+                    total=len(chunks),
                     disable=not progress_bar,
                 )
             )
-    return result
+            result = reducer.combine(partials)
+        else:
+            with tqdm.tqdm(total=len(chunks), disable=not progress_bar) as bar:
+                result = _tree_reduce(pool, runner, reducer, chunks, bar.update)
+    return reducer.finalize(result)
+
+
+def _tree_reduce(
+    pool: Any,
+    runner: Callable,
+    reducer: Reducer,
+    chunks: List[List],
+    on_chunk_done: Callable[[int], Any],
+) -> Any:
+    # Partial results are nodes of a binary tree, keyed by (level, position).
+    # Level 0 holds the reduced chunks, and a node is the combination of its
+    # two children on the level below. A node without a sibling moves up a
+    # level as is.
+    level_sizes = [len(chunks)]
+    while level_sizes[-1] > 1:
+        level_sizes.append(math.ceil(level_sizes[-1] / 2))
+    root = (len(level_sizes) - 1, 0)
+
+    running = {
+        (0, i): _submit(pool, _reduce_chunk, runner, reducer, chunk)
+        for i, chunk in enumerate(chunks)
+    }
+    done: Dict[Tuple[int, int], Any] = {}
+    while root not in done:
+        finished = [node for node, async_result in running.items() if async_result.ready()]
+        if not finished:
+            time.sleep(_POLL_INTERVAL)
+            continue
+        for node in finished:
+            done[node] = running.pop(node).get()
+            if node[0] == 0:
+                on_chunk_done(1)
+        while finished:
+            level, position = node = finished.pop()
+            if node == root or node not in done:
+                continue
+            parent = (level + 1, position // 2)
+            sibling = (level, position ^ 1)
+            if sibling[1] >= level_sizes[level]:
+                done[parent] = done.pop(node)
+                finished.append(parent)
+            elif sibling in done:
+                left, right = sorted([node, sibling])
+                running[parent] = _submit(
+                    pool, reducer.combine, [done.pop(left), done.pop(right)]
+                )
+    return done[root]
@@ -2,8 +2,6 @@
 from datetime import datetime
 from pathlib import Path
 
-import yaml
-
 ##################
 # Executor paths #
 ##################
@@ -19,6 +17,9 @@ R_SINGULARITY_IMAGE_PATH = Path(
 COVID_19 = Path("/ihme/covid-19")
 ARCHIVE_ROOT = COVID_19 / "archive"
 
+# Local cache for expensive inputs.
+DEFAULT_CACHE_ROOT = Path.home() / ".cache" / "covid_shared"
+
 # Shared config for running rclone on the IHME OneDrive
 RCLONE_CONFIG_PATH = COVID_19 / ".config" / "rclone" / "rclone.conf"
 
@@ -84,6 +85,8 @@ METADATA_FILE_NAME = Path("metadata.yaml")
 LOG_DIR = Path("logs")
 LOG_FILE_NAME = Path("master_log.txt")
 DETAILED_LOG_FILE_NAME = Path("master_log.json")
+PROFILE_STATS_FILE_NAME = Path("profile.pstats")
+PROFILE_STACKS_FILE_NAME = Path("profile.collapsed")
 
 BEST_LINK = Path("best")
 LATEST_LINK = Path("latest")
@@ -110,6 +113,8 @@ def _latest_prod_path(prefix: Path):
 
 
 def _latest_prod_source_path(prefix: Path):
+    import yaml
+
     latest_prod_etl_path = latest_production_etl_path()
     with open(latest_prod_etl_path / "metadata.yaml", mode="r") as f:
         etl_metadata = yaml.safe_load(f)
@@ -1,8 +1,10 @@
+import contextlib
 import os
 import shlex
 import subprocess
+import uuid
 from pathlib import Path
-from typing import Union
+from typing import Iterator, Union
 
 
 def wget(url: str, output_path: Union[str, Path]) -> None:
@@ -67,3 +69,30 @@ def mkdir(
         path.mkdir(exist_ok=exists_ok, parents=parents)
     finally:
         os.umask(old_umask)
+
+
+@contextlib.contextmanager
+def atomic_output(output_path: Union[str, Path]) -> Iterator[Path]:
+    """Write an output file atomically.
+
+    Yields a temporary path next to the output path to write to. The
+    temporary file replaces the output path only if the block succeeds,
+    so readers never see a partially written output and several copies of
+    a task (e.g. a speculative retry) can write the same output safely.
+
+    Parameters
+    ----------
+    output_path
+        The path of the output file.
+
+    """
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(
+        f".{output_path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    )
+    try:
+        yield tmp_path
+        tmp_path.replace(output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,114 @@
+"""Utilities for task graphs.
+
+Tasks are any objects with ``upstream_tasks`` and ``downstream_tasks``
+sets, which covers both jobmon tasks and local tasks. Mappings of task
+properties are keyed by the tasks themselves.
+
+"""
+import heapq
+from typing import Any, Dict, Iterable, List
+
+
+def topological_sort(tasks: Iterable[Any], priorities: Dict[Any, float] = None) -> List[Any]:
+    """Sort tasks so that every task comes after its upstream tasks.
+
+    Only edges between the given tasks are considered.
+
+    Parameters
+    ----------
+    tasks
+        The tasks to sort.
+    priorities
+        Priorities of the tasks, keyed by task. Of the tasks whose
+        upstream tasks have all been placed, the highest priority task
+        goes first. Ties keep the input order.
+
+    Raises
+    ------
+    ValueError
+        If the tasks contain a cycle.
+
+    """
+    tasks = list(dict.fromkeys(tasks))
+    priorities = priorities if priorities is not None else {}
+    position = {task: i for i, task in enumerate(tasks)}
+    waiting_on = [
+        sum(upstream in position for upstream in task.upstream_tasks) for task in tasks
+    ]
+
+    def _key(i: int):
+        return -priorities.get(tasks[i], 0.0), i
+
+    ready = [_key(i) for i, waiting in enumerate(waiting_on) if not waiting]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        task = tasks[heapq.heappop(ready)[1]]
+        ordered.append(task)
+        for downstream in task.downstream_tasks:
+            i = position.get(downstream)
+            if i is not None:
+                waiting_on[i] -= 1
+                if not waiting_on[i]:
+                    heapq.heappush(ready, _key(i))
+    if len(ordered) != len(tasks):
+        raise ValueError("Task graph contains a cycle.")
+    return ordered
+
+
+def critical_path_lengths(
+    tasks: Iterable[Any], runtimes: Dict[Any, float]
+) -> Dict[Any, float]:
+    """Compute the critical path length of each task.
+
+    A task's critical path length is the longest total runtime of any
+    chain of tasks starting with it, i.e. the least time the graph will
+    take to finish once the task starts. Starting the tasks with the
+    longest critical paths first keeps long chains from starting late.
+
+    Parameters
+    ----------
+    tasks
+        The tasks in the graph. Only edges between them are considered.
+    runtimes
+        Estimated runtimes of the tasks, keyed by task. Missing tasks
+        take no time.
+
+    Returns
+    -------
+    Dict[Any, float]
+        The critical path length of each task, keyed by task.
+
+    """
+    ordered = topological_sort(tasks)
+    lengths: Dict[Any, float] = {}
+    for task in reversed(ordered):
+        downstream = [lengths[d] for d in task.downstream_tasks if d in lengths]
+        lengths[task] = runtimes.get(task, 0.0) + max(downstream, default=0.0)
+    return lengths
+
+
+def critical_path(tasks: Iterable[Any], lengths: Dict[Any, float]) -> List[Any]:
+    """Get the longest chain of tasks in a graph.
+
+    Parameters
+    ----------
+    tasks
+        The tasks in the graph.
+    lengths
+        The critical path length of each task from
+        :func:`critical_path_lengths`.
+
+    Returns
+    -------
+    List
+        The tasks on the critical path, in order.
+
+    """
+    candidates = [task for task in tasks if task in lengths]
+    path = []
+    while candidates:
+        task = max(candidates, key=lambda t: lengths[t])
+        path.append(task)
+        candidates = [t for t in task.downstream_tasks if t in lengths]
+    return path
@@ -0,0 +1,162 @@
+"""Skipping tasks whose outputs are already up to date.
+
+Task templates can declare the files their tasks read and write (see
+:class:`~covid_shared.workflow.template.TaskTemplate`). When a workflow
+is rerun incrementally, tasks are checked in dependency order, like
+make. A task is up to date if
+
+* it declares outputs and they all exist,
+* all of its declared inputs exist, and
+* it is consistent with its inputs. With ``"mtime"`` fingerprints, every
+  output must be at least as new as every input. With ``"hash"``
+  fingerprints, an input that is newer than the outputs but whose
+  contents haven't changed since the outputs were last recorded does
+  not make the task stale.
+
+Up to date tasks are pruned unless one of their upstream tasks has to
+run, so only the invalidated parts of the graph are resubmitted.
+
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from loguru import logger
+
+from covid_shared import cache
+from covid_shared.workflow.graph import topological_sort
+
+FINGERPRINTS = ("mtime", "hash")
+
+
+class TaskFiles(NamedTuple):
+    """The files a task reads and writes."""
+
+    inputs: Tuple[Path, ...]
+    outputs: Tuple[Path, ...]
+
+    def merge(self, other: "TaskFiles") -> "TaskFiles":
+        return TaskFiles(self.inputs + other.inputs, self.outputs + other.outputs)
+
+
+class FingerprintStore:
+    """Content hashes of task inputs, recorded when outputs are up to date.
+
+    Parameters
+    ----------
+    path
+        The json file the fingerprints are stored in.
+
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        try:
+            with self.path.open() as fingerprint_file:
+                self._fingerprints: Dict[str, Dict[str, str]] = json.load(fingerprint_file)
+        except FileNotFoundError:
+            self._fingerprints = {}
+        # Hash each file at most once per build.
+        self._hashes: Dict[Path, str] = {}
+
+    def _hash(self, path: Path) -> str:
+        if path not in self._hashes:
+            self._hashes[path] = cache.hash_file(path)
+        return self._hashes[path]
+
+    def matches(self, name: str, files: TaskFiles) -> bool:
+        """Whether a task's inputs are unchanged since it was recorded."""
+        recorded = self._fingerprints.get(name)
+        if recorded is None or set(recorded) != {str(p) for p in files.inputs}:
+            return False
+        return all(recorded[str(path)] == self._hash(path) for path in files.inputs)
+
+    def record(self, name: str, files: TaskFiles) -> None:
+        self._fingerprints[name] = {str(path): self._hash(path) for path in files.inputs}
+
+    def save(self) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w") as fingerprint_file:
+            json.dump(self._fingerprints, fingerprint_file)
+        tmp_path.replace(self.path)
+
+
+def is_up_to_date(
+    name: str, files: TaskFiles, fingerprints: Optional[FingerprintStore] = None
+) -> bool:
+    """Whether a task's outputs are up to date with its inputs."""
+    if not files.outputs:
+        return False
+    try:
+        output_mtime = min(path.stat().st_mtime_ns for path in files.outputs)
+        input_mtime = max((path.stat().st_mtime_ns for path in files.inputs), default=0)
+    except FileNotFoundError:
+        return False
+    if output_mtime >= input_mtime:
+        return True
+    return fingerprints is not None and fingerprints.matches(name, files)
+
+
+def prune_up_to_date(
+    tasks: Iterable[Any],
+    task_files: Dict[Any, TaskFiles],
+    fingerprints: Optional[FingerprintStore] = None,
+) -> List[Any]:
+    """Remove up to date tasks from a task graph.
+
+    Parameters
+    ----------
+    tasks
+        The tasks in the graph. Tasks downstream of tasks outside the
+        graph are never pruned.
+    task_files
+        The files of each task, keyed by task. Tasks without files are
+        never up to date.
+    fingerprints
+        Input content hashes to check tasks with stale modification times
+        against.
+
+    Returns
+    -------
+    List
+        The tasks that need to run, in dependency order. Edges from pruned
+        upstream tasks are removed.
+
+    """
+    ordered = topological_sort(tasks)
+    to_run = []
+    pruned = set()
+    for task in ordered:
+        files = task_files.get(task)
+        # Upstream tasks from outside the graph always run.
+        stale = (
+            files is None
+            or any(upstream not in pruned for upstream in task.upstream_tasks)
+            or not is_up_to_date(task.name, files, fingerprints)
+        )
+        if stale:
+            to_run.append(task)
+        else:
+            pruned.add(task)
+
+    for task in to_run:
+        for upstream in list(task.upstream_tasks):
+            if upstream in pruned:
+                task.upstream_tasks.discard(upstream)
+                upstream.downstream_tasks.discard(task)
+    logger.info(
+        f"Incremental run: {len(to_run)} tasks to run, "
+        f"{len(ordered) - len(to_run)} up to date."
+    )
+    return to_run
+
+
+def record_fingerprints(
+    tasks: Iterable[Any], task_files: Dict[Any, TaskFiles], fingerprints: FingerprintStore
+) -> None:
+    """Record input hashes for all tasks whose outputs are up to date."""
+    for task in tasks:
+        files = task_files.get(task)
+        if files is not None and is_up_to_date(task.name, files):
+            fingerprints.record(task.name, files)
+    fingerprints.save()
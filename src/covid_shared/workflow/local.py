@@ -0,0 +1,556 @@
+"""Local execution of workflows without jobmon or a cluster.
+
+The classes here mimic the small part of the jobmon client API that
+workflow templates use (tools, task templates, tasks, and workflows) so
+that a :class:`~covid_shared.workflow.template.WorkflowTemplate` can run
+its DAG on a single machine. Each task's command runs in its own
+subprocess. Tasks are started once their upstream tasks have finished
+and there are enough free cores and memory for their compute resources.
+
+"""
+import heapq
+import itertools
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Collection, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from loguru import logger
+
+from covid_shared.cli_tools.tracing import TASK_NAME_ENV_VAR
+from covid_shared.parallel import THREAD_ENV_VARS, get_available_cpus
+from covid_shared.workflow import progress
+from covid_shared.workflow.progress import ProgressReporter
+from covid_shared.workflow.stragglers import StragglerDetector, StragglerPolicy
+
+JOBMON_BACKEND = "jobmon"
+LOCAL_BACKEND = "local"
+WORKFLOW_BACKENDS = (JOBMON_BACKEND, LOCAL_BACKEND)
+WORKFLOW_BACKEND_ENV_VAR = "COVID_SHARED_WORKFLOW_BACKEND"
+
+
+class LocalWorkflowRunStatus:
+    """Workflow run statuses, matching the codes used by jobmon."""
+
+    DONE = "D"
+    ERROR = "E"
+
+
+def get_workflow_backend(backend: str = None) -> str:
+    """Resolve the workflow backend, defaulting to the
+    ``COVID_SHARED_WORKFLOW_BACKEND`` environment variable and then jobmon.
+
+    """
+    backend = backend or os.environ.get(WORKFLOW_BACKEND_ENV_VAR, JOBMON_BACKEND)
+    if backend not in WORKFLOW_BACKENDS:
+        raise ValueError(
+            f"Unknown workflow backend {backend}. Backend must be one of {WORKFLOW_BACKENDS}."
+        )
+    return backend
+
+
+def get_available_cores() -> int:
+    """Get the number of cores this process may run on."""
+    return get_available_cpus()
+
+
+def get_available_memory_gb() -> Optional[float]:
+    """Get the total memory of the machine in GB, if it can be determined."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+    return None
+
+
+def parse_memory_gb(memory: Union[str, int, float]) -> float:
+    """Parse a memory request like ``"10G"`` into a number of GB."""
+    if isinstance(memory, str):
+        return float(memory.rstrip("Gg"))
+    return float(memory)
+
+
+class LocalTask:
+    """A command to run locally and its place in the task graph."""
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        compute_resources: Dict[str, Union[str, int]] = None,
+        max_attempts: int = 1,
+        template_name: str = None,
+    ):
+        self.name = name
+        self.command = command
+        self.template_name = template_name
+        self.compute_resources = compute_resources if compute_resources is not None else {}
+        self.max_attempts = max_attempts
+        # Ready tasks with higher priorities are started first.
+        self.priority = 0.0
+        self.upstream_tasks: Set["LocalTask"] = set()
+        self.downstream_tasks: Set["LocalTask"] = set()
+
+        self.attempts = 0
+        self.returncode: Optional[int] = None
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    @property
+    def cores(self) -> int:
+        return int(self.compute_resources.get("cores", 1))
+
+    @property
+    def memory_gb(self) -> float:
+        return parse_memory_gb(self.compute_resources.get("memory", 0))
+
+    @property
+    def max_runtime_seconds(self) -> Optional[float]:
+        return self.compute_resources.get("runtime")
+
+    @property
+    def runtime(self) -> Optional[float]:
+        """Wall time of the last attempt, in seconds."""
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def add_upstream(self, task: "LocalTask") -> None:
+        self.upstream_tasks.add(task)
+        task.downstream_tasks.add(self)
+
+    def add_downstream(self, task: "LocalTask") -> None:
+        task.add_upstream(self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name})"
+
+
+class LocalTaskTemplate:
+    """Resolves arguments into local tasks, like a jobmon task template."""
+
+    def __init__(
+        self,
+        template_name: str,
+        command_template: str,
+        node_args: list = None,
+        task_args: list = None,
+        **_,
+    ):
+        self.template_name = template_name
+        self.command_template = command_template
+        self.node_args = node_args or []
+        self.task_args = task_args or []
+
+    def create_task(
+        self,
+        compute_resources: Dict[str, Union[str, int]] = None,
+        name: str = None,
+        max_attempts: int = 1,
+        **kwargs,
+    ) -> LocalTask:
+        command = self.command_template.format(**kwargs)
+        return LocalTask(
+            name=name if name is not None else self.template_name,
+            command=command,
+            compute_resources=compute_resources,
+            max_attempts=max_attempts,
+            template_name=self.template_name,
+        )
+
+
+class LocalWorkflow:
+    """Runs a DAG of local tasks in subprocesses.
+
+    Parameters
+    ----------
+    name
+        The workflow name.
+    default_compute_resources_set
+        Jobmon style cluster resources. Task stdout and stderr are
+        written to files in the ``stdout`` and ``stderr`` directories
+        if provided.
+    max_cores
+        The number of cores available to tasks. Defaults to the cores
+        available to this process.
+    max_memory_gb
+        The memory available to tasks. Defaults to the machine's memory.
+    straggler_policy
+        How to detect and handle straggling tasks, if at all.
+    speculative_templates
+        The task templates whose tasks may be run speculatively if the
+        straggler policy allows it. Defaults to all of them.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        default_compute_resources_set: Dict[str, Dict] = None,
+        max_cores: int = None,
+        max_memory_gb: float = None,
+        straggler_policy: StragglerPolicy = None,
+        speculative_templates: Collection[str] = None,
+        **_,
+    ):
+        self.name = name
+        resources = {}
+        for cluster_resources in (default_compute_resources_set or {}).values():
+            resources.update(cluster_resources)
+        self._stdout = Path(resources["stdout"]) if "stdout" in resources else None
+        self._stderr = Path(resources["stderr"]) if "stderr" in resources else None
+
+        self.max_cores = max_cores if max_cores is not None else get_available_cores()
+        self.max_memory_gb = (
+            max_memory_gb if max_memory_gb is not None else get_available_memory_gb()
+        )
+        self.straggler_policy = straggler_policy
+        self.speculative_templates = (
+            set(speculative_templates) if speculative_templates is not None else None
+        )
+        # Set by workflow templates to track task statuses while running.
+        self.progress_reporter: Optional[ProgressReporter] = None
+        self.tasks: List[LocalTask] = []
+        # The names of the tasks flagged as stragglers in the last run.
+        self.stragglers: List[str] = []
+        self.workflow_run_id: Optional[str] = None
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    def add_task(self, task: LocalTask) -> LocalTask:
+        self.tasks.append(task)
+        return task
+
+    def add_tasks(self, tasks: Iterable[LocalTask]) -> None:
+        self.tasks.extend(tasks)
+
+    def run(self, fail_fast: bool = False, seconds_until_timeout: float = None) -> str:
+        """Run all tasks, respecting dependencies and resource limits.
+
+        If the workflow has a straggler policy, tasks that run much longer
+        than their finished siblings are flagged and, if the policy and
+        ``speculative_templates`` allow, a speculative copy of each is
+        started. The first copy to succeed wins and the other is killed.
+
+        Parameters
+        ----------
+        fail_fast
+            Stop starting new tasks after the first task failure. Running
+            tasks are allowed to finish.
+        seconds_until_timeout
+            Kill all running tasks and fail if the workflow hasn't finished
+            after this long.
+
+        Returns
+        -------
+        str
+            :attr:`LocalWorkflowRunStatus.DONE` if all tasks succeeded,
+            otherwise :attr:`LocalWorkflowRunStatus.ERROR`.
+
+        """
+        task_set = set(self.tasks)
+        for task in self.tasks:
+            missing = task.upstream_tasks - task_set
+            if missing:
+                raise ValueError(
+                    f"Task {task.name} depends on tasks that are not in the workflow: "
+                    f"{sorted(t.name for t in missing)}."
+                )
+
+        self.workflow_run_id = uuid.uuid4().hex[:12]
+        logger.info(
+            f"Running workflow {self.name} locally with {len(self.tasks)} tasks on "
+            f"{self.max_cores} cores (run id {self.workflow_run_id})."
+        )
+        self.start_time = time.time()
+        deadline = self.start_time + seconds_until_timeout if seconds_until_timeout else None
+        policy = self.straggler_policy
+        detector = StragglerDetector(policy) if policy is not None else None
+        reporter = self.progress_reporter
+
+        def _set_status(task: LocalTask, status: str) -> None:
+            if reporter is not None:
+                reporter.set_status(task.name, status)
+
+        waiting_on = {task: len(task.upstream_tasks) for task in self.tasks}
+        # Ready tasks, highest priority first, then first ready first. Retried
+        # tasks go ahead of other tasks with the same priority.
+        ready: List[Tuple[float, int, LocalTask]] = []
+        sequence = itertools.count()
+        retry_sequence = itertools.count(-1, -1)
+
+        def _make_ready(task: LocalTask, retry: bool = False) -> None:
+            order = next(retry_sequence) if retry else next(sequence)
+            heapq.heappush(ready, (-task.priority, order, task))
+
+        for task in self.tasks:
+            if not task.upstream_tasks:
+                _make_ready(task)
+        finished: "queue.Queue" = queue.Queue()
+        # Every running copy of each task and when it started.
+        running: Dict[LocalTask, Dict[subprocess.Popen, float]] = {}
+        succeeded: Set[LocalTask] = set()
+        stragglers: Set[LocalTask] = set()
+        speculated: Set[LocalTask] = set()
+        failed: List[LocalTask] = []
+        free_cores = self.max_cores
+        free_memory_gb = self.max_memory_gb
+        timed_out = False
+
+        while ready or running:
+            if failed and fail_fast:
+                ready.clear()
+            if not running:
+                # Avoid drift in the free memory from repeated float arithmetic.
+                free_cores, free_memory_gb = self.max_cores, self.max_memory_gb
+            # Start ready tasks in priority order. Tasks that don't fit are
+            # skipped so smaller tasks can fill the remaining resources.
+            skipped = []
+            while ready and free_cores > 0:
+                entry = heapq.heappop(ready)
+                task = entry[2]
+                cores, memory_gb = self._reservation(task)
+                fits_memory = free_memory_gb is None or memory_gb <= free_memory_gb
+                if cores <= free_cores and fits_memory:
+                    free_cores -= cores
+                    if free_memory_gb is not None:
+                        free_memory_gb -= memory_gb
+                    running[task] = {self._launch(task, finished): time.time()}
+                    _set_status(task, progress.RUNNING)
+                else:
+                    skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(ready, entry)
+
+            if detector is not None and not (failed and fail_fast):
+                for task in running.keys() - speculated:
+                    elapsed = time.time() - task.start_time
+                    if not detector.is_straggler(task.template_name, elapsed):
+                        continue
+                    if task not in stragglers:
+                        stragglers.add(task)
+                        logger.warning(
+                            f"Task {task.name} has been running for {elapsed:.0f} seconds, "
+                            f"longer than the {detector.threshold(task.template_name):.0f} "
+                            f"second straggler threshold for {task.template_name}."
+                        )
+                    cores, memory_gb = self._reservation(task)
+                    fits_memory = free_memory_gb is None or memory_gb <= free_memory_gb
+                    if self._can_speculate(task) and cores <= free_cores and fits_memory:
+                        speculated.add(task)
+                        free_cores -= cores
+                        if free_memory_gb is not None:
+                            free_memory_gb -= memory_gb
+                        process = self._launch(task, finished, speculative=True)
+                        running[task][process] = time.time()
+                        logger.info(f"Started a speculative copy of task {task.name}.")
+            if not running:
+                break
+
+            timeout = max(deadline - time.time(), 0) if deadline is not None else None
+            if detector is not None:
+                timeout = min(
+                    timeout if timeout is not None else policy.check_interval,
+                    policy.check_interval,
+                )
+            try:
+                task, process, returncode = finished.get(timeout=timeout)
+            except queue.Empty:
+                if deadline is not None and time.time() >= deadline:
+                    timed_out = True
+                    break
+                continue
+            process_start = running[task].pop(process)
+            if not running[task]:
+                del running[task]
+            cores, memory_gb = self._reservation(task)
+            free_cores += cores
+            if free_memory_gb is not None:
+                free_memory_gb += memory_gb
+
+            if task in succeeded:
+                # A losing copy of a task that has already succeeded.
+                continue
+            if returncode == 0:
+                succeeded.add(task)
+                task.end_time, task.returncode = time.time(), returncode
+                _set_status(task, progress.DONE)
+                for other in running.get(task, {}):
+                    _kill(other)
+                if detector is not None and task.template_name is not None:
+                    detector.record(task.template_name, task.end_time - process_start)
+                for downstream in task.downstream_tasks:
+                    waiting_on[downstream] -= 1
+                    if not waiting_on[downstream]:
+                        _make_ready(downstream)
+            elif task in running:
+                logger.warning(
+                    f"A copy of task {task.name} failed with exit code {returncode}. "
+                    f"Waiting on the other copy."
+                )
+            else:
+                task.end_time, task.returncode = time.time(), returncode
+                stragglers.discard(task)
+                speculated.discard(task)
+                if task.attempts < task.max_attempts:
+                    logger.warning(
+                        f"Task {task.name} failed with exit code {returncode}. "
+                        f"Retrying (attempt {task.attempts + 1} of {task.max_attempts})."
+                    )
+                    _make_ready(task, retry=True)
+                    _set_status(task, progress.QUEUED)
+                else:
+                    logger.error(f"Task {task.name} failed with exit code {returncode}.")
+                    failed.append(task)
+                    _set_status(task, progress.FAILED)
+
+        if timed_out:
+            logger.error(
+                f"Workflow {self.name} timed out after {seconds_until_timeout} seconds."
+            )
+            processes = [p for copies in running.values() for p in copies]
+            for process in processes:
+                _kill(process)
+            for _ in processes:
+                task, _, returncode = finished.get()
+                if task not in succeeded:
+                    task.end_time, task.returncode = time.time(), returncode
+                    _set_status(task, progress.FAILED)
+
+        self.end_time = time.time()
+        self.stragglers = sorted(task.name for task in stragglers)
+        summary = self.summary()
+        logger.info(
+            f"Workflow {self.name} finished in {summary['wall_seconds']:.1f} seconds. "
+            f"{summary['done']} tasks done, {summary['failed']} failed, "
+            f"{summary['not_run']} not run, {summary['stragglers']} stragglers."
+        )
+        succeeded = not (failed or timed_out) and summary["done"] == len(self.tasks)
+        return LocalWorkflowRunStatus.DONE if succeeded else LocalWorkflowRunStatus.ERROR
+
+    def summary(self) -> Dict[str, float]:
+        """Summarize the last run of the workflow."""
+        runtimes = [t.runtime for t in self.tasks if t.runtime is not None]
+        wall_seconds = (
+            self.end_time - self.start_time if self.start_time and self.end_time else 0.0
+        )
+        core_seconds = sum(
+            t.runtime * self._reservation(t)[0] for t in self.tasks if t.runtime is not None
+        )
+        return {
+            "tasks": len(self.tasks),
+            "done": sum(t.returncode == 0 for t in self.tasks),
+            "failed": sum(t.returncode not in (None, 0) for t in self.tasks),
+            "not_run": sum(t.attempts == 0 for t in self.tasks),
+            "stragglers": len(self.stragglers),
+            "wall_seconds": wall_seconds,
+            "task_seconds": sum(runtimes),
+            "core_utilization": (
+                core_seconds / (wall_seconds * self.max_cores) if wall_seconds else 0.0
+            ),
+        }
+
+    def _can_speculate(self, task: LocalTask) -> bool:
+        if self.straggler_policy is None or not self.straggler_policy.speculate:
+            return False
+        templates = self.speculative_templates
+        return templates is None or task.template_name in templates
+
+    def _reservation(self, task: LocalTask):
+        # Tasks bigger than the machine run alone rather than never running.
+        cores = min(task.cores, self.max_cores)
+        memory_gb = task.memory_gb
+        if self.max_memory_gb is not None:
+            memory_gb = min(memory_gb, self.max_memory_gb)
+        return cores, memory_gb
+
+    def _launch(
+        self, task: LocalTask, finished: "queue.Queue", speculative: bool = False
+    ) -> subprocess.Popen:
+        if not speculative:
+            task.attempts += 1
+            task.returncode = None
+            task.start_time = time.time()
+            task.end_time = None
+        env = dict(os.environ)
+        # Keep numerical libraries within the cores reserved for the task.
+        for var in THREAD_ENV_VARS:
+            env.setdefault(var, str(self._reservation(task)[0]))
+        env[TASK_NAME_ENV_VAR] = task.name
+        suffix = "s" if speculative else ""
+        stdout = self._open_log(self._stdout, task, "o", suffix)
+        stderr = self._open_log(self._stderr, task, "e", suffix)
+
+        process = subprocess.Popen(
+            task.command,
+            shell=True,
+            stdout=stdout,
+            stderr=stderr,
+            env=env,
+            # Run in a new session so we can kill the whole process group.
+            start_new_session=True,
+        )
+        waiter = threading.Thread(
+            target=self._wait,
+            args=(task, process, finished, [stdout, stderr]),
+            daemon=True,
+        )
+        waiter.start()
+        return process
+
+    @staticmethod
+    def _wait(
+        task: LocalTask, process: subprocess.Popen, finished: "queue.Queue", log_files: List
+    ) -> None:
+        try:
+            returncode = process.wait(timeout=task.max_runtime_seconds)
+        except subprocess.TimeoutExpired:
+            logger.warning(
+                f"Task {task.name} exceeded its max runtime of "
+                f"{task.max_runtime_seconds} seconds and was killed."
+            )
+            _kill(process)
+            returncode = process.wait()
+        finally:
+            for log_file in log_files:
+                if log_file is not None:
+                    log_file.close()
+        finished.put((task, process, returncode))
+
+    @staticmethod
+    def _open_log(log_dir: Optional[Path], task: LocalTask, stream: str, suffix: str = ""):
+        if log_dir is None:
+            return None
+        file_name = task.name.replace(os.sep, "_")
+        return (log_dir / f"{file_name}.{stream}{task.attempts}{suffix}").open("w")
+
+
+def _kill(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class LocalTool:
+    """Creates local workflows and task templates, like a jobmon tool."""
+
+    def __init__(self, max_cores: int = None, max_memory_gb: float = None):
+        self.max_cores = max_cores
+        self.max_memory_gb = max_memory_gb
+
+    def create_workflow(self, name: str, **kwargs) -> LocalWorkflow:
+        return LocalWorkflow(
+            name, max_cores=self.max_cores, max_memory_gb=self.max_memory_gb, **kwargs
+        )
+
+    def get_task_template(self, template_name: str, **kwargs) -> LocalTaskTemplate:
+        return LocalTaskTemplate(template_name, **kwargs)
@@ -0,0 +1,185 @@
+"""Packing many small tasks into a single cluster job.
+
+Scheduler and jobmon overhead can dwarf the compute of very short tasks.
+Task templates declared as packed by a
+:class:`~covid_shared.workflow.template.WorkflowTemplate` write the
+commands of many logical tasks to a json manifest and submit one job per
+manifest that runs::
+
+    python -m covid_shared.workflow.packing MANIFEST
+
+The runner executes the logical tasks sequentially or with a small local
+pool, retries failed logical tasks, and records the status of every
+logical task next to the manifest. A rerun of the job (e.g. a jobmon
+retry or resume) skips logical tasks that have already succeeded with
+the same command.
+
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import click
+from loguru import logger
+
+from covid_shared.cli_tools.tracing import TASK_NAME_ENV_VAR
+
+DONE = "done"
+FAILED = "failed"
+
+
+class TaskPacking(NamedTuple):
+    """How to pack the tasks of a task template.
+
+    Attributes
+    ----------
+    size
+        The maximum number of logical tasks per job.
+    workers
+        The number of logical tasks to run at once in a job.
+    max_attempts
+        The number of times to try each logical task in a job.
+
+    """
+
+    size: int
+    workers: int = 1
+    max_attempts: int = 1
+
+
+def get_status_path(manifest_path: Union[str, Path]) -> Path:
+    """Get the path of the logical task status file for a manifest."""
+    manifest_path = Path(manifest_path)
+    return manifest_path.with_name(f"{manifest_path.stem}.status.json")
+
+
+def write_manifest(
+    manifest_path: Union[str, Path], tasks: List[Dict[str, str]], packing: TaskPacking
+) -> None:
+    """Write a packed job manifest.
+
+    Parameters
+    ----------
+    manifest_path
+        Where to write the manifest.
+    tasks
+        The logical tasks, as dicts with a ``name`` and ``command``.
+    packing
+        How to run the logical tasks.
+
+    """
+    manifest = {
+        "workers": packing.workers,
+        "max_attempts": packing.max_attempts,
+        "tasks": tasks,
+    }
+    with Path(manifest_path).open("w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def read_status(manifest_path: Union[str, Path]) -> Dict[str, Dict]:
+    """Read the status of the logical tasks in a packed job."""
+    try:
+        with get_status_path(manifest_path).open() as status_file:
+            return json.load(status_file)
+    except FileNotFoundError:
+        return {}
+
+
+def run_packed_tasks(manifest_path: Union[str, Path], workers: int = None) -> bool:
+    """Run the logical tasks in a packed job manifest.
+
+    Parameters
+    ----------
+    manifest_path
+        The path of the manifest.
+    workers
+        Override the number of logical tasks to run at once.
+
+    Returns
+    -------
+    bool
+        Whether all logical tasks have succeeded.
+
+    """
+    with Path(manifest_path).open() as manifest_file:
+        manifest = json.load(manifest_file)
+    workers = workers if workers is not None else manifest["workers"]
+    max_attempts = manifest["max_attempts"]
+
+    status = read_status(manifest_path)
+    status_lock = threading.Lock()
+    pending = [t for t in manifest["tasks"] if not _is_done(t, status)]
+    logger.info(
+        f"Running {len(pending)} of {len(manifest['tasks'])} packed tasks "
+        f"with {workers} workers."
+    )
+
+    def _run(task: Dict[str, str]) -> None:
+        task_status = status.get(task["name"], {"attempts": 0})
+        for _ in range(max_attempts):
+            start = time.time()
+            env = {**os.environ, TASK_NAME_ENV_VAR: task["name"]}
+            returncode = subprocess.call(task["command"], shell=True, env=env)
+            task_status = {
+                "status": DONE if returncode == 0 else FAILED,
+                "command": task["command"],
+                "attempts": task_status["attempts"] + 1,
+                "returncode": returncode,
+                "runtime": round(time.time() - start, 3),
+            }
+            if returncode == 0:
+                break
+            logger.warning(f"Packed task {task['name']} failed with exit code {returncode}.")
+        with status_lock:
+            status[task["name"]] = task_status
+            _write_status(manifest_path, status)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_run, pending))
+    else:
+        for task in pending:
+            _run(task)
+
+    failed = [t["name"] for t in manifest["tasks"] if not _is_done(t, status)]
+    if failed:
+        logger.error(f"{len(failed)} packed tasks failed: {failed}.")
+    return not failed
+
+
+def _is_done(task: Dict[str, str], status: Dict[str, Dict]) -> bool:
+    task_status = status.get(task["name"], {})
+    return task_status.get("status") == DONE and task_status.get("command") == task["command"]
+
+
+def _write_status(manifest_path: Union[str, Path], status: Dict[str, Dict]) -> None:
+    status_path = get_status_path(manifest_path)
+    tmp_path = status_path.with_name(status_path.name + ".tmp")
+    with tmp_path.open("w") as status_file:
+        json.dump(status, status_file)
+    tmp_path.replace(status_path)
+
+
+def get_packed_command(manifest_path: Union[str, Path]) -> str:
+    """Get the command that runs a packed job."""
+    return f"{sys.executable} -m covid_shared.workflow.packing {manifest_path}"
+
+
+@click.command()
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", type=int, default=None, help="Override the number of workers.")
+def main(manifest: str, workers: Optional[int]):
+    """Run the logical tasks in a packed job MANIFEST."""
+    if not run_packed_tasks(manifest, workers):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
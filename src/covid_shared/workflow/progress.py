@@ -0,0 +1,360 @@
+"""Live progress reporting for workflow runs.
+
+A :class:`ProgressReporter` tracks how many tasks of each task template
+are queued, running, done, or failed while a workflow runs, along with
+the recent task completion rate and an estimate of the time remaining.
+While started, it logs a progress line at a fixed interval from a
+background thread and can write the same information to a small json
+status file that dashboards or a local watcher can poll.
+
+The local executor updates the status of every task. Jobmon doesn't
+report task statuses to the client, so for traced jobmon workflows a
+:class:`TraceStatusPoller` reads them from the trace records the tasks
+write when they start and finish. Untraced jobmon workflows are reported
+with ``track_statuses=False`` and only show the number of tasks queued
+or running on the cluster, lifted from the distributor's log messages by
+:class:`~covid_shared.cli_tools.logging.JobmonInterceptHandler`.
+
+"""
+import bisect
+import collections
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Mapping, Optional, Set, Tuple, Union
+
+from loguru import logger
+
+from covid_shared.cli_tools import tracing
+from covid_shared.workflow.stragglers import StragglerDetector
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATUSES = (QUEUED, RUNNING, DONE, FAILED)
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_WINDOW = 600.0
+UNKNOWN_TEMPLATE = "unknown"
+
+_ACTIVE_REPORTER: Optional["ProgressReporter"] = None
+
+
+def get_active_reporter() -> Optional["ProgressReporter"]:
+    """Get the progress reporter of the running workflow, if any."""
+    return _ACTIVE_REPORTER
+
+
+class ProgressReporter:
+    """Tracks and reports the progress of a workflow run.
+
+    Parameters
+    ----------
+    interval
+        Seconds between progress reports.
+    status_path
+        If provided, a json file to write the status to on each report.
+    window
+        Seconds of recent task completions used to estimate throughput.
+    track_statuses
+        Whether task statuses are reported with :meth:`set_status`. If
+        not, the task counts by status, throughput, and ETA are left out
+        of reports, as every task would look queued forever.
+    poller
+        If provided, polled for task statuses before each report.
+
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_INTERVAL,
+        status_path: Union[str, Path] = None,
+        window: float = DEFAULT_WINDOW,
+        track_statuses: bool = True,
+        poller: "TraceStatusPoller" = None,
+    ):
+        self.interval = interval
+        self.status_path = Path(status_path) if status_path is not None else None
+        self.window = window
+        self.track_statuses = track_statuses
+        self.poller = poller
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, str] = {}
+        self._templates: Dict[str, str] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._completions: Deque[float] = collections.deque()
+        # Tasks queued or running on the cluster, if only that is known.
+        self._active: Optional[int] = None
+        self._start: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_task(self, name: str, template: str = None) -> None:
+        """Track a queued task."""
+        with self._lock:
+            self._add_task(name, template)
+
+    def _add_task(self, name: str, template: Optional[str]) -> None:
+        template = template if template is not None else UNKNOWN_TEMPLATE
+        if name in self._tasks:
+            self._counts[self._templates[name]][self._tasks[name]] -= 1
+        self._tasks[name] = QUEUED
+        self._templates[name] = template
+        counts = self._counts.setdefault(template, dict.fromkeys(STATUSES, 0))
+        counts[QUEUED] += 1
+
+    def set_status(self, name: str, status: str, at: float = None) -> None:
+        """Update the status of a task. Unknown tasks are tracked first.
+
+        ``at`` is when the task reached the status as a unix timestamp and
+        defaults to now. Tasks done before reporting started don't count
+        toward the throughput.
+
+        """
+        if status not in STATUSES:
+            raise ValueError(
+                f"Unknown task status {status}. Status must be one of {STATUSES}."
+            )
+        at = at if at is not None else time.time()
+        with self._lock:
+            if name not in self._tasks:
+                self._add_task(name, None)
+            counts = self._counts[self._templates[name]]
+            counts[self._tasks[name]] -= 1
+            counts[status] += 1
+            self._tasks[name] = status
+            if status == DONE and (self._start is None or at >= self._start):
+                bisect.insort(self._completions, at)
+
+    def get_status(self, name: str) -> Optional[str]:
+        """Get the status of a task, or None if it isn't tracked."""
+        with self._lock:
+            return self._tasks.get(name)
+
+    def get_template(self, name: str) -> Optional[str]:
+        """Get the template of a task, or None if it isn't tracked."""
+        with self._lock:
+            return self._templates.get(name)
+
+    def set_active(self, active: int) -> None:
+        """Set the number of tasks queued or running on the cluster."""
+        with self._lock:
+            self._active = active
+
+    def status(self) -> Dict:
+        """Summarize the progress of the run."""
+        now = time.time()
+        with self._lock:
+            while self._completions and self._completions[0] < now - self.window:
+                self._completions.popleft()
+            templates = {name: dict(counts) for name, counts in self._counts.items()}
+            recent = len(self._completions)
+            active = self._active
+        totals = {status: sum(c[status] for c in templates.values()) for status in STATUSES}
+        elapsed = now - self._start if self._start is not None else 0.0
+        span = min(elapsed, self.window)
+        throughput = recent / span if span > 0 else 0.0
+        remaining = totals[QUEUED] + totals[RUNNING]
+        if not self.track_statuses:
+            return {
+                "updated": now,
+                "elapsed_seconds": round(elapsed, 1),
+                "tasks": sum(totals.values()),
+                "active": active,
+            }
+        return {
+            "updated": now,
+            "elapsed_seconds": round(elapsed, 1),
+            "tasks": sum(totals.values()),
+            **totals,
+            "active": active,
+            "throughput_per_minute": round(throughput * 60, 2),
+            "eta_seconds": round(remaining / throughput, 1) if throughput else None,
+            "templates": templates,
+        }
+
+    def report(self) -> Dict:
+        """Log the progress of the run and write the status file."""
+        status = self.status()
+        if not self.track_statuses:
+            active = status["active"] if status["active"] is not None else "unknown"
+            logger.info(
+                f"Progress: {status['tasks']} tasks submitted, {active} queued or "
+                f"running on the cluster."
+            )
+            if self.status_path is not None:
+                self._write_status(status)
+            return status
+        if status["tasks"]:
+            message = (
+                f"Progress: {status[DONE]}/{status['tasks']} tasks done, "
+                f"{status[RUNNING]} running, {status[QUEUED]} queued, "
+                f"{status[FAILED]} failed"
+            )
+        else:
+            message = "Progress: no tasks tracked"
+        if status["active"] is not None:
+            message += f", {status['active']} queued or running on the cluster"
+        message += f". {status['throughput_per_minute']} tasks/minute"
+        if status["eta_seconds"] is not None:
+            message += f", ETA {status['eta_seconds'] / 60:.1f} minutes"
+        templates = ", ".join(
+            f"{name} {counts[DONE]}/{sum(counts.values())}"
+            for name, counts in status["templates"].items()
+        )
+        logger.info(f"{message}." + (f" ({templates})" if templates else ""))
+        if self.status_path is not None:
+            self._write_status(status)
+        return status
+
+    def _write_status(self, status: Dict) -> None:
+        tmp_path = self.status_path.with_name(self.status_path.name + ".tmp")
+        try:
+            with tmp_path.open("w") as status_file:
+                json.dump(status, status_file)
+            tmp_path.replace(self.status_path)
+        except OSError as e:
+            logger.warning(f"Could not write workflow status to {self.status_path}: {e}")
+
+    def start(self) -> None:
+        """Start reporting progress in the background."""
+        global _ACTIVE_REPORTER
+        if self._thread is not None:
+            raise RuntimeError("Progress reporter has already been started.")
+        _ACTIVE_REPORTER = self
+        self._start = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Dict:
+        """Stop reporting and make a final report."""
+        global _ACTIVE_REPORTER
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        if _ACTIVE_REPORTER is self:
+            _ACTIVE_REPORTER = None
+        self._poll()
+        return self.report()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._poll()
+            self.report()
+
+    def _poll(self) -> None:
+        if self.poller is None:
+            return
+        try:
+            self.poller.poll(self)
+        except Exception as e:
+            # Progress reporting must never take the workflow down.
+            logger.warning(f"Could not poll task statuses: {e!r}")
+
+
+class TraceStatusPoller:
+    """Reads task statuses from the trace records of a workflow run.
+
+    Traced tasks write a record without an ``end`` when they start and
+    fill it in when they finish, so the latest record of each task tells
+    whether it is running, done, or failed. Tasks without records are
+    left queued. Records of tasks the reporter doesn't track are ignored.
+
+    Parameters
+    ----------
+    trace_dir
+        The directory the task records are written to.
+    trace_id
+        The trace id of the workflow.
+    aliases
+        Maps the names logical tasks record to the name of the task that
+        runs them, like the tasks in a pack. A task with aliases is done
+        once all of them are done.
+    since
+        When the run started, as a unix timestamp. Only successes are read
+        from records of earlier runs of a resumed workflow, as failed tasks
+        are queued again.
+    detector
+        If provided, flags running tasks that have run much longer than
+        their finished siblings of the same template.
+
+    """
+
+    def __init__(
+        self,
+        trace_dir: Union[str, Path],
+        trace_id: str,
+        aliases: Mapping[str, str] = None,
+        since: float = None,
+        detector: StragglerDetector = None,
+    ):
+        self.trace_dir = Path(trace_dir)
+        self.trace_id = trace_id
+        self.since = since
+        self.aliases = dict(aliases) if aliases is not None else {}
+        self.detector = detector
+        # The names of the tasks flagged as stragglers.
+        self.stragglers: List[str] = []
+        self._expected: Dict[str, int] = collections.Counter(self.aliases.values())
+        # The finished tasks whose runtimes the detector has, by name and start.
+        self._recorded: Set[Tuple[str, float]] = set()
+
+    def poll(self, reporter: ProgressReporter) -> None:
+        """Update the reporter with the task statuses in the trace records."""
+        latest: Dict[str, Dict[str, Any]] = {}
+        # Records are ordered by start, so retries replace earlier attempts.
+        for record in tracing.read_task_traces(self.trace_dir, self.trace_id):
+            earlier = self.since is not None and record["start"] < self.since
+            if not earlier or record.get("success", False):
+                latest[record["task_name"]] = record
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for name, record in latest.items():
+            grouped.setdefault(self.aliases.get(name, name), []).append(record)
+        if self.detector is not None:
+            self._check_stragglers(reporter, latest)
+        for name, records in grouped.items():
+            current = reporter.get_status(name)
+            if current is None:
+                continue
+            status = self._get_status(name, records)
+            if status != current:
+                at = max(r["end"] for r in records) if status == DONE else None
+                reporter.set_status(name, status, at)
+
+    def _check_stragglers(
+        self, reporter: ProgressReporter, latest: Mapping[str, Dict[str, Any]]
+    ) -> None:
+        now = time.time()
+        running = []
+        for name, record in latest.items():
+            template = reporter.get_template(self.aliases.get(name, name))
+            if template is None:
+                continue
+            if "end" not in record:
+                running.append((name, template, now - record["start"]))
+            elif (
+                record.get("success", False) and (name, record["start"]) not in self._recorded
+            ):
+                self._recorded.add((name, record["start"]))
+                self.detector.record(template, record["end"] - record["start"])
+        for name, template, elapsed in running:
+            if name in self.stragglers or not self.detector.is_straggler(template, elapsed):
+                continue
+            self.stragglers.append(name)
+            logger.warning(
+                f"Task {name} has been running for {elapsed:.0f} seconds, longer than "
+                f"the {self.detector.threshold(template):.0f} second straggler "
+                f"threshold for {template}."
+            )
+
+    def _get_status(self, name: str, records: List[Dict[str, Any]]) -> str:
+        if any("end" not in r for r in records):
+            return RUNNING
+        if not all(r.get("success", False) for r in records):
+            return FAILED
+        if len(records) < self._expected.get(name, 1):
+            # Some logical tasks haven't started yet.
+            return RUNNING
+        return DONE
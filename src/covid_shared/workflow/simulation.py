@@ -0,0 +1,234 @@
+"""Offline simulation of workflow runs.
+
+:func:`simulate` replays a task graph with estimated task runtimes on a
+machine or cluster allocation with a fixed number of cores and, optionally,
+a fixed amount of memory. Scheduling follows the local executor: tasks
+start once their upstream tasks have finished and their compute resources
+fit, with the tasks with the longest critical paths first. The result
+estimates the makespan and utilization of a run and which task templates
+hold it up, so task specifications, packing, and concurrency limits can be
+tuned without running anything.
+
+"""
+import heapq
+import itertools
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from covid_shared.workflow.graph import critical_path, critical_path_lengths
+from covid_shared.workflow.local import parse_memory_gb
+
+UNKNOWN_TEMPLATE = "unknown"
+
+
+class TemplateStats(NamedTuple):
+    """Simulated statistics for the tasks of a task template.
+
+    Attributes
+    ----------
+    tasks
+        The number of tasks.
+    task_seconds
+        The total runtime of the tasks.
+    wait_seconds
+        The total time tasks were ready to run but waiting for resources.
+    critical_seconds
+        The runtime of the template's tasks on the critical path of the
+        task graph.
+
+    """
+
+    tasks: int
+    task_seconds: float
+    wait_seconds: float
+    critical_seconds: float
+
+
+class SimulationResult(NamedTuple):
+    """The outcome of a simulated workflow run.
+
+    Attributes
+    ----------
+    makespan
+        The simulated wall time of the run in seconds.
+    critical_path_seconds
+        The runtime of the longest chain of tasks, the shortest possible
+        makespan with unlimited resources.
+    capacity_bound_seconds
+        The total core seconds of all tasks divided by the cores, the
+        shortest possible makespan with no dependencies.
+    core_utilization
+        The fraction of available core seconds used.
+    memory_utilization
+        The fraction of available memory seconds reserved, if memory is
+        limited.
+    templates
+        Statistics by task template.
+
+    """
+
+    makespan: float
+    critical_path_seconds: float
+    capacity_bound_seconds: float
+    core_utilization: float
+    memory_utilization: Optional[float]
+    templates: Dict[str, TemplateStats]
+
+    @property
+    def bottlenecks(self) -> List[str]:
+        """Task templates ordered by how much they hold up the run: their
+        time on the critical path, then their time waiting for resources.
+
+        """
+        return sorted(
+            self.templates,
+            key=lambda name: (
+                -self.templates[name].critical_seconds,
+                -self.templates[name].wait_seconds,
+            ),
+        )
+
+    def summary(self) -> str:
+        lines = [
+            f"Simulated makespan {self.makespan / 60:.1f} minutes "
+            f"(critical path {self.critical_path_seconds / 60:.1f} minutes, "
+            f"capacity bound {self.capacity_bound_seconds / 60:.1f} minutes). "
+            f"Core utilization {self.core_utilization:.0%}"
+            + (
+                f", memory utilization {self.memory_utilization:.0%}."
+                if self.memory_utilization is not None
+                else "."
+            )
+        ]
+        for name in self.bottlenecks:
+            stats = self.templates[name]
+            lines.append(
+                f"  {name}: {stats.tasks} tasks, {stats.task_seconds / 60:.1f} task "
+                f"minutes, {stats.critical_seconds / 60:.1f} critical minutes, "
+                f"{stats.wait_seconds / 60:.1f} minutes waiting."
+            )
+        return "\n".join(lines)
+
+
+def simulate(
+    tasks: Iterable[Any],
+    runtimes: Dict[Any, float],
+    max_cores: int,
+    max_memory_gb: float = None,
+    templates: Dict[Any, str] = None,
+) -> SimulationResult:
+    """Simulate running a task graph.
+
+    Parameters
+    ----------
+    tasks
+        The tasks in the graph. Cores and memory are read from their
+        ``compute_resources``. Tasks bigger than the available resources
+        run alone.
+    runtimes
+        Estimated runtimes of the tasks in seconds, keyed by task.
+        Missing tasks take no time.
+    max_cores
+        The number of cores available to tasks.
+    max_memory_gb
+        The memory available to tasks, or None for unlimited memory.
+    templates
+        The task template of each task, keyed by task.
+
+    """
+    tasks = list(dict.fromkeys(tasks))
+    templates = templates if templates is not None else {}
+    lengths = critical_path_lengths(tasks, runtimes)
+    position = {task: i for i, task in enumerate(tasks)}
+    reservations = {task: _reservation(task, max_cores, max_memory_gb) for task in tasks}
+
+    waiting_on = {
+        task: sum(upstream in position for upstream in task.upstream_tasks) for task in tasks
+    }
+    # Ready tasks, longest critical path first, then in task order.
+    ready = [(-lengths[task], position[task], task) for task in tasks if not waiting_on[task]]
+    heapq.heapify(ready)
+    ready_since = {task: 0.0 for _, _, task in ready}
+    wait_seconds: Dict[Any, float] = {}
+    running: List = []
+    sequence = itertools.count()
+    now = 0.0
+    free_cores, free_memory_gb = max_cores, max_memory_gb
+
+    while ready or running:
+        if not running:
+            free_cores, free_memory_gb = max_cores, max_memory_gb
+        skipped = []
+        while ready and free_cores > 0:
+            entry = heapq.heappop(ready)
+            task = entry[2]
+            cores, memory_gb = reservations[task]
+            fits_memory = free_memory_gb is None or memory_gb <= free_memory_gb
+            if cores <= free_cores and fits_memory:
+                free_cores -= cores
+                if free_memory_gb is not None:
+                    free_memory_gb -= memory_gb
+                wait_seconds[task] = now - ready_since[task]
+                end = now + runtimes.get(task, 0.0)
+                heapq.heappush(running, (end, next(sequence), task))
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(ready, entry)
+
+        now = running[0][0]
+        while running and running[0][0] == now:
+            task = heapq.heappop(running)[2]
+            cores, memory_gb = reservations[task]
+            free_cores += cores
+            if free_memory_gb is not None:
+                free_memory_gb += memory_gb
+            for downstream in task.downstream_tasks:
+                if downstream in waiting_on:
+                    waiting_on[downstream] -= 1
+                    if not waiting_on[downstream]:
+                        heapq.heappush(
+                            ready,
+                            (-lengths[downstream], position[downstream], downstream),
+                        )
+                        ready_since[downstream] = now
+
+    on_critical_path = {task for task in critical_path(tasks, lengths)}
+    stats: Dict[str, Dict[str, float]] = {}
+    core_seconds = memory_seconds = 0.0
+    for task in tasks:
+        runtime = runtimes.get(task, 0.0)
+        cores, memory_gb = reservations[task]
+        core_seconds += cores * runtime
+        memory_seconds += memory_gb * runtime
+        template = stats.setdefault(
+            templates.get(task, UNKNOWN_TEMPLATE),
+            {"tasks": 0, "task_seconds": 0.0, "wait_seconds": 0.0, "critical_seconds": 0.0},
+        )
+        template["tasks"] += 1
+        template["task_seconds"] += runtime
+        template["wait_seconds"] += wait_seconds[task]
+        if task in on_critical_path:
+            template["critical_seconds"] += runtime
+
+    makespan = now
+    return SimulationResult(
+        makespan=makespan,
+        critical_path_seconds=max(lengths.values(), default=0.0),
+        capacity_bound_seconds=core_seconds / max_cores,
+        core_utilization=core_seconds / (makespan * max_cores) if makespan else 0.0,
+        memory_utilization=(
+            memory_seconds / (makespan * max_memory_gb)
+            if makespan and max_memory_gb is not None
+            else None
+        ),
+        templates={name: TemplateStats(**values) for name, values in stats.items()},
+    )
+
+
+def _reservation(task: Any, max_cores: int, max_memory_gb: Optional[float]):
+    compute_resources = getattr(task, "compute_resources", None) or {}
+    cores = min(int(compute_resources.get("cores", 1)), max_cores)
+    memory_gb = parse_memory_gb(compute_resources.get("memory", 0))
+    if max_memory_gb is not None:
+        memory_gb = min(memory_gb, max_memory_gb)
+    return cores, memory_gb
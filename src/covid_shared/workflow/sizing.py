@@ -0,0 +1,259 @@
+"""Sizing task resource requests from the observed usage of prior runs.
+
+Hand-coded resource defaults for task specifications tend to drift away
+from what tasks actually use. Requests that are too large wait longer in
+the scheduler queue and requests that are too small get tasks killed.
+:class:`ResourceUsage` collects the observed runtime, peak memory, and cpu
+time of prior runs of each task template and estimates resource requests
+as a high quantile of the observations with a safety margin. Estimates
+are passed to :class:`~covid_shared.workflow.specification.WorkflowSpecification`
+and used in place of the task specification defaults.
+
+Usage can be loaded from
+
+* job accounting exports from ``sacct --parsable2`` with (at least) the
+  ``JobID``, ``JobName``, ``State``, ``Elapsed``, and ``MaxRSS`` fields,
+  and optionally ``TotalCPU``.
+* csv files with ``task_template``, ``runtime_seconds``, and
+  ``memory_gb`` columns, and optionally ``cpu_seconds``.
+* run metadata files, which record the resource usage of the run.
+
+"""
+import csv
+import math
+import re
+import string
+from pathlib import Path
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Union
+
+DEFAULT_QUANTILE = 0.95
+DEFAULT_MARGIN = 1.2
+DEFAULT_MIN_OBSERVATIONS = 5
+
+_MEMORY_RE = re.compile(r"^(\d+(?:\.\d+)?)([KMGT]?)$")
+_MEMORY_UNITS_GB = {"": 1024**-3, "K": 1024**-2, "M": 1024**-1, "G": 1, "T": 1024}
+
+
+class _Observation(NamedTuple):
+    runtime_seconds: float
+    memory_gb: float
+    cpu_seconds: Optional[float]
+
+
+def parse_duration(duration: str) -> float:
+    """Parse a slurm duration like ``"1-02:03:04"`` or ``"03:04.500"`` into seconds."""
+    days, _, clock = duration.rpartition("-")
+    seconds = 0.0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds + (int(days) * 24 * 60 * 60 if days else 0)
+
+
+def parse_memory_gb(memory: str) -> Optional[float]:
+    """Parse a slurm memory value like ``"2048K"`` into GB."""
+    match = _MEMORY_RE.match(memory.strip().upper())
+    if not match:
+        return None
+    value, unit = match.groups()
+    return float(value) * _MEMORY_UNITS_GB[unit]
+
+
+def quantile(values: Sequence[float], q: float) -> float:
+    """Linearly interpolated quantile of a sequence of values."""
+    values = sorted(values)
+    position = q * (len(values) - 1)
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def task_name_pattern(task_name_template: str) -> "re.Pattern":
+    """Convert a task name template like ``"stage_{location_id}"`` into a
+    regular expression that matches the names of its tasks.
+
+    """
+    pattern = ""
+    for literal, field_name, _, _ in string.Formatter().parse(task_name_template):
+        pattern += re.escape(literal)
+        if field_name is not None:
+            pattern += "(.+?)"
+    return re.compile(f"^{pattern}$")
+
+
+class ResourceUsage:
+    """Observed resource usage of prior runs, by task template.
+
+    Parameters
+    ----------
+    quantile
+        The quantile of the observed usage to request.
+    margin
+        A multiplicative safety margin applied to the quantile.
+    min_observations
+        The minimum number of observations of a task template needed
+        before estimates are made for it.
+
+    """
+
+    def __init__(
+        self,
+        quantile: float = DEFAULT_QUANTILE,
+        margin: float = DEFAULT_MARGIN,
+        min_observations: int = DEFAULT_MIN_OBSERVATIONS,
+    ):
+        if not 0 <= quantile <= 1:
+            raise ValueError(f"Quantile must be between 0 and 1. Got {quantile}.")
+        if margin < 1:
+            raise ValueError(f"Safety margin must be at least 1. Got {margin}.")
+        self.quantile = quantile
+        self.margin = margin
+        self.min_observations = min_observations
+        self._observations: Dict[str, List[_Observation]] = {}
+
+    def add(
+        self,
+        task_template: str,
+        runtime_seconds: float,
+        memory_gb: float,
+        cpu_seconds: float = None,
+    ) -> None:
+        """Record the resource usage of a single run of a task."""
+        self._observations.setdefault(task_template, []).append(
+            _Observation(float(runtime_seconds), float(memory_gb), cpu_seconds)
+        )
+
+    def add_run_metadata(
+        self, task_template: str, metadata: Union[str, Path, Mapping]
+    ) -> None:
+        """Record the resource usage stored in run metadata.
+
+        Parameters
+        ----------
+        task_template
+            The task template the run belongs to.
+        metadata
+            A run metadata mapping or the path to a metadata file.
+
+        """
+        if not isinstance(metadata, Mapping):
+            import yaml
+
+            with Path(metadata).open() as metadata_file:
+                metadata = yaml.full_load(metadata_file)
+        usage = metadata.get("resource_usage")
+        if usage is not None:
+            self.add(
+                task_template,
+                usage["wall_seconds"],
+                usage["max_rss_gb"],
+                usage.get("cpu_seconds"),
+            )
+
+    def add_csv(self, path: Union[str, Path]) -> None:
+        """Record resource usage from a csv file."""
+        with Path(path).open(newline="") as usage_file:
+            for row in csv.DictReader(usage_file):
+                cpu_seconds = row.get("cpu_seconds")
+                self.add(
+                    row["task_template"],
+                    float(row["runtime_seconds"]),
+                    float(row["memory_gb"]),
+                    float(cpu_seconds) if cpu_seconds else None,
+                )
+
+    def add_sacct(
+        self, path: Union[str, Path], task_name_templates: Mapping[str, str]
+    ) -> None:
+        """Record resource usage from a ``sacct --parsable2`` export.
+
+        Only completed jobs are used, as jobs that were killed for running
+        out of time or memory understate what they need.
+
+        Parameters
+        ----------
+        path
+            The path of the export.
+        task_name_templates
+            A mapping of task template names to the templates of their task
+            names, used to work out which template each job belongs to.
+            Jobs that don't match any template are ignored.
+
+        """
+        # Match the most specific templates first.
+        patterns = sorted(
+            ((name, task_name_pattern(t)) for name, t in task_name_templates.items()),
+            key=lambda item: -len(item[1].pattern),
+        )
+        jobs: Dict[str, Dict[str, str]] = {}
+        max_rss: Dict[str, float] = {}
+        with Path(path).open(newline="") as usage_file:
+            for row in csv.DictReader(usage_file, delimiter="|"):
+                job_id, _, step = row["JobID"].partition(".")
+                if not step:
+                    jobs[job_id] = row
+                # Peak memory is reported on job steps.
+                memory_gb = parse_memory_gb(row.get("MaxRSS") or "")
+                if memory_gb is not None:
+                    max_rss[job_id] = max(memory_gb, max_rss.get(job_id, 0.0))
+
+        for job_id, job in jobs.items():
+            if not job["State"].startswith("COMPLETED") or job_id not in max_rss:
+                continue
+            task_template = next(
+                (name for name, pattern in patterns if pattern.match(job["JobName"])), None
+            )
+            if task_template is None:
+                continue
+            total_cpu = job.get("TotalCPU")
+            self.add(
+                task_template,
+                parse_duration(job["Elapsed"]),
+                max_rss[job_id],
+                parse_duration(total_cpu) if total_cpu else None,
+            )
+
+    def observations(self, task_template: str) -> int:
+        """The number of observations recorded for a task template."""
+        return len(self._observations.get(task_template, []))
+
+    def estimate(self, task_template: str) -> Optional[Dict[str, float]]:
+        """Estimate resource requests for a task template.
+
+        Returns
+        -------
+        Optional[Dict[str, float]]
+            Estimated ``max_runtime_seconds``, ``memory_gb``, and, if cpu
+            time was observed, ``num_cores``, or None if there are too few
+            observations of the task template. Estimates are not rounded or
+            bounded.
+
+        """
+        observations = self._observations.get(task_template, [])
+        if len(observations) < max(self.min_observations, 1):
+            return None
+
+        estimate = {
+            "max_runtime_seconds": self._size([o.runtime_seconds for o in observations]),
+            "memory_gb": self._size([o.memory_gb for o in observations]),
+        }
+        parallelism = [
+            o.cpu_seconds / o.runtime_seconds
+            for o in observations
+            if o.cpu_seconds is not None and o.runtime_seconds > 0
+        ]
+        if parallelism:
+            estimate["num_cores"] = self._size(parallelism)
+        return estimate
+
+    def expected_runtime(self, task_template: str) -> Optional[float]:
+        """The median observed runtime of a task template in seconds, or
+        None if it hasn't been observed.
+
+        """
+        observations = self._observations.get(task_template, [])
+        if not observations:
+            return None
+        return quantile([o.runtime_seconds for o in observations], 0.5)
+
+    def _size(self, values: Sequence[float]) -> float:
+        return quantile(values, self.quantile) * self.margin
@@ -1,10 +1,13 @@
 """Primitives for construction jobmon workflow specifications."""
 import abc
+import math
 import re
-from typing import Dict, Type, TypeVar, Union
+from typing import Dict, Optional, Tuple, Type, TypeVar, Union
 
 from loguru import logger
 
+from covid_shared.workflow.sizing import ResourceUsage
+
 DEFAULT_PROJECT = "proj_covid"
 DEFAULT_QUEUE = "d.q"
 
@@ -24,6 +27,11 @@ class TaskSpecification:
     is parsed and then the full task specification will be validated against
     the values in the `validate` method of this class.
 
+    Defaults can also be sized from observed resource usage by passing a
+    resource estimate from :class:`~covid_shared.workflow.sizing.ResourceUsage`.
+    Estimates replace the class defaults (after rounding up and clipping to
+    the allowed bounds) but never values given in the specification.
+
     """
 
     # Class variables meant to be overridden by subclasses.
@@ -37,15 +45,20 @@ class TaskSpecification:
     _mem_bounds_gb = [1, 1000]
     _num_core_bounds = [1, 79]
 
-    def __init__(self, task_specification_dict: _TaskSpecDict):
+    def __init__(
+        self,
+        task_specification_dict: _TaskSpecDict,
+        resource_estimate: Dict[str, float] = None,
+    ):
         self.name = self.__class__.__name__
+        defaults = self._get_defaults(resource_estimate)
         key_aliases_and_defaults = {
             "max_runtime_seconds": (
                 ("max_runtime_seconds", "runtime"),
-                self.default_max_runtime_seconds,
+                defaults["max_runtime_seconds"],
             ),
-            "m_mem_free": (("m_mem_free", "memory"), self.default_m_mem_free),
-            "num_cores": (("num_cores", "cores"), self.default_num_cores),
+            "m_mem_free": (("m_mem_free", "memory"), defaults["m_mem_free"]),
+            "num_cores": (("num_cores", "cores"), defaults["num_cores"]),
         }
         params = {}
         for key, (aliases, default) in key_aliases_and_defaults.items():
@@ -54,11 +67,9 @@ class TaskSpecification:
                 if alias in task_specification_dict:
                     params[key] = task_specification_dict.pop(alias)
 
-        self.max_runtime_seconds = task_specification_dict.pop(
-            "max_runtime_seconds", self.default_max_runtime_seconds
-        )
-        self.m_mem_free = task_specification_dict.pop("m_mem_free", self.default_m_mem_free)
-        self.num_cores = task_specification_dict.pop("num_cores", self.default_num_cores)
+        self.max_runtime_seconds = params["max_runtime_seconds"]
+        self.m_mem_free = params["m_mem_free"]
+        self.num_cores = params["num_cores"]
         # Workflow specification guarantees this will be present.
         self.queue = task_specification_dict.pop("queue")
 
@@ -68,6 +79,35 @@ class TaskSpecification:
                 f"These options will be ignored."
             )
 
+    def _get_defaults(
+        self, resource_estimate: Optional[Dict[str, float]]
+    ) -> Dict[str, Union[str, int]]:
+        """Resolve class defaults with any estimated resource requests."""
+        defaults = {
+            "max_runtime_seconds": self.default_max_runtime_seconds,
+            "m_mem_free": self.default_m_mem_free,
+            "num_cores": self.default_num_cores,
+        }
+        if not resource_estimate:
+            return defaults
+
+        def _clip(value: float, bounds) -> int:
+            return int(min(max(math.ceil(value), bounds[0]), bounds[1]))
+
+        if "max_runtime_seconds" in resource_estimate:
+            defaults["max_runtime_seconds"] = _clip(
+                resource_estimate["max_runtime_seconds"], self._runtime_bounds
+            )
+        if "memory_gb" in resource_estimate:
+            memory_gb = _clip(resource_estimate["memory_gb"], self._mem_bounds_gb)
+            defaults["m_mem_free"] = f"{memory_gb}G"
+        if "num_cores" in resource_estimate:
+            defaults["num_cores"] = _clip(
+                resource_estimate["num_cores"], self._num_core_bounds
+            )
+        logger.debug(f"Sized {self.name} defaults from resource usage: {defaults}.")
+        return defaults
+
     def __init_subclass__(cls, **kwargs):
         name = cls.__name__
 
@@ -150,6 +190,65 @@ class TaskSpecification:
             "queue": self.queue,
         }
 
+    def fit_packing(self, size: int, workers: int = 1) -> Tuple[int, int]:
+        """Shrink a packing until its jobs fit in the allowed bounds.
+
+        Parameters
+        ----------
+        size
+            The maximum number of these tasks per job.
+        workers
+            The number of these tasks to run at once in a job.
+
+        Returns
+        -------
+        Tuple[int, int]
+            The largest size and workers, no larger than those given, for
+            which :meth:`to_packed_dict` gives every task the resources of
+            its specification.
+
+        """
+        memory_gb = int(self.m_mem_free[:-1])
+        workers = min(
+            workers,
+            self._mem_bounds_gb[1] // memory_gb,
+            self._num_core_bounds[1] // self.num_cores,
+        )
+        rounds = self._runtime_bounds[1] // self.max_runtime_seconds
+        return max(min(size, rounds * workers), 1), max(workers, 1)
+
+    def to_packed_dict(self, num_tasks: int, workers: int = 1) -> Dict[str, Union[str, int]]:
+        """Resources for a job running ``num_tasks`` of these tasks with
+        ``workers`` of them at a time.
+
+        Raises a ValueError if the job would need more than the allowed
+        bounds. Use :meth:`fit_packing` to find a packing that fits.
+
+        """
+        workers = max(min(workers, num_tasks), 1)
+        rounds = math.ceil(num_tasks / workers)
+        runtime = self.max_runtime_seconds * rounds
+        memory_gb = int(self.m_mem_free[:-1]) * workers
+        num_cores = self.num_cores * workers
+        if (
+            runtime > self._runtime_bounds[1]
+            or memory_gb > self._mem_bounds_gb[1]
+            or num_cores > self._num_core_bounds[1]
+        ):
+            raise ValueError(
+                f"A job packing {num_tasks} tasks of {self.name} with {workers} workers "
+                f"needs a runtime of {runtime}, {memory_gb}G of memory, and {num_cores} "
+                f"cores, which is more than the allowed runtime of "
+                f"{self._runtime_bounds[1]}, memory of {self._mem_bounds_gb[1]}G, or "
+                f"cores of {self._num_core_bounds[1]}."
+            )
+        return {
+            "runtime": runtime,
+            "memory": f"{memory_gb}G",
+            "cores": num_cores,
+            "queue": self.queue,
+        }
+
     def __repr__(self):
         return f'{self.name}({", ".join([f"{k}={v}" for k, v in self.to_dict().items()])})'
 
@@ -179,10 +278,12 @@ class WorkflowSpecification(abc.ABC):
         tasks: Dict[str, Dict[str, Union[int, str]]] = None,
         project: str = None,
         queue: str = None,
+        resource_usage: ResourceUsage = None,
     ):
         self.name: str = self.__class__.__name__
         self.project: str = project if project is not None else DEFAULT_PROJECT
         self.queue: str = queue if queue is not None else DEFAULT_QUEUE
+        self.resource_usage = resource_usage
 
         # Check everything's okay before making the task specs
         self.validate()
@@ -217,7 +318,12 @@ class WorkflowSpecification(abc.ABC):
         for task_name, spec_class in self.tasks.items():
             task_spec_dict = task_specification_dicts.pop(task_name, {})
             task_spec_dict["queue"] = self.queue
-            task_specifications[task_name] = spec_class(task_spec_dict)
+            resource_estimate = (
+                self.resource_usage.estimate(task_name)
+                if self.resource_usage is not None
+                else None
+            )
+            task_specifications[task_name] = spec_class(task_spec_dict, resource_estimate)
 
         if task_specification_dicts:
             logger.warning(
@@ -0,0 +1,96 @@
+"""Detecting straggling tasks.
+
+A few tasks landing on slow or unhealthy nodes can hold up a whole
+workflow. Tasks from the same template tend to take similar amounts of
+time, so a task that has been running much longer than most of its
+finished siblings is likely stuck rather than slow. The local executor
+uses a :class:`StragglerDetector` to flag such tasks and, if the
+:class:`StragglerPolicy` allows it, to run a speculative copy of each
+straggler and keep whichever copy finishes first. Jobmon workflows flag
+stragglers from the trace records of their tasks (see
+:class:`covid_shared.workflow.progress.TraceStatusPoller`) but never
+speculate.
+
+"""
+from typing import Dict, List, NamedTuple, Optional
+
+from covid_shared.workflow.sizing import quantile
+
+
+class StragglerPolicy(NamedTuple):
+    """How to detect and handle straggling tasks.
+
+    Attributes
+    ----------
+    quantile
+        The quantile of the runtimes of finished sibling tasks to compare
+        running tasks against.
+    multiplier
+        How many times the quantile a task must run for before it is a
+        straggler.
+    min_siblings
+        The number of sibling tasks that must finish before tasks of a
+        template can be flagged.
+    speculate
+        Whether to run a speculative copy of stragglers. Both copies run
+        the same command at once, so only tasks that commit their outputs
+        atomically (see :func:`covid_shared.shell_tools.atomic_output`)
+        are safe to copy. Workflow templates only copy tasks of task
+        templates that set ``atomic_outputs``. Only supported by the
+        local backend.
+    check_interval
+        How often to check for stragglers, in seconds.
+
+    """
+
+    quantile: float = 0.9
+    multiplier: float = 1.5
+    min_siblings: int = 5
+    speculate: bool = False
+    check_interval: float = 10.0
+
+
+class StragglerDetector:
+    """Flags tasks that run much longer than their finished siblings.
+
+    Parameters
+    ----------
+    policy
+        How to detect stragglers.
+
+    """
+
+    def __init__(self, policy: StragglerPolicy = None):
+        self.policy = policy if policy is not None else StragglerPolicy()
+        if not 0 <= self.policy.quantile <= 1:
+            raise ValueError(f"Quantile must be between 0 and 1. Got {self.policy.quantile}.")
+        self._runtimes: Dict[str, List[float]] = {}
+        self._thresholds: Dict[str, Optional[float]] = {}
+
+    def record(self, template: str, runtime: float) -> None:
+        """Record the runtime of a finished task."""
+        self._runtimes.setdefault(template, []).append(runtime)
+        self._thresholds.pop(template, None)
+
+    def threshold(self, template: str) -> Optional[float]:
+        """The runtime after which tasks of a template are stragglers, or
+        None if too few of them have finished.
+
+        """
+        if template not in self._thresholds:
+            runtimes = self._runtimes.get(template, [])
+            if len(runtimes) < max(self.policy.min_siblings, 1):
+                self._thresholds[template] = None
+            else:
+                self._thresholds[template] = (
+                    quantile(runtimes, self.policy.quantile) * self.policy.multiplier
+                )
+        return self._thresholds[template]
+
+    def is_straggler(self, template: str, elapsed: float) -> bool:
+        """Whether a task of a template that has been running for
+        ``elapsed`` seconds is a straggler.
+
+        """
+        threshold = self.threshold(template)
+        return threshold is not None and elapsed > threshold
@@ -1,16 +1,66 @@
 """Primitives for construction jobmon workflows."""
 import abc
 import functools
+import hashlib
+import time
 from pathlib import Path
-from typing import Dict, Type, TypeVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from loguru import logger
 
-from covid_shared import paths
-from covid_shared.ihme_deps import Task, WorkflowRunStatus
+from covid_shared import ihme_deps, paths, shell_tools
+from covid_shared.cli_tools import tracing
+from covid_shared.cli_tools.timing import span
+from covid_shared.workflow.graph import (
+    critical_path,
+    critical_path_lengths,
+    topological_sort,
+)
+from covid_shared.workflow.incremental import (
+    FINGERPRINTS,
+    FingerprintStore,
+    TaskFiles,
+    prune_up_to_date,
+    record_fingerprints,
+)
+from covid_shared.workflow.local import (
+    LOCAL_BACKEND,
+    LocalTool,
+    LocalWorkflowRunStatus,
+    get_workflow_backend,
+)
+from covid_shared.workflow.packing import (
+    TaskPacking,
+    get_packed_command,
+    write_manifest,
+)
+from covid_shared.workflow.progress import (
+    DEFAULT_INTERVAL,
+    ProgressReporter,
+    TraceStatusPoller,
+)
+from covid_shared.workflow.simulation import SimulationResult, simulate
 from covid_shared.workflow.specification import TaskSpecification, WorkflowSpecification
+from covid_shared.workflow.stragglers import StragglerDetector, StragglerPolicy
 from covid_shared.workflow.utilities import JobmonTool, get_cluster_name, make_log_dirs
 
+if TYPE_CHECKING:
+    # Pandas is slow to import and only needed here for annotations.
+    import pandas as pd
+
 
 class TaskTemplate(abc.ABC):
     """Factory class for a parameterized task.
@@ -20,6 +70,25 @@ class TaskTemplate(abc.ABC):
     job names from the task args and ``command_template`` which will
     resolve the task args into a job executable by bash.
 
+    Templates can be packed with :meth:`enable_packing`, in which case
+    :meth:`get_tasks` merges many logical tasks into each cluster job.
+
+    Subclasses may also list the files each task reads and writes as path
+    templates in the ``inputs`` and ``outputs`` class variables. They are
+    resolved with the task args like the command and let incremental
+    workflows skip tasks whose outputs are up to date.
+
+    ``max_attempts`` sets how many times each task is tried.
+
+    ``atomic_outputs`` declares that tasks commit their outputs atomically
+    (see :func:`covid_shared.shell_tools.atomic_output`), so two copies of
+    a task can safely run at once. Only such tasks are run speculatively
+    by a workflow's straggler policy.
+
+    ``runtime_estimate`` is the expected runtime of a task in seconds,
+    used to prioritize tasks. It defaults to the max runtime of the task
+    specification.
+
     """
 
     task_name_template: str
@@ -27,26 +96,214 @@ class TaskTemplate(abc.ABC):
     node_args: list
     task_args: list
     tool: JobmonTool
+    inputs: List[str] = []
+    outputs: List[str] = []
+    max_attempts: int = 1
+    atomic_outputs: bool = False
 
-    def __init__(self, name: str, task_specification: TaskSpecification):
-        self.jobmon_template = self.tool.get_task_template(
+    def __init__(
+        self,
+        name: str,
+        task_specification: TaskSpecification,
+        tool: Union[JobmonTool, LocalTool] = None,
+    ):
+        self.name = name
+        tool = tool if tool is not None else self.tool
+        self.jobmon_template = tool.get_task_template(
             template_name=name,
             command_template=self.command_template,
             node_args=self.node_args,
             task_args=self.task_args,
         )
+        self.task_specification = task_specification
         self.params = task_specification.to_dict()
+        self.runtime_estimate: float = task_specification.max_runtime_seconds
+
+        self._command_prefix = ""
+        self.packing: Optional[TaskPacking] = None
+        self._packs_created = 0
+        # The declared files and estimated runtime of each task created.
+        self.task_files: Dict["ihme_deps.Task", TaskFiles] = {}
+        self.task_runtimes: Dict["ihme_deps.Task", float] = {}
+        # The pack running each packed logical task, by task name.
+        self.packed_task_names: Dict[str, str] = {}
+
+    def enable_tracing(
+        self, trace_env: Dict[str, str], tool: Union[JobmonTool, LocalTool] = None
+    ) -> None:
+        """Run this template's tasks with a trace environment.
+
+        Must be enabled before packing.
+
+        """
+        tool = tool if tool is not None else self.tool
+        prefix = tracing.get_trace_command_prefix(trace_env)
+        # Escape braces so the prefix survives command template formatting.
+        self._command_prefix = prefix.replace("{", "{{").replace("}", "}}")
+        self.jobmon_template = tool.get_task_template(
+            template_name=self.name,
+            command_template=self._command_prefix + self.command_template,
+            node_args=self.node_args,
+            task_args=self.task_args,
+        )
+
+    def enable_packing(
+        self,
+        packing: TaskPacking,
+        manifest_dir: Union[str, Path],
+        tool: Union[JobmonTool, LocalTool] = None,
+    ) -> None:
+        """Pack the tasks created by :meth:`get_tasks` into larger jobs.
+
+        Each job runs up to ``packing.size`` logical tasks from a manifest
+        written to ``manifest_dir``. Job resources are derived from the
+        task specification with
+        :meth:`~covid_shared.workflow.specification.TaskSpecification.to_packed_dict`.
+        Packings whose jobs would need more than the allowed resources are
+        shrunk to fit with a warning.
 
-    def get_task(self, *_, **kwargs) -> Task:
+        """
+        tool = tool if tool is not None else self.tool
+        size, workers = self.task_specification.fit_packing(packing.size, packing.workers)
+        if (size, workers) != (packing.size, packing.workers):
+            logger.warning(
+                f"Packs of {packing.size} {self.name} tasks with {packing.workers} "
+                f"workers would exceed the allowed job resources. Packing "
+                f"{size} tasks with {workers} workers instead."
+            )
+            packing = packing._replace(size=size, workers=workers)
+        self.packing = packing
+        self._manifest_dir = Path(manifest_dir)
+        shell_tools.mkdir(self._manifest_dir, exists_ok=True, parents=True)
+        self.packed_jobmon_template = tool.get_task_template(
+            template_name=f"{self.name}_packed",
+            command_template=self._command_prefix + get_packed_command("{manifest}"),
+            node_args=["manifest"],
+            task_args=[],
+        )
+        self._packed_params: Dict[int, Dict[str, Union[str, int]]] = {}
+
+    def get_task(self, *_, **kwargs) -> "ihme_deps.Task":
         """Resolve job arguments into a bash executable task for jobmon."""
         task = self.jobmon_template.create_task(
             compute_resources=self.params,
             name=self.task_name_template.format(**kwargs),
-            max_attempts=1,
+            max_attempts=self.max_attempts,
             **kwargs,
         )
+        self._record_files(task, kwargs)
+        self.task_runtimes[task] = self.runtime_estimate
         return task
 
+    def _record_files(self, task: "ihme_deps.Task", kwargs: Dict[str, Any]) -> None:
+        if self.inputs or self.outputs:
+            files = TaskFiles(
+                tuple(Path(path.format(**kwargs)) for path in self.inputs),
+                tuple(Path(path.format(**kwargs)) for path in self.outputs),
+            )
+            previous = self.task_files.get(task)
+            self.task_files[task] = files if previous is None else previous.merge(files)
+
+    def get_tasks(
+        self, task_args: Union["pd.DataFrame", Mapping[str, Sequence[Any]]]
+    ) -> List["ihme_deps.Task"]:
+        """Resolve columns of job arguments into tasks in bulk.
+
+        All tasks share this template's compute resources rather than
+        getting their own copy.
+
+        If packing is enabled, rows are packed into jobs and the returned
+        list holds the job of each row, so rows in the same job share a
+        task. Use :meth:`WorkflowTemplate.add_tasks` to add them to the
+        workflow.
+
+        Parameters
+        ----------
+        task_args
+            A data frame or mapping of argument names to equal length
+            columns of argument values (lists, arrays, or series). Each row
+            is resolved into one task as with :meth:`get_task`.
+
+        """
+        columns = {}
+        for arg_name in task_args:
+            column = task_args[arg_name]
+            # Convert numpy scalars to python objects for jobmon.
+            columns[arg_name] = column.tolist() if hasattr(column, "tolist") else list(column)
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(
+                f"All task argument columns must have the same length. Got lengths "
+                f"{ {arg_name: len(column) for arg_name, column in columns.items()} }."
+            )
+
+        arg_names = list(columns)
+        if self.packing is not None:
+            return self._get_packed_tasks(arg_names, list(zip(*columns.values())))
+
+        name_template = self.task_name_template
+        create_task = self.jobmon_template.create_task
+        compute_resources = self.params
+        with span(f"get_tasks[{self.name}]") as s:
+            tasks = []
+            for row in zip(*columns.values()):
+                kwargs = dict(zip(arg_names, row))
+                task = create_task(
+                    compute_resources=compute_resources,
+                    name=name_template.format(**kwargs),
+                    max_attempts=self.max_attempts,
+                    **kwargs,
+                )
+                self._record_files(task, kwargs)
+                self.task_runtimes[task] = self.runtime_estimate
+                tasks.append(task)
+            s.add("tasks", len(tasks))
+        return tasks
+
+    def _get_packed_tasks(
+        self, arg_names: List[str], rows: List[Tuple]
+    ) -> List["ihme_deps.Task"]:
+        packing = self.packing
+        tasks = []
+        with span(f"get_tasks[{self.name}]") as s:
+            for start in range(0, len(rows), packing.size):
+                logical_tasks = []
+                pack_kwargs = []
+                for row in rows[start : start + packing.size]:
+                    kwargs = dict(zip(arg_names, row))
+                    pack_kwargs.append(kwargs)
+                    logical_tasks.append(
+                        {
+                            "name": self.task_name_template.format(**kwargs),
+                            "command": self.command_template.format(**kwargs),
+                        }
+                    )
+                pack_name = f"{self.name}_pack_{self._packs_created:05d}"
+                self._packs_created += 1
+                manifest_path = self._manifest_dir / f"{pack_name}.json"
+                write_manifest(manifest_path, logical_tasks, packing)
+
+                num_tasks = len(logical_tasks)
+                if num_tasks not in self._packed_params:
+                    self._packed_params[num_tasks] = self.task_specification.to_packed_dict(
+                        num_tasks, packing.workers
+                    )
+                pack = self.packed_jobmon_template.create_task(
+                    compute_resources=self._packed_params[num_tasks],
+                    name=pack_name,
+                    max_attempts=self.max_attempts,
+                    manifest=str(manifest_path),
+                )
+                for kwargs, logical_task in zip(pack_kwargs, logical_tasks):
+                    self._record_files(pack, kwargs)
+                    self.packed_task_names[logical_task["name"]] = pack_name
+                rounds = -(-num_tasks // packing.workers)
+                self.task_runtimes[pack] = self.runtime_estimate * rounds
+                tasks.extend([pack] * num_tasks)
+                s.add("packs")
+            s.add("tasks", len(rows))
+        return tasks
+
 
 TTaskTemplate = TypeVar("TTaskTemplate", bound=TaskTemplate)
 
@@ -71,23 +328,127 @@ class WorkflowTemplate(abc.ABC):
     which takes relevant model parameters as arguments and builds and attaches
     an appropriate task dag to the jobmon workflow.
 
+    Passing ``backend="local"`` (or setting the ``COVID_SHARED_WORKFLOW_BACKEND``
+    environment variable) swaps jobmon for a local executor that runs the
+    task commands in subprocesses on the current machine, so a workflow can
+    be run and benchmarked off the cluster.
+
+    Task templates that produce many very short tasks can be packed by
+    mapping their names to a pack size or a
+    :class:`~covid_shared.workflow.packing.TaskPacking` in the
+    ``packed_task_templates`` class variable.
+
+    Tasks added with :meth:`add_tasks` are only submitted to the workflow
+    when it runs. Tasks added directly to ``self.workflow`` still run and
+    are prioritized, reported on, and simulated, but are never pruned. If
+    ``incremental`` is set, tasks whose declared outputs
+    are up to date with their inputs are pruned first and only the
+    invalidated parts of the graph run (see
+    :mod:`covid_shared.workflow.incremental`). ``fingerprint`` selects how
+    outputs are checked against inputs, ``"mtime"`` or ``"hash"``.
+
+    Tasks are submitted so that those with the longest chains of work
+    downstream of them start first, using each task template's
+    ``runtime_estimate`` (the median observed runtime if the workflow
+    specification has resource usage for it), and the estimated critical
+    path of the workflow is logged before it runs. :meth:`simulate`
+    estimates how long the attached tasks will take to run on a given
+    number of cores without running them.
+
+    A :class:`~covid_shared.workflow.stragglers.StragglerPolicy` in the
+    ``straggler_policy`` class variable flags tasks that run much longer
+    than their finished siblings. With the local backend, it can also run
+    speculative copies of the tasks of templates that set
+    ``atomic_outputs``. Jobmon workflows flag stragglers from trace
+    records at each progress report, so they need ``trace`` set and
+    can't speculate.
+
+    If ``trace`` is set, tasks run with a trace id and directory in their
+    environment, so applications wrapped with
+    :func:`~covid_shared.cli_tools.metadata.monitor_application` record
+    their timing and resource usage. After each run, the records are
+    merged into a Chrome trace timeline and a summary table in the
+    version's log directory (see :mod:`covid_shared.cli_tools.tracing`).
+
+    Progress is logged every ``progress_interval`` seconds while the
+    workflow runs and, if ``progress_status`` is set, written to
+    ``progress.json`` in the version's log directory (see
+    :mod:`covid_shared.workflow.progress`). Jobmon workflows only report
+    task statuses if ``trace`` is set.
+
     """
 
     tool: JobmonTool
     workflow_name_template: str = None
     task_template_classes: Dict[str, Type[TTaskTemplate]]
+    packed_task_templates: Dict[str, Union[int, TaskPacking]] = {}
     fail_fast: bool = True
+    incremental: bool = False
+    fingerprint: str = "mtime"
+    straggler_policy: Optional[StragglerPolicy] = None
+    trace: bool = False
+    progress_interval: float = DEFAULT_INTERVAL
+    progress_status: bool = False
 
-    def __init__(self, version: str, workflow_specification: WorkflowSpecification):
+    def __init__(
+        self,
+        version: str,
+        workflow_specification: WorkflowSpecification,
+        backend: str = None,
+    ):
         self.version = version
+        if self.fingerprint not in FINGERPRINTS:
+            raise ValueError(
+                f"Unknown fingerprint {self.fingerprint}. Fingerprint must be one of "
+                f"{FINGERPRINTS}."
+            )
+        self.backend = get_workflow_backend(backend)
+        policy = self.straggler_policy
+        if policy is not None and self.backend != LOCAL_BACKEND:
+            # Jobmon doesn't report running task durations back to us, so
+            # stragglers are flagged from the trace records.
+            if not self.trace:
+                raise ValueError(
+                    "Straggler detection with the jobmon backend requires trace=True."
+                )
+            if policy.speculate:
+                raise ValueError(
+                    "Speculative execution is only supported by the local backend. "
+                    "Use max_attempts and max runtimes to recover from stuck jobmon "
+                    "tasks."
+                )
+        # The tasks added so far, in order.
+        self._tasks: Dict["ihme_deps.Task", None] = {}
+        tool = LocalTool() if self.backend == LOCAL_BACKEND else self.tool
         assert workflow_specification.tasks.keys() == self.task_template_classes.keys()
         self.task_templates = self.build_task_templates(
-            workflow_specification.task_specifications
+            workflow_specification.task_specifications, tool
         )
+        resource_usage = workflow_specification.resource_usage
+        if resource_usage is not None:
+            for task_name, task_template in self.task_templates.items():
+                runtime = resource_usage.expected_runtime(task_name)
+                if runtime is not None:
+                    task_template.runtime_estimate = runtime
 
         stdout, stderr = make_log_dirs(Path(version) / paths.LOG_DIR)
+        workflow_name = self.workflow_name_template.format(version=version)
+        self.trace_dir = Path(version) / paths.LOG_DIR / "traces"
+        # Derived from the workflow name so resumed workflows keep their commands.
+        self.trace_id = hashlib.sha1(workflow_name.encode()).hexdigest()[:16]
+        if self.trace:
+            shell_tools.mkdir(self.trace_dir, exists_ok=True, parents=True)
+            trace_env = tracing.get_trace_env(self.trace_id, self.trace_dir)
+            for task_template in self.task_templates.values():
+                task_template.enable_tracing(trace_env, tool)
+        for task_name, packing in self.packed_task_templates.items():
+            if isinstance(packing, int):
+                packing = TaskPacking(packing)
+            self.task_templates[task_name].enable_packing(
+                packing, Path(version) / paths.LOG_DIR / "packing", tool
+            )
 
-        cluster = get_cluster_name()
+        cluster = LOCAL_BACKEND if self.backend == LOCAL_BACKEND else get_cluster_name()
 
         resources = {
             "stdout": stdout,
@@ -95,14 +456,34 @@ class WorkflowTemplate(abc.ABC):
             "project": workflow_specification.project,
         }
 
-        self.workflow = self.tool.create_workflow(
-            name=self.workflow_name_template.format(version=version),
+        workflow_kwargs = {}
+        if self.backend == LOCAL_BACKEND:
+            workflow_kwargs["straggler_policy"] = policy
+            # Packs aren't copied, as both copies would update the pack's status.
+            speculative_templates = [
+                task_template.name
+                for task_template in self.task_templates.values()
+                if task_template.atomic_outputs
+            ]
+            workflow_kwargs["speculative_templates"] = speculative_templates
+            if policy is not None and policy.speculate and not speculative_templates:
+                logger.warning(
+                    "The straggler policy speculates, but no task template sets "
+                    "atomic_outputs. Stragglers will only be flagged."
+                )
+        self.workflow = tool.create_workflow(
+            name=workflow_name,
             default_cluster_name=cluster,
             default_compute_resources_set={
                 cluster: resources,
             },
+            **workflow_kwargs,
         )
 
+        if self.backend == LOCAL_BACKEND:
+            # Local workflows keep track of their own run ids.
+            return
+
         ##############
         # GROSS HACK #
         ##############
@@ -137,23 +518,178 @@ class WorkflowTemplate(abc.ABC):
         setattr(original_method.__self__, original_method.__name__, rebound_method)
 
     def build_task_templates(
-        self, task_specifications: Dict[str, TaskSpecification]
+        self,
+        task_specifications: Dict[str, TaskSpecification],
+        tool: Union[JobmonTool, LocalTool] = None,
     ) -> Dict[str, TaskTemplate]:
         """Parses task specifications into task templates."""
         task_templates = {}
         for task_name, task_specification in task_specifications.items():
             task_templates[task_name] = self.task_template_classes[task_name](
-                task_name, task_specification
+                task_name, task_specification, tool
             )
         return task_templates
 
+    def add_tasks(self, tasks: Iterable["ihme_deps.Task"]) -> None:
+        """Add tasks to the workflow, skipping repeats (e.g. the packed jobs
+        returned by :meth:`TaskTemplate.get_tasks`).
+
+        Tasks are submitted to the workflow when it runs.
+
+        """
+        for task in tasks:
+            self._tasks.setdefault(task)
+
     @abc.abstractmethod
     def attach_tasks(self, *args, **kwargs) -> None:
         """Turn model arguments into jobmon workflow tasks."""
         pass
 
+    def prioritize(self, tasks: List["ihme_deps.Task"]) -> List["ihme_deps.Task"]:
+        """Order tasks for submission by their critical path lengths and log
+        the critical path of the workflow.
+
+        """
+        runtimes = {}
+        for task_template in self.task_templates.values():
+            runtimes.update(task_template.task_runtimes)
+        lengths = critical_path_lengths(tasks, runtimes)
+        path = critical_path(tasks, lengths)
+        if path:
+            names = [task.name for task in path]
+            if len(names) > 10:
+                names = names[:5] + ["..."] + names[-4:]
+            logger.info(
+                f"Estimated critical path of {lengths[path[0]] / 60:.1f} minutes "
+                f"through {len(path)} tasks: {' -> '.join(names)}."
+            )
+        if self.backend == LOCAL_BACKEND:
+            for task in tasks:
+                task.priority = lengths[task]
+        return topological_sort(tasks, lengths)
+
+    def simulate(
+        self,
+        max_cores: int,
+        max_memory_gb: float = None,
+        runtimes: Dict[str, float] = None,
+    ) -> SimulationResult:
+        """Simulate running the tasks added to the workflow.
+
+        Parameters
+        ----------
+        max_cores
+            The number of cores (or cluster slots) available to tasks.
+        max_memory_gb
+            The memory available to tasks, or None for unlimited memory.
+        runtimes
+            Runtimes in seconds of the tasks of each task template,
+            overriding the templates' ``runtime_estimate``. Overrides for
+            templates with a zero runtime estimate are ignored.
+
+        """
+        runtimes = runtimes if runtimes is not None else {}
+        task_runtimes = {}
+        for task_name, task_template in self.task_templates.items():
+            scale = 1.0
+            if task_name in runtimes:
+                if task_template.runtime_estimate > 0:
+                    scale = runtimes[task_name] / task_template.runtime_estimate
+                else:
+                    logger.warning(
+                        f"Task template {task_name} has no runtime estimate to "
+                        f"scale. Ignoring its runtime override."
+                    )
+            for task, runtime in task_template.task_runtimes.items():
+                task_runtimes[task] = runtime * scale
+        templates = self._get_task_template_names()
+        tasks = self._get_direct_tasks() + list(self._tasks)
+        result = simulate(tasks, task_runtimes, max_cores, max_memory_gb, templates)
+        logger.info(result.summary())
+        return result
+
+    def _get_task_template_names(self) -> Dict["ihme_deps.Task", str]:
+        return {
+            task: task_name
+            for task_name, task_template in self.task_templates.items()
+            for task in task_template.task_runtimes
+        }
+
+    def _get_direct_tasks(self) -> List["ihme_deps.Task"]:
+        """Get tasks added directly to the workflow rather than with
+        :meth:`add_tasks`."""
+        workflow_tasks = self.workflow.tasks
+        if isinstance(workflow_tasks, Mapping):
+            # Jobmon workflows key tasks by their hash.
+            workflow_tasks = workflow_tasks.values()
+        return [task for task in workflow_tasks if task not in self._tasks]
+
     def run(self) -> None:
         """Execute the constructed workflow."""
+        if self.backend == LOCAL_BACKEND:
+            run_status = LocalWorkflowRunStatus
+        else:
+            run_status = ihme_deps.WorkflowRunStatus
+
+        direct_tasks = self._get_direct_tasks()
+        if direct_tasks and self.incremental:
+            logger.warning(
+                f"{len(direct_tasks)} tasks were added directly to the workflow and "
+                f"will always run. Add tasks with WorkflowTemplate.add_tasks so they "
+                f"can be pruned."
+            )
+        # The attached tasks are kept so the workflow can still be simulated.
+        tasks = direct_tasks + list(self._tasks)
+        task_files = {}
+        for task_template in self.task_templates.values():
+            task_files.update(task_template.task_files)
+        fingerprints = None
+        if self.fingerprint == "hash":
+            fingerprints = FingerprintStore(
+                Path(self.version) / paths.LOG_DIR / "fingerprints.json"
+            )
+        if self.incremental:
+            tasks = prune_up_to_date(tasks, task_files, fingerprints)
+        tasks = self.prioritize(tasks)
+        direct = set(direct_tasks)
+        self.workflow.add_tasks([task for task in tasks if task not in direct])
+        if not self.workflow.tasks:
+            logger.info("All tasks are up to date. Nothing to run.")
+            return
+
+        run_start = time.time()
+        status_path = Path(self.version) / paths.LOG_DIR / "progress.json"
+        poller = None
+        if self.backend != LOCAL_BACKEND and self.trace:
+            # Jobmon doesn't report task statuses back to us, but traced
+            # tasks record when they start and finish.
+            aliases = {}
+            for task_template in self.task_templates.values():
+                aliases.update(task_template.packed_task_names)
+            detector = None
+            if self.straggler_policy is not None:
+                detector = StragglerDetector(self.straggler_policy)
+            poller = TraceStatusPoller(
+                self.trace_dir, self.trace_id, aliases, run_start, detector
+            )
+        elif self.backend != LOCAL_BACKEND:
+            logger.info(
+                "Task statuses aren't reported for untraced jobmon workflows. "
+                "Enable tracing to report them."
+            )
+        reporter = ProgressReporter(
+            self.progress_interval,
+            status_path if self.progress_status else None,
+            track_statuses=self.backend == LOCAL_BACKEND or poller is not None,
+            poller=poller,
+        )
+        templates = self._get_task_template_names()
+        for task in tasks:
+            reporter.add_task(task.name, templates.get(task))
+        if self.backend == LOCAL_BACKEND:
+            self.workflow.progress_reporter = reporter
+
+        reporter.start()
         try:
             r = self.workflow.run(
                 fail_fast=self.fail_fast,
@@ -162,8 +698,24 @@ class WorkflowTemplate(abc.ABC):
         except RuntimeError:
             # fail_fast now induces a runtime error instead of returning an error
             # status, which is unexpected behavior.  Patch around this for now.
-            r = WorkflowRunStatus.ERROR
-        if r != WorkflowRunStatus.DONE:
+            r = run_status.ERROR
+        finally:
+            reporter.stop()
+            if fingerprints is not None:
+                record_fingerprints(tasks, task_files, fingerprints)
+            if self.trace:
+                try:
+                    tracing.write_trace_report(
+                        self.trace_dir,
+                        self.trace_id,
+                        Path(self.version) / paths.LOG_DIR,
+                        upstream={t.name: [u.name for u in t.upstream_tasks] for t in tasks},
+                        run_start=run_start,
+                    )
+                except Exception as e:
+                    # Don't mask the workflow's own result or errors.
+                    logger.warning(f"Failed to write trace report: {e!r}")
+        if r != run_status.DONE:
             raise RuntimeError(
                 f"Workflow failed with status {r}.\n"
                 f"Workflow run id: {self.workflow.workflow_run_id}."
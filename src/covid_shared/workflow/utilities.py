@@ -1,9 +1,78 @@
+import functools
 import socket
 from pathlib import Path
-from typing import Tuple, Union
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 
-from covid_shared import shell_tools
-from covid_shared.ihme_deps import Tool
+from covid_shared import ihme_deps, shell_tools
+
+# Process-wide cache of jobmon tool and task template handles.
+_JOBMON_HANDLES: Dict[Tuple, Any] = {}
+
+
+@functools.lru_cache()
+def get_jobmon_service() -> Tuple[Optional[str], Optional[str]]:
+    """Get the jobmon client version and the url of the jobmon service.
+
+    Either is None if it can't be determined, e.g. if jobmon isn't
+    installed.
+
+    """
+    # This may be the first import of jobmon in the process, so apply the
+    # structlog hack that importing jobmon through ihme_deps would.
+    ihme_deps._alias_structlog()
+    try:
+        import jobmon
+
+        version = getattr(jobmon, "__version__", None)
+    except ImportError:
+        return None, None
+    try:
+        from jobmon.client.client_config import ClientConfig
+
+        url = ClientConfig.from_defaults().url
+    except Exception:  # The config is read from files and the environment.
+        url = None
+    return version, url
+
+
+def get_jobmon_handle(key: Tuple, factory: Callable[[], Any]) -> Any:
+    """Get a jobmon handle from the process cache.
+
+    Creating jobmon tools and task templates requires a round trip to the
+    jobmon service, but the handles never change for a given tool version
+    and template definition on a given service. Handles are cached in
+    process by the key together with the jobmon client version and service
+    url, so that templates built repeatedly in one process only make the
+    round trip once.
+
+    Handles are deliberately not cached across processes. They hold ids
+    assigned by the service, and jobmon has no public way to rebuild a
+    handle from its ids, so a persisted handle would go stale silently
+    after a jobmon upgrade or a switch of service.
+
+    Parameters
+    ----------
+    key
+        A tuple that uniquely identifies the handle. It must include
+        everything that would change the handle returned by the service.
+    factory
+        Creates the handle on a cache miss.
+
+    """
+    key = get_jobmon_service() + key
+    if key not in _JOBMON_HANDLES:
+        _JOBMON_HANDLES[key] = factory()
+    return _JOBMON_HANDLES[key]
+
+
+def clear_jobmon_handles() -> None:
+    """Drop all cached jobmon handles so they are recreated on next use.
+
+    Call this after changing the jobmon configuration in a running process.
+
+    """
+    _JOBMON_HANDLES.clear()
+    get_jobmon_service.cache_clear()
 
 
 class JobmonTool:
@@ -27,18 +96,56 @@ class JobmonTool:
             self._active_tool_version_id = package.__jobmon_tool_version__
         self._tool = None
 
+    @property
+    def _key(self) -> Tuple[str, int]:
+        return self._package_name, self._active_tool_version_id
+
     def lazy_init_tool(self):
         if self._tool is None:
-            self._tool = Tool(self._package_name)
-            self._tool.active_tool_version_id = self._active_tool_version_id
+
+            def make_tool():
+                tool = ihme_deps.Tool(self._package_name)
+                tool.active_tool_version_id = self._active_tool_version_id
+                return tool
+
+            self._tool = get_jobmon_handle(("tool",) + self._key, make_tool)
 
     def create_workflow(self, *args, **kwargs):
         self.lazy_init_tool()
         return self._tool.create_workflow(*args, **kwargs)
 
-    def get_task_template(self, *args, **kwargs):
-        self.lazy_init_tool()
-        return self._tool.get_task_template(*args, **kwargs)
+    def get_task_template(
+        self,
+        template_name: str,
+        command_template: str,
+        node_args: list = None,
+        task_args: list = None,
+        **kwargs,
+    ):
+        """Get a task template handle, reusing cached handles where possible."""
+        key = (
+            ("task_template",)
+            + self._key
+            + (
+                template_name,
+                command_template,
+                tuple(node_args or []),
+                tuple(task_args or []),
+                tuple(sorted((k, repr(v)) for k, v in kwargs.items())),
+            )
+        )
+
+        def make_task_template():
+            self.lazy_init_tool()
+            return self._tool.get_task_template(
+                template_name=template_name,
+                command_template=command_template,
+                node_args=node_args,
+                task_args=task_args,
+                **kwargs,
+            )
+
+        return get_jobmon_handle(key, make_task_template)
 
 
 def get_jobmon_tool(package) -> JobmonTool:
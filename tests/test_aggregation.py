@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from covid_shared.aggregation import HierarchyAggregator
+from covid_shared.hierarchy import LocationHierarchy
+
+
+@pytest.fixture
+def hierarchy():
+    # 1 -> (2 -> (4, 5), 3 -> (6 -> (7, 8)))
+    return LocationHierarchy([1, 2, 3, 4, 5, 6, 7, 8], [1, 1, 1, 2, 2, 3, 6, 6])
+
+
+@pytest.fixture
+def aggregator(hierarchy):
+    # Inputs deliberately not in hierarchy order.
+    return HierarchyAggregator(hierarchy, [8, 4, 7, 5])
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    return rng.random((4, 6, 3))
+
+
+def _rows(aggregator, result, location_ids):
+    return result[aggregator.hierarchy.index(location_ids)]
+
+
+def test_sum(aggregator, values):
+    result = aggregator.aggregate(values)
+
+    assert result.shape == (8, 6, 3)
+    assert aggregator.location_ids.tolist() == [1, 2, 4, 5, 3, 6, 7, 8]
+    np.testing.assert_allclose(_rows(aggregator, result, 1), values.sum(axis=0))
+    np.testing.assert_allclose(_rows(aggregator, result, 2), values[1] + values[3])
+    np.testing.assert_allclose(_rows(aggregator, result, 3), values[0] + values[2])
+    np.testing.assert_allclose(_rows(aggregator, result, 6), values[0] + values[2])
+    np.testing.assert_allclose(_rows(aggregator, result, 8), values[0])
+
+
+def test_weighted_sum_and_mean(aggregator, values):
+    population = np.array([1.0, 2.0, 3.0, 4.0])
+
+    weighted = aggregator.aggregate(values, weights=population)
+    mean = aggregator.aggregate(values, how="mean", weights=population)
+
+    expected_sum = (values * population[:, None, None]).sum(axis=0)
+    np.testing.assert_allclose(_rows(aggregator, weighted, 1), expected_sum)
+    np.testing.assert_allclose(_rows(aggregator, mean, 1), expected_sum / population.sum())
+    np.testing.assert_allclose(_rows(aggregator, mean, 4), values[1])
+
+
+def test_mean_with_time_varying_weights(aggregator, values):
+    population = np.arange(1, 13, dtype=float).reshape(4, 1, 3)
+
+    mean = aggregator.aggregate(values, how="mean", weights=population)
+
+    expected = (values * population).sum(axis=0) / population.sum(axis=0)
+    np.testing.assert_allclose(_rows(aggregator, mean, 1), expected)
+
+
+@pytest.mark.parametrize("how", ["sum", "mean"])
+def test_chunked_matches_unchunked(aggregator, values, how):
+    weights = np.arange(1, 25, dtype=float).reshape(4, 6)
+
+    expected = aggregator.aggregate(values, how=how, weights=weights)
+    chunked = aggregator.aggregate(values, how=how, weights=weights, chunk_size=4)
+    streamed = np.concatenate(
+        list(
+            aggregator.aggregate_chunks(
+                (values[:, i : i + 2] for i in range(0, 6, 2)),
+                how=how,
+                weights=np.arange(1, 5, dtype=float),
+            )
+        ),
+        axis=1,
+    )
+
+    np.testing.assert_allclose(chunked, expected)
+    np.testing.assert_allclose(
+        streamed,
+        aggregator.aggregate(values, how=how, weights=np.arange(1, 5, dtype=float)),
+    )
+
+
+def test_most_detailed_with_children_keeps_its_value():
+    hierarchy = LocationHierarchy([1, 2, 3, 4], [1, 1, 1, 2], most_detailed=[0, 1, 1, 0])
+    aggregator = HierarchyAggregator(hierarchy, [2, 3])
+
+    result = aggregator.aggregate(np.array([5, 7]))
+
+    assert dict(zip(aggregator.location_ids.tolist(), result.tolist())) == {
+        1: 12,
+        2: 5,
+        4: 0,
+        3: 7,
+    }
+
+
+@pytest.mark.parametrize(
+    "location_ids",
+    [
+        [4, 5, 7],  # Missing a most detailed location
+        [4, 5, 7, 8, 2],  # Includes an aggregate
+        [4, 5, 7, 8, 8],  # Duplicates
+    ],
+)
+def test_invalid_input_locations(hierarchy, location_ids):
+    with pytest.raises(ValueError):
+        HierarchyAggregator(hierarchy, location_ids)
+
+
+def test_invalid_arguments(aggregator, values):
+    with pytest.raises(ValueError):
+        aggregator.aggregate(values, how="median")
+    with pytest.raises(ValueError):
+        aggregator.aggregate(values, how="mean")
+    with pytest.raises(ValueError):
+        aggregator.aggregate(values[:3])
+    with pytest.raises(ValueError):
+        aggregator.aggregate(values, chunk_size=2, axis=0)
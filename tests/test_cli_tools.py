@@ -280,3 +280,104 @@ def test_get_last_stage_directory_errors(
         cli_tools.get_last_stage_directory(
             last_stage_version, last_stage_directory, last_stage_root
         )
+
+
+def test_monitor_application_records_trace(tmp_path: Path, monkeypatch):
+    import json
+
+    from loguru import logger
+
+    from covid_shared.cli_tools import tracing
+
+    def main(app_metadata, draw):
+        # The task is recorded as running while it runs.
+        (record_path,) = tmp_path.glob("fit_1.*.json")
+        assert "end" not in json.loads(record_path.read_text())
+        return draw
+
+    monkeypatch.setenv(tracing.TRACE_ID_ENV_VAR, "abc")
+    monkeypatch.setenv(tracing.TRACE_DIR_ENV_VAR, str(tmp_path))
+    monkeypatch.setenv(tracing.TASK_NAME_ENV_VAR, "fit_1")
+    _, result = cli_tools.monitor_application(main, logger, False)(3)
+    assert result == 3
+
+    (record_path,) = tmp_path.glob("fit_1.*.json")
+    record = json.loads(record_path.read_text())
+    assert record["trace_id"] == "abc"
+    assert record["success"]
+    assert record["end"] >= record["start"]
+    assert "max_rss_gb" in record
+
+
+def test_write_trace_report(tmp_path: Path):
+    import json
+
+    import pandas as pd
+
+    from covid_shared.cli_tools import tracing
+
+    context = {"trace_id": "abc", "trace_dir": str(tmp_path)}
+    for name, start, end in [("a", 10, 20), ("b", 25, 30)]:
+        tracing.record_task_trace(
+            {**context, "task_name": name}, {"start": start, "end": end, "success": True}
+        )
+    tracing.record_task_trace(
+        {**context, "trace_id": "other", "task_name": "c"}, {"start": 0, "end": 1}
+    )
+    # A task from an earlier run of a resumed workflow.
+    tracing.record_task_trace(
+        {**context, "task_name": "d"}, {"start": 1, "end": 2, "success": True}
+    )
+    # A task that never finished.
+    tracing.record_task_trace({**context, "task_name": "e"}, {"start": 12})
+
+    trace_path = tracing.write_trace_report(
+        tmp_path, "abc", tmp_path, upstream={"b": ["a"]}, run_start=5
+    )
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    tasks = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(tasks) == {"a", "b"}
+    assert tasks["b"]["ts"] == 15 * 1e6 and tasks["b"]["dur"] == 5 * 1e6
+    assert tasks["b"]["args"]["queue_wait_seconds"] == 5
+
+    (summary_path,) = tmp_path.glob(f"{tracing.TRACE_SUMMARY_FILE_NAME}.*")
+    reader = pd.read_parquet if summary_path.suffix == ".parquet" else pd.read_csv
+    summary = reader(summary_path)
+    assert summary.set_index("task_name")["queue_wait_seconds"].to_dict() == {"a": 5, "b": 5}
+
+
+def test_summarize_argument(tmp_path: Path, monkeypatch):
+    import numpy as np
+    import pandas as pd
+
+    from covid_shared.cli_tools import metadata
+
+    monkeypatch.chdir(tmp_path)
+    assert metadata.summarize_argument(Path("data")) == str(tmp_path / "data")
+    assert metadata.summarize_argument(3) == "3"
+    assert metadata.summarize_argument("x" * 5000).endswith("... (5000 characters)")
+    assert metadata.summarize_argument(list(range(1000))) == "list(len=1000)"
+
+    array = np.arange(10**6, dtype=np.float64).reshape(1000, 1000)
+    summary = metadata.summarize_argument(array)
+    assert summary.startswith("ndarray(shape=(1000, 1000), dtype=float64, hash=")
+    assert metadata.summarize_argument(array.copy()) == summary
+    changed = array.copy()
+    changed[0, 0] = -1
+    assert metadata.summarize_argument(changed) != summary
+    assert metadata.summarize_argument(array.T) != summary
+
+    data = pd.DataFrame({"location_id": range(10**5), "name": "a"})
+    summary = metadata.summarize_argument(data)
+    assert summary.startswith("DataFrame(shape=(100000, 2), dtypes={'location_id': 'int64'")
+    assert len(summary) < 200
+    assert metadata.summarize_argument(data.copy()) == summary
+    assert metadata.summarize_argument(data.assign(name="b")) != summary
+    assert metadata.summarize_argument(data["name"]).startswith("Series(shape=(100000,)")
+    assert metadata.summarize_argument(data.index).startswith("RangeIndex(shape=(100000,)")
+
+    def main(app_metadata, data, draws=10):
+        pass
+
+    run_args = metadata.get_function_full_argument_mapping(main, "metadata", data, draws=5)
+    assert run_args == {"app_metadata": "metadata", "data": summary, "draws": "5"}
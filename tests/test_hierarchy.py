@@ -0,0 +1,103 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid_shared.hierarchy import LocationHierarchy
+
+
+@pytest.fixture
+def hierarchy_frame():
+    # 1 -> (2 -> (4, 5), 3 -> (6 -> (7, 8)))
+    return pd.DataFrame(
+        {
+            "location_id": [7, 1, 3, 2, 5, 4, 6, 8],
+            "parent_id": [6, 1, 1, 1, 2, 2, 3, 6],
+            "most_detailed": [1, 0, 0, 0, 1, 1, 0, 1],
+            "sort_order": [7, 1, 5, 2, 4, 3, 6, 8],
+        }
+    )
+
+
+@pytest.fixture
+def hierarchy(hierarchy_frame):
+    return LocationHierarchy.from_frame(hierarchy_frame)
+
+
+def test_preorder_layout(hierarchy):
+    assert hierarchy.location_ids.tolist() == [1, 2, 4, 5, 3, 6, 7, 8]
+    assert hierarchy.level.tolist() == [0, 1, 2, 2, 1, 2, 3, 3]
+    assert hierarchy.subtree_end.tolist() == [8, 4, 3, 4, 8, 8, 7, 8]
+    assert hierarchy.most_detailed_ids.tolist() == [4, 5, 7, 8]
+    assert hierarchy.max_level == 3
+    assert hierarchy.level_mask(1).sum() == 2
+
+
+def test_relationships(hierarchy):
+    assert hierarchy.parent_ids([1, 4, 7]).tolist() == [1, 2, 6]
+    assert hierarchy.child_ids(1).tolist() == [2, 3]
+    assert hierarchy.descendant_ids(3).tolist() == [6, 7, 8]
+    assert hierarchy.descendant_ids(1, most_detailed_only=True).tolist() == [4, 5, 7, 8]
+    assert hierarchy.ancestor_ids(7).tolist() == [1, 3, 6]
+    assert hierarchy.ancestor_ids(1).tolist() == []
+
+
+def test_is_ancestor(hierarchy):
+    assert hierarchy.is_ancestor(3, [3, 6, 7, 4, 1]).tolist() == [
+        True,
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert hierarchy.is_ancestor([1, 2, 6], [8, 5, 8]).all()
+
+
+def test_index_missing_location(hierarchy):
+    with pytest.raises(KeyError):
+        hierarchy.index([1, 99])
+
+
+def test_aggregate(hierarchy):
+    values = np.zeros((len(hierarchy), 2))
+    md = hierarchy.most_detailed
+    values[md] = [[1, 10], [2, 20], [3, 30], [4, 40]]
+    # Values at aggregate locations are ignored.
+    values[0] = 1000
+
+    result = hierarchy.aggregate(values)
+
+    expected = {1: [10, 100], 2: [3, 30], 3: [7, 70], 6: [7, 70], 4: [1, 10]}
+    for location_id, expected_values in expected.items():
+        assert result[hierarchy.index(location_id)].tolist() == expected_values
+
+
+def test_aggregate_shape_mismatch(hierarchy):
+    with pytest.raises(ValueError):
+        hierarchy.aggregate(np.ones(3))
+
+
+def test_default_most_detailed_is_leaves():
+    hierarchy = LocationHierarchy([1, 2, 3], [1, 1, 2])
+    assert hierarchy.most_detailed_ids.tolist() == [3]
+
+
+@pytest.mark.parametrize(
+    "location_ids, parent_ids",
+    [
+        ([1, 2, 2], [1, 1, 1]),  # Duplicate ids
+        ([1, 2], [1, 2]),  # Two roots
+        ([1, 2, 3], [1, 3, 2]),  # Cycle not connected to the root
+    ],
+)
+def test_invalid_hierarchy(location_ids, parent_ids):
+    with pytest.raises(ValueError):
+        LocationHierarchy(location_ids, parent_ids)
+
+
+def test_pickle_round_trip(hierarchy):
+    restored = pickle.loads(pickle.dumps(hierarchy))
+    assert restored.location_ids.tolist() == hierarchy.location_ids.tolist()
+    assert restored.is_ancestor(3, 8)
+    assert restored.descendant_ids(2).tolist() == [4, 5]
@@ -1,5 +1,6 @@
 import pytest
 
+from covid_shared import ihme_deps
 from covid_shared.ihme_deps import _lazy_import_callable
 
 
@@ -14,3 +15,195 @@ def test_lazy_import_callable_fail():
     magic = _lazy_import_callable("fairyland", "magic")
     with pytest.raises(ModuleNotFoundError):
         magic()
+
+
+@pytest.fixture
+def hierarchy():
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "location_id": [1, 2, 3, 4, 5, 6],
+            "parent_id": [1, 1, 2, 2, 2, 2],
+            "location_name": ["Global", "Region", "A", "B", "C", "D"],
+            "location_type": ["global", "region", "admin0", "admin0", "admin0", "admin0"],
+        }
+    )
+
+
+@pytest.fixture(autouse=True)
+def empty_hierarchy_memo(monkeypatch):
+    monkeypatch.setattr(ihme_deps, "_LOCATION_HIERARCHIES", {})
+
+
+def test_load_location_hierarchy_from_file(hierarchy, tmp_path):
+    location_file = tmp_path / "hierarchy.csv"
+    hierarchy.to_csv(location_file, index=False)
+    cache_root = tmp_path / "cache"
+
+    loaded = ihme_deps.load_location_hierarchy(
+        location_file=location_file, cache_root=cache_root
+    )
+    assert loaded["location_id"].tolist() == hierarchy["location_id"].tolist()
+    # Strings keep their dtype unless categoricals are asked for.
+    assert loaded["location_type"].dtype == hierarchy["location_type"].dtype
+    categorized = ihme_deps.load_location_hierarchy(
+        location_file=location_file, cache_root=cache_root, categorical=True
+    )
+    assert categorized["location_type"].dtype == "category"
+    assert categorized["location_name"].dtype != "category"
+    assert len(list((cache_root / ihme_deps.LOCATION_HIERARCHY_CACHE).iterdir())) == 1
+
+    # Results are copies of the in-process cache.
+    loaded["location_id"] = 0
+    reloaded = ihme_deps.load_location_hierarchy(
+        location_file=location_file, cache_root=cache_root
+    )
+    assert reloaded["location_id"].tolist() == hierarchy["location_id"].tolist()
+
+    # A new process would read from the on disk cache.
+    ihme_deps._LOCATION_HIERARCHIES.clear()
+    location_file.unlink()
+    location_file.write_text("location_id\n1\n")
+    reloaded = ihme_deps.load_location_hierarchy(
+        location_file=location_file, cache_root=cache_root
+    )
+    assert reloaded["location_id"].tolist() == [1]
+
+
+def test_load_location_hierarchy_from_db(hierarchy, tmp_path, mocker):
+    query = mocker.patch.object(
+        ihme_deps, "get_location_hierarchy_by_version", return_value=hierarchy, create=True
+    )
+    for _ in range(3):
+        loaded = ihme_deps.load_location_hierarchy(
+            location_set_version_id=123, cache_root=tmp_path
+        )
+        assert loaded["location_id"].tolist() == hierarchy["location_id"].tolist()
+    query.assert_called_once_with(location_set_version_id=123)
+
+    ihme_deps._LOCATION_HIERARCHIES.clear()
+    ihme_deps.load_location_hierarchy(location_set_version_id=123, cache_root=tmp_path)
+    query.assert_called_once()
+
+    ihme_deps.load_location_hierarchy(
+        location_set_version_id=123, cache_root=tmp_path, use_cache=False
+    )
+    assert query.call_count == 2
+
+
+@pytest.fixture
+def query(hierarchy, mocker):
+    return mocker.patch.object(
+        ihme_deps, "get_location_hierarchy_by_version", return_value=hierarchy, create=True
+    )
+
+
+def test_query_db_read_through(query, tmp_path, monkeypatch):
+    monkeypatch.delenv(ihme_deps.DB_QUERY_CACHE_MODE_ENV_VAR, raising=False)
+    for _ in range(2):
+        response = ihme_deps.query_db(
+            "get_location_hierarchy_by_version",
+            cache_root=tmp_path,
+            location_set_version_id=1,
+        )
+        assert response["location_id"].tolist() == [1, 2, 3, 4, 5, 6]
+    query.assert_called_once_with(location_set_version_id=1)
+
+    # Different arguments are stored separately.
+    ihme_deps.query_db(
+        "get_location_hierarchy_by_version", cache_root=tmp_path, location_set_version_id=2
+    )
+    assert query.call_count == 2
+
+    # Expired responses are refreshed.
+    ihme_deps.query_db(
+        "get_location_hierarchy_by_version",
+        cache_root=tmp_path,
+        ttl=0,
+        location_set_version_id=1,
+    )
+    assert query.call_count == 3
+
+    # As are responses stored by a different version of the store.
+    monkeypatch.setattr(ihme_deps, "DB_QUERY_CACHE_VERSION", -1)
+    ihme_deps.query_db(
+        "get_location_hierarchy_by_version", cache_root=tmp_path, location_set_version_id=1
+    )
+    assert query.call_count == 4
+
+
+def test_query_db_replay(query, tmp_path, monkeypatch):
+    ihme_deps.query_db(
+        "get_location_hierarchy_by_version", cache_root=tmp_path, location_set_version_id=1
+    )
+
+    monkeypatch.setenv(ihme_deps.DB_QUERY_CACHE_MODE_ENV_VAR, "replay")
+    response = ihme_deps.query_db(
+        "get_location_hierarchy_by_version",
+        cache_root=tmp_path,
+        use_cache=False,
+        location_set_version_id=1,
+    )
+    assert response["location_id"].tolist() == [1, 2, 3, 4, 5, 6]
+    query.assert_called_once()
+
+    with pytest.raises(RuntimeError):
+        ihme_deps.query_db(
+            "get_location_hierarchy_by_version",
+            cache_root=tmp_path,
+            location_set_version_id=2,
+        )
+    query.assert_called_once()
+
+
+def test_query_db_off(query, tmp_path, monkeypatch):
+    monkeypatch.setenv(ihme_deps.DB_QUERY_CACHE_MODE_ENV_VAR, "off")
+    for _ in range(2):
+        ihme_deps.query_db(
+            "get_location_hierarchy_by_version",
+            cache_root=tmp_path,
+            location_set_version_id=1,
+        )
+    assert query.call_count == 2
+    assert not (tmp_path / ihme_deps.DB_QUERY_CACHE).exists()
+
+    monkeypatch.setenv(ihme_deps.DB_QUERY_CACHE_MODE_ENV_VAR, "sometimes")
+    with pytest.raises(ValueError):
+        ihme_deps.get_db_query_cache_mode()
+
+
+def test_load_location_hierarchy_unwritable_cache(hierarchy, tmp_path, mocker):
+    location_file = tmp_path / "hierarchy.csv"
+    hierarchy.to_csv(location_file, index=False)
+    # A file where the cache directory should be makes the cache unusable.
+    cache_root = tmp_path / "cache"
+    cache_root.write_text("")
+
+    loaded = ihme_deps.load_location_hierarchy(
+        location_file=location_file, cache_root=cache_root
+    )
+    assert loaded["location_id"].tolist() == hierarchy["location_id"].tolist()
+
+    query = mocker.patch.object(
+        ihme_deps, "get_location_hierarchy_by_version", return_value=hierarchy, create=True
+    )
+    loaded = ihme_deps.load_location_hierarchy(
+        location_set_version_id=123, cache_root=cache_root
+    )
+    assert loaded["location_id"].tolist() == hierarchy["location_id"].tolist()
+    query.assert_called_once_with(location_set_version_id=123)
+
+
+def test_get_cache_root(tmp_path, monkeypatch):
+    from covid_shared import cache, paths
+
+    monkeypatch.delenv(cache.CACHE_DIR_ENV_VAR, raising=False)
+    monkeypatch.delenv(cache.XDG_CACHE_HOME_ENV_VAR, raising=False)
+    assert cache.get_cache_root() == paths.DEFAULT_CACHE_ROOT
+
+    monkeypatch.setenv(cache.XDG_CACHE_HOME_ENV_VAR, str(tmp_path / "xdg"))
+    assert cache.get_cache_root() == tmp_path / "xdg" / "covid_shared"
+
+    monkeypatch.setenv(cache.CACHE_DIR_ENV_VAR, str(tmp_path / "cache"))
+    assert cache.get_cache_root() == tmp_path / "cache"
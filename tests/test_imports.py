@@ -0,0 +1,69 @@
+"""Guards against regressions in package import time.
+
+Imports are run in a fresh interpreter so that modules imported by other
+tests don't leak in.
+
+"""
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are slow to import or talk to external services on import.
+HEAVY_MODULES = ["pandas", "numpy", "pathos", "dill", "tqdm", "db_queries", "jobmon"]
+
+
+def _imported_modules(statement: str) -> set:
+    code = f"import sys\n{statement}\nprint('\\n'.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    return set(result.stdout.split())
+
+
+def _import_time_us(module: str) -> int:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    # Lines look like "import time: self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.rsplit("|", 2)
+        if name.strip() == module:
+            return int(cumulative)
+    raise ValueError(f"No import time found for {module}.")
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import covid_shared",
+        "from covid_shared import cli_tools",
+        "from covid_shared.cli_tools import monitor_application, finish_application",
+        "import covid_shared.parallel",
+        "import covid_shared.ihme_deps",
+        "import covid_shared.workflow",
+    ],
+)
+def test_no_heavy_imports(statement: str):
+    imported = _imported_modules(statement)
+    assert not imported.intersection(HEAVY_MODULES)
+
+
+def test_lazy_names_resolve():
+    imported = _imported_modules(
+        "from covid_shared import cli_tools\n"
+        "from covid_shared.cli_tools import add_verbose, RunMetadata\n"
+        "assert cli_tools.logging.configure_logging_to_files\n"
+        "assert 'monitor_application' in dir(cli_tools)\n"
+    )
+    assert "click" in imported
+
+
+@pytest.mark.parametrize("module", ["covid_shared", "covid_shared.cli_tools"])
+def test_import_time(module: str):
+    # Generous budget. This is meant to catch heavy dependencies being
+    # imported eagerly, not to benchmark the interpreter.
+    assert _import_time_us(module) < 100_000
@@ -0,0 +1,214 @@
+import logging
+import time
+from pathlib import Path
+
+import pytest
+from loguru import logger
+
+from covid_shared import paths
+from covid_shared.cli_tools.log_files import LogFile, LogReader, parse_size
+from covid_shared.cli_tools.logging import (
+    JOBMON_LOGGING_LEVEL,
+    JobmonInterceptHandler,
+    QueuedFileSink,
+)
+
+
+@pytest.fixture
+def sink_path(tmp_path: Path) -> Path:
+    return tmp_path / "log.txt"
+
+
+def test_queued_file_sink_writes_everything(sink_path: Path):
+    sink = QueuedFileSink(sink_path, max_queue_size=10, batch_size=3)
+    handler_id = logger.add(sink, format="{message}")
+    for i in range(100):
+        logger.info(str(i))
+    sink.flush()
+    assert sink_path.read_text().splitlines() == [str(i) for i in range(100)]
+
+    logger.remove(handler_id)
+    sink.close()
+    stats = sink.stats()
+    assert stats["enqueued"] == stats["written"] == 100
+    assert stats["dropped"] == 0
+
+
+def test_queued_file_sink_drops_on_overflow(sink_path: Path):
+    sink = QueuedFileSink(sink_path, max_queue_size=1, drop_on_overflow=True)
+    # Slow the writer thread down so the queue fills.
+    sink._file.write_messages = lambda messages: time.sleep(0.01)
+    for i in range(1000):
+        sink(f"{i}\n")
+    sink.close()
+    stats = sink.stats()
+    assert stats["enqueued"] + stats["dropped"] == 1000
+    assert stats["dropped"] > 0
+    assert stats["written"] == stats["enqueued"]
+
+
+def test_queued_file_sink_closed(sink_path: Path):
+    sink = QueuedFileSink(sink_path)
+    sink("before\n")
+    sink.close()
+    sink("after\n")
+    sink.flush()
+    assert sink_path.read_text() == "before\n"
+    assert sink.stats()["dropped"] == 1
+
+
+def test_queued_file_sinks_released_on_remove(tmp_path: Path):
+    from covid_shared.cli_tools import log_files
+    from covid_shared.cli_tools import logging as cli_logging
+
+    before = set(logger._core.handlers)
+    for run in ("run_1", "run_2"):
+        (tmp_path / run).mkdir()
+        cli_logging.configure_logging_to_files(tmp_path / run, asynchronous=True)
+    sinks = list(cli_logging._QUEUED_SINKS)
+    assert len(sinks) == 4
+    logger.info("message")
+
+    for handler_id in set(logger._core.handlers) - before:
+        logger.remove(handler_id)
+    assert not cli_logging._QUEUED_SINKS
+    assert not log_files._LOG_FILES
+    assert not any(sink._writer.is_alive() for sink in sinks)
+    log_path = tmp_path / "run_2" / paths.LOG_DIR / paths.LOG_FILE_NAME
+    assert "message" in log_path.read_text()
+
+
+def test_managed_log_file_writes_immediately(tmp_path: Path):
+    from covid_shared.cli_tools import logging as cli_logging
+
+    before = set(logger._core.handlers)
+    cli_logging.configure_logging_to_files(tmp_path, rotation="1 MB")
+    for i in range(20):
+        logger.info(f"message {i}")
+    # Messages are on disk before the file is closed.
+    log_path = tmp_path / paths.LOG_DIR / paths.LOG_FILE_NAME
+    assert log_path.read_text().count("message") == 20
+
+    for handler_id in set(logger._core.handlers) - before:
+        logger.remove(handler_id)
+
+
+@pytest.fixture
+def jobmon_logs():
+    records = []
+    handler_id = logger.add(lambda m: records.append(m.record), level=0, format="{message}")
+    yield records
+    logger.remove(handler_id)
+
+
+def _jobmon_logger(name: str, handler: JobmonInterceptHandler) -> logging.Logger:
+    jobmon_logger = logging.getLogger(name)
+    jobmon_logger.handlers = [handler]
+    jobmon_logger.propagate = False
+    jobmon_logger.setLevel(logging.DEBUG)
+    return jobmon_logger
+
+
+def add_task(jobmon_logger: logging.Logger, message: str):
+    jobmon_logger.info(message)
+
+
+def some_jobmon_function(jobmon_logger: logging.Logger, message: str):
+    jobmon_logger.info(message)
+
+
+def test_jobmon_handler_routing(jobmon_logs):
+    handler = JobmonInterceptHandler()
+    workflow_logger = _jobmon_logger("jobmon.client.workflow", handler)
+    distributor_logger = _jobmon_logger(JobmonInterceptHandler._DISTRIBUTOR_LOGGER, handler)
+
+    add_task(workflow_logger, "dropped")
+    some_jobmon_function(workflow_logger, "re-emitted")
+    some_jobmon_function(distributor_logger, "active distributor_ids: 1, 2, 3")
+    workflow_logger.warning("important")
+
+    messages = [(r["level"].no, r["message"], r["function"]) for r in jobmon_logs]
+    assert messages == [
+        (JOBMON_LOGGING_LEVEL, "dropped", "add_task"),
+        (logging.INFO, "re-emitted", "some_jobmon_function"),
+        (logging.INFO, "Queued or running: 3", "emit"),
+        (JOBMON_LOGGING_LEVEL, "active distributor_ids: 1, 2, 3", "some_jobmon_function"),
+        (logging.WARNING, "important", "test_jobmon_handler_routing"),
+    ]
+    assert handler._routes == {
+        ("jobmon.client.workflow", "add_task"): JobmonInterceptHandler._FILTER,
+        ("jobmon.client.workflow", "some_jobmon_function"): JobmonInterceptHandler._RE_EMIT,
+        (JobmonInterceptHandler._DISTRIBUTOR_LOGGER, "some_jobmon_function"): (
+            JobmonInterceptHandler._PARSE
+        ),
+    }
+
+
+def test_jobmon_handler_summary(jobmon_logs):
+    handler = JobmonInterceptHandler(summary_interval=3600)
+    workflow_logger = _jobmon_logger("jobmon.client.workflow", handler)
+
+    for _ in range(10):
+        add_task(workflow_logger, "dropped")
+    assert not jobmon_logs
+
+    handler.close()
+    assert [r["message"] for r in jobmon_logs] == [
+        "Suppressed 10 jobmon messages: jobmon.client.workflow:add_task=10"
+    ]
+
+
+def test_log_file_rotation_and_reader(tmp_path: Path):
+    log_path = tmp_path / "log.json"
+    log_file = LogFile(log_path, rotation="2 KB", compression="gz", retention=2)
+    handler_id = logger.add(log_file.write, level=0, serialize=True)
+    for i in range(50):
+        logger.info(str(i))
+    logger.warning("last")
+    logger.remove(handler_id)
+    log_file.close()
+
+    rotated = sorted(p.name for p in tmp_path.glob("log.*.json.gz"))
+    assert len(rotated) == 2
+    assert (tmp_path / "log.json.index").exists()
+
+    reader = LogReader(log_path)
+    messages = [r["record"]["message"] for r in reader.read()]
+    assert messages[-1] == "last"
+    assert messages == [str(i) for i in range(50 - len(messages) + 1, 50)] + ["last"]
+
+    assert reader.segments(level="WARNING") == [log_path]
+    assert [r["record"]["message"] for r in reader.read(level="WARNING")] == ["last"]
+
+
+def test_parse_size():
+    assert parse_size(10) == 10
+    assert parse_size("10") == 10
+    assert parse_size("1.5 KB") == 1536
+    assert parse_size("2GB") == 2 * 1024**3
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_jobmon_handler_feeds_progress(jobmon_logs):
+    from covid_shared.workflow.progress import ProgressReporter
+
+    handler = JobmonInterceptHandler()
+    distributor_logger = _jobmon_logger(JobmonInterceptHandler._DISTRIBUTOR_LOGGER, handler)
+    # Jobmon workflows don't report task statuses.
+    reporter = ProgressReporter(interval=3600, track_statuses=False)
+    for i in range(5):
+        reporter.add_task(f"fit_{i}", "fit")
+    reporter.start()
+    try:
+        some_jobmon_function(distributor_logger, "active distributor_ids: 1, 2, 3")
+    finally:
+        status = reporter.stop()
+
+    assert status["active"] == 3
+    assert status["tasks"] == 5
+    # Without statuses every task would look queued, so no counts are reported.
+    assert not {"done", "queued", "throughput_per_minute", "eta_seconds"} & set(status)
+    messages = [r["message"] for r in jobmon_logs]
+    assert "Queued or running: 3" in messages
+    assert "Progress: 5 tasks submitted, 3 queued or running on the cluster." in messages
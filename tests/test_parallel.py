@@ -0,0 +1,267 @@
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid_shared import parallel
+
+
+def _worker_state(_):
+    return os.environ["OMP_NUM_THREADS"], sorted(os.sched_getaffinity(0))
+
+
+def test_get_available_cpus(tmp_path: Path):
+    available = parallel.get_available_cpus(tmp_path)
+    assert 1 <= available <= (os.cpu_count() or 1)
+
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert parallel.get_available_cpus(tmp_path) == available
+    (tmp_path / "cpu.max").write_text("50000 100000\n")
+    assert parallel.get_available_cpus(tmp_path) == 1
+
+    (tmp_path / "cpu.max").unlink()
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert parallel.get_available_cpus(tmp_path) == available
+
+
+def test_get_worker_cpu_sets():
+    cpus = sorted(os.sched_getaffinity(0))
+    cpu_sets = parallel.get_worker_cpu_sets(3, 2)
+    assert len(cpu_sets) == 3
+    assert all(len(cpu_set) == 2 and set(cpu_set) <= set(cpus) for cpu_set in cpu_sets)
+    assert cpu_sets[0] == [cpus[0], cpus[1 % len(cpus)]]
+
+
+@pytest.mark.parametrize("pin_workers", [False, True])
+def test_run_parallel_limits_worker_threads(pin_workers: bool):
+    parent_threads = os.environ.get("OMP_NUM_THREADS")
+    results = parallel.run_parallel(
+        _worker_state,
+        list(range(4)),
+        num_cores=2,
+        threads_per_worker=1,
+        pin_workers=pin_workers,
+    )
+    assert [threads for threads, _ in results] == ["1"] * 4
+    if pin_workers:
+        assert all(len(cpus) == 1 for _, cpus in results)
+    # The parent process is left alone.
+    assert os.environ.get("OMP_NUM_THREADS") == parent_threads
+
+
+def test_limit_threads_warns_without_threadpoolctl(monkeypatch):
+    import sys
+
+    from loguru import logger
+
+    for var in parallel.THREAD_ENV_VARS:
+        monkeypatch.setenv(var, "8")
+    # Make threadpoolctl unimportable. numpy is already imported here.
+    monkeypatch.setitem(sys.modules, "threadpoolctl", None)
+    messages = []
+    sink_id = logger.add(messages.append, level="WARNING", format="{message}")
+    try:
+        parallel.limit_threads(2)
+    finally:
+        logger.remove(sink_id)
+    assert os.environ["OMP_NUM_THREADS"] == "2"
+    assert any("threadpoolctl is not installed" in m for m in messages)
+
+
+def test_run_parallel_serial():
+    assert parallel.run_parallel(lambda x: x * 2, [1, 2, 3], num_cores=1) == [2, 4, 6]
+
+
+def _timed_sleep(x):
+    start = time.monotonic()
+    time.sleep(0.2)
+    return x, start, time.monotonic()
+
+
+def test_get_memory_limit_gb(tmp_path: Path):
+    machine = parallel.get_memory_limit_gb(tmp_path)
+    assert machine is not None and machine > 0
+
+    (tmp_path / "memory.max").write_text("max\n")
+    assert parallel.get_memory_limit_gb(tmp_path) == machine
+    (tmp_path / "memory.max").write_text(f"{2 * 1024 ** 3}\n")
+    assert parallel.get_memory_limit_gb(tmp_path) == min(2.0, machine)
+
+    (tmp_path / "memory.max").unlink()
+    (tmp_path / "memory").mkdir()
+    (tmp_path / "memory" / "memory.limit_in_bytes").write_text("9223372036854771712\n")
+    assert parallel.get_memory_limit_gb(tmp_path) == machine
+
+
+def test_get_process_tree_rss_gb():
+    assert 0 < parallel.get_process_tree_rss_gb() < parallel.get_memory_limit_gb()
+
+
+@pytest.mark.parametrize("memory_limit_gb, overlapping", [(1e-6, False), (1e6, True)])
+def test_run_parallel_memory_admission(memory_limit_gb: float, overlapping: bool):
+    results = parallel.run_parallel(
+        _timed_sleep, list(range(4)), num_cores=2, memory_limit_gb=memory_limit_gb
+    )
+    # Results keep the order of the arguments.
+    assert [x for x, _, _ in results] == list(range(4))
+    spans = sorted((start, end) for _, start, end in results)
+    overlaps = any(next_start < end for (_, end), (next_start, _) in zip(spans, spans[1:]))
+    # Without headroom, tasks are held back until the running task is done.
+    assert overlaps == overlapping
+
+
+_TASK_GB = 0.2
+
+
+def _allocate(x):
+    start = time.monotonic()
+    data = np.ones(int(_TASK_GB * 1024**3 / 8))
+    time.sleep(0.6)
+    return x, start, time.monotonic(), data.size
+
+
+def test_run_parallel_memory_admission_budget(monkeypatch):
+    # Measure memory relative to the first check so the budget doesn't
+    # depend on the size of the test process and its workers.
+    get_rss = parallel.get_process_tree_rss_gb
+    baseline = []
+
+    def _relative_rss():
+        rss = get_rss()
+        if not baseline:
+            baseline.append(rss)
+        return 1.0 + rss - baseline[0]
+
+    monkeypatch.setattr(parallel, "get_process_tree_rss_gb", _relative_rss)
+    # The budget fits two tasks but there are four workers.
+    results = parallel.run_parallel(
+        _allocate,
+        list(range(6)),
+        num_cores=4,
+        memory_fraction=1.0,
+        memory_limit_gb=1.0 + 2.5 * _TASK_GB,
+    )
+    assert [x for x, _, _, _ in results] == list(range(6))
+    events = sorted(
+        [(start, 1) for _, start, _, _ in results] + [(end, -1) for _, _, end, _ in results]
+    )
+    running, max_running = 0, 0
+    for _, change in events:
+        running += change
+        max_running = max(max_running, running)
+    # Tasks are held back to fit the budget, and dispatch resumes as they finish.
+    assert max_running == 2
+
+
+def test_run_parallel_bad_memory_fraction():
+    with pytest.raises(ValueError):
+        parallel.run_parallel(_timed_sleep, [1, 2], num_cores=2, memory_fraction=1.5)
+
+
+def _frame(x):
+    return pd.DataFrame({"location_id": [x, x], "value": [float(x), 2.0 * x]})
+
+
+@pytest.mark.parametrize("num_cores, chunk_size", [(1, None), (2, None), (2, 1), (3, 2)])
+def test_reduce_parallel_concat(num_cores: int, chunk_size: int):
+    args = list(range(7))
+    result = parallel.reduce_parallel(
+        _frame, args, "concat", num_cores=num_cores, chunk_size=chunk_size
+    )
+    pd.testing.assert_frame_equal(result, pd.concat([_frame(x) for x in args]))
+
+    arrays = parallel.reduce_parallel(
+        np.arange, args, "concat", num_cores=num_cores, chunk_size=chunk_size
+    )
+    np.testing.assert_array_equal(arrays, np.concatenate([np.arange(x) for x in args]))
+
+
+@pytest.mark.parametrize("num_cores", [1, 2])
+def test_reduce_parallel_sum_and_mean(num_cores: int):
+    args = list(range(1, 6))
+    frames = [_frame(x) for x in args]
+    total = parallel.reduce_parallel(_frame, args, "sum", num_cores=num_cores, chunk_size=1)
+    pd.testing.assert_frame_equal(total, sum(frames[1:], frames[0]))
+
+    mean = parallel.reduce_parallel(
+        lambda x: np.full(3, float(x)), args, "mean", num_cores=num_cores
+    )
+    np.testing.assert_array_equal(mean, np.full(3, 3.0))
+
+
+def test_reduce_parallel_custom_combine():
+    # Combining keeps the order of the arguments, so non-commutative
+    # combines work.
+    result = parallel.reduce_parallel(
+        str, list(range(10)), lambda a, b: a + b, num_cores=2, chunk_size=3
+    )
+    assert result == "0123456789"
+
+
+_PARENT_PID = os.getpid()
+# Rows pickled or unpickled by the test process, i.e. sent between it and workers.
+_ROWS_SENT = []
+
+
+def _make_rows(rows):
+    if os.getpid() == _PARENT_PID:
+        _ROWS_SENT.append(len(rows))
+    return _Rows(rows)
+
+
+class _Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __reduce__(self):
+        if os.getpid() == _PARENT_PID:
+            _ROWS_SENT.append(len(self.rows))
+        return _make_rows, (self.rows,)
+
+
+def _rows(x):
+    return _Rows([x] * 10)
+
+
+def _concat_rows(values):
+    return _Rows([row for value in values for row in value.rows])
+
+
+def test_reduce_parallel_concat_transfers():
+    args = list(range(16))
+    parallel.run_parallel(_rows, args, num_cores=4)
+    baseline = sum(_ROWS_SENT)
+    _ROWS_SENT.clear()
+
+    reducer = parallel.Reducer(_concat_rows, grows=True)
+    result = parallel.reduce_parallel(_rows, args, reducer, num_cores=4, chunk_size=2)
+    assert result.rows == [x for x in args for _ in range(10)]
+    # Each row is only sent from a worker to this process once.
+    assert sum(_ROWS_SENT) <= baseline == 10 * len(args)
+    assert parallel.CONCAT.grows
+
+
+def test_reduce_parallel_bad_arguments():
+    with pytest.raises(ValueError):
+        parallel.reduce_parallel(str, [], "concat", num_cores=1)
+    with pytest.raises(ValueError):
+        parallel.reduce_parallel(str, [1], "median", num_cores=1)
+
+
+def test_get_memory_peak_gb(tmp_path: Path):
+    # Cgroups missing from the root are read from the root itself, like in
+    # a container.
+    assert parallel.get_memory_peak_gb(tmp_path) is None
+    (tmp_path / "memory").mkdir()
+    (tmp_path / "memory" / "memory.max_usage_in_bytes").write_text(f"{1024 ** 3}\n")
+    assert parallel.get_memory_peak_gb(tmp_path) == 1.0
+
+    (tmp_path / "memory" / "memory.max_usage_in_bytes").unlink()
+    (tmp_path / "memory.peak").write_text(f"{2 * 1024 ** 3}\n")
+    if any(line.startswith("0::") for line in Path("/proc/self/cgroup").read_text().split()):
+        assert parallel.get_memory_peak_gb(tmp_path) == 2.0
@@ -0,0 +1,68 @@
+import pstats
+import time
+from pathlib import Path
+
+import pytest
+
+from covid_shared import paths
+from covid_shared.cli_tools.profiling import ApplicationProfiler, get_active_profiler
+
+
+def _spin(seconds: float):
+    start = time.time()
+    while time.time() - start < seconds:
+        sum(range(100))
+
+
+@pytest.mark.parametrize("mode", ["sample", "cprofile"])
+def test_profiler_writes_results(mode: str, tmp_path: Path):
+    profiler = ApplicationProfiler(mode, interval=0.001)
+    with profiler:
+        assert get_active_profiler() is profiler
+        _spin(0.1)
+    assert get_active_profiler() is None
+
+    summary = profiler.finish(tmp_path)
+    assert summary["mode"] == mode
+    assert summary["samples"] > 0
+    assert any("_spin" in f["function"] for f in summary["top_functions"])
+
+    stacks = (tmp_path / paths.PROFILE_STACKS_FILE_NAME).read_text().splitlines()
+    assert stacks
+    for line in stacks:
+        frames, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert " " not in frames
+    # Both modes write a pstats file, estimated from the samples by default.
+    stats = pstats.Stats(str(tmp_path / paths.PROFILE_STATS_FILE_NAME))
+    assert any(name == "_spin" for _, _, name in stats.stats)
+    assert stats.total_tt > 0
+
+    # Finishing is idempotent.
+    assert profiler.finish(tmp_path) is summary
+
+
+def test_profiler_bad_mode():
+    with pytest.raises(ValueError):
+        ApplicationProfiler("magic")
+
+
+def test_add_profiler_without_finish_application(tmp_path: Path, monkeypatch):
+    from covid_shared.cli_tools import logging as cli_logging
+    from covid_shared.cli_tools.decorators import add_profiler
+
+    @add_profiler
+    def entry_point():
+        _spin(0.05)
+
+    # Without a log directory, nothing is written to the working directory.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cli_logging, "_LOG_DIRECTORY", None)
+    entry_point(profile="sample")
+    assert get_active_profiler() is None
+    assert not list(tmp_path.iterdir())
+
+    log_dir = tmp_path / paths.LOG_DIR
+    monkeypatch.setattr(cli_logging, "_LOG_DIRECTORY", log_dir)
+    entry_point(profile="sample")
+    assert (log_dir / paths.PROFILE_STACKS_FILE_NAME).exists()
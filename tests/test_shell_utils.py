@@ -2,7 +2,7 @@ from pathlib import Path
 
 import pytest
 
-from covid_shared.shell_tools import mkdir
+from covid_shared.shell_tools import atomic_output, mkdir
 
 
 @pytest.fixture(params=range(0o700, 0o1000, 3))
@@ -53,3 +53,18 @@ def test_mkdir_exists(mode: int, parents: bool, tmp_path: Path):
 
     mkdir(tmp_path, mode, parents=parents, exists_ok=True)
     assert oct(tmp_path.stat().st_mode)[-3:] == perms
+
+
+def test_atomic_output(tmp_path: Path):
+    output_path = tmp_path / "output.txt"
+    with atomic_output(output_path) as tmp_output_path:
+        tmp_output_path.write_text("done")
+        assert not output_path.exists()
+    assert output_path.read_text() == "done"
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(output_path) as tmp_output_path:
+            tmp_output_path.write_text("partial")
+            raise RuntimeError
+    assert output_path.read_text() == "done"
+    assert list(tmp_path.iterdir()) == [output_path]
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from covid_shared.cli_tools.timing import SpanRecorder
+
+
+@pytest.fixture
+def recorder():
+    return SpanRecorder(logged_per_span=0)
+
+
+def test_nested_spans(recorder: SpanRecorder):
+    with recorder.span("model"):
+        for _ in range(3):
+            with recorder.span("fit", locations=2) as s:
+                s.add("iterations", 5)
+        with recorder.span("write"):
+            pass
+
+    summary = recorder.summary()
+    assert list(summary) == ["model", "model/fit", "model/write"]
+    assert summary["model"]["calls"] == 1
+    assert summary["model/fit"]["calls"] == 3
+    assert summary["model/fit"]["counters"] == {"locations": 6, "iterations": 15}
+    assert summary["model"]["total_seconds"] >= summary["model/fit"]["total_seconds"]
+
+
+def test_timed_decorator(recorder: SpanRecorder):
+    @recorder.timed()
+    def load():
+        return 1
+
+    @recorder.timed("custom")
+    def other():
+        return load()
+
+    assert other() == 1
+    assert load() == 1
+    summary = recorder.summary()
+    assert summary["custom"]["calls"] == 1
+    assert summary["custom/test_timed_decorator.<locals>.load"]["calls"] == 1
+    assert summary["test_timed_decorator.<locals>.load"]["calls"] == 1
+
+
+def test_sampled_spans(recorder: SpanRecorder):
+    for _ in range(100):
+        with recorder.span("hot", sample_every=10):
+            pass
+    stats = recorder.summary()["hot"]
+    assert stats["calls"] == 100
+    assert stats["timed_calls"] == 10
+
+
+def test_sampled_out_spans_keep_child_paths(recorder: SpanRecorder):
+    for _ in range(10):
+        with recorder.span("outer", sample_every=5):
+            with recorder.span("inner"):
+                pass
+    summary = recorder.summary()
+    assert set(summary) == {"outer", "outer/inner"}
+    assert summary["outer"]["timed_calls"] == 2
+    assert summary["outer/inner"]["calls"] == 10
+
+
+def test_sampling_counts_per_path(recorder: SpanRecorder):
+    for parent in ["a", "b"] * 4:
+        with recorder.span(parent):
+            with recorder.span("load", sample_every=2):
+                pass
+    summary = recorder.summary()
+    assert summary["a/load"]["timed_calls"] == summary["b/load"]["timed_calls"] == 2
+
+
+def test_spans_nest_per_thread(recorder: SpanRecorder):
+    def work():
+        with recorder.span("worker"):
+            pass
+
+    with recorder.span("main"):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+    assert set(recorder.summary()) == {"main", "worker"}
+
+
+def test_reset(recorder: SpanRecorder):
+    with recorder.span("a"):
+        pass
+    recorder.reset()
+    assert recorder.summary() == {}
+
+
+def test_span_log_nests_counters():
+    from loguru import logger
+
+    records = []
+    sink_id = logger.add(lambda message: records.append(message.record), level="DEBUG")
+    try:
+        recorder = SpanRecorder(logged_per_span=1)
+        # Counters may share names with the span's own log fields.
+        with recorder.span("load", span=1, duration=2):
+            pass
+    finally:
+        logger.remove(sink_id)
+    extra = records[-1]["extra"]
+    assert extra["span"] == "load"
+    assert extra["counters"] == {"span": 1, "duration": 2}
@@ -0,0 +1,1187 @@
+import os
+import sys
+import time
+import types
+
+import pytest
+
+from covid_shared import ihme_deps
+from covid_shared.workflow import utilities
+
+
+class FakeTool:
+    """Picklable stand in for a jobmon Tool."""
+
+    instances = 0
+
+    def __init__(self, name):
+        FakeTool.instances += 1
+        self.name = name
+        self.templates_created = 0
+
+    def get_task_template(self, template_name, command_template, node_args, task_args):
+        self.templates_created += 1
+        return {"template_name": template_name, "command_template": command_template}
+
+
+@pytest.fixture
+def package():
+    return types.SimpleNamespace(__name__="fake_package", __jobmon_tool_version__=7)
+
+
+@pytest.fixture(autouse=True)
+def jobmon_handles(tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv("COVID_SHARED_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utilities, "_JOBMON_HANDLES", {})
+    FakeTool.instances = 0
+    mocker.patch.object(ihme_deps, "Tool", FakeTool, create=True)
+
+
+def _get_template(tool, name="stage"):
+    return tool.get_task_template(
+        template_name=name,
+        command_template="run {arg}",
+        node_args=["arg"],
+        task_args=[],
+    )
+
+
+def test_jobmon_tool_requires_version():
+    with pytest.raises(AttributeError):
+        utilities.JobmonTool(types.SimpleNamespace(__name__="no_version"))
+
+
+def test_jobmon_handles_cached_in_process(package):
+    first, second = utilities.get_jobmon_tool(package), utilities.get_jobmon_tool(package)
+    assert _get_template(first) is _get_template(second)
+    _get_template(second, name="other")
+
+    first.lazy_init_tool()
+    assert first._tool is second._tool
+    assert first._tool.active_tool_version_id == 7
+    assert FakeTool.instances == 1
+    assert first._tool.templates_created == 2
+
+
+def test_jobmon_handles_keyed_by_service(package, monkeypatch):
+    tool = utilities.get_jobmon_tool(package)
+    template = _get_template(tool)
+    assert _get_template(utilities.get_jobmon_tool(package)) is template
+
+    # New tool versions get new handles.
+    package.__jobmon_tool_version__ = 8
+    _get_template(utilities.get_jobmon_tool(package))
+    assert FakeTool.instances == 2
+
+    # As do other jobmon versions and services.
+    package.__jobmon_tool_version__ = 7
+    monkeypatch.setattr(utilities, "get_jobmon_service", lambda: ("3.0.5", "http://other"))
+    assert _get_template(utilities.get_jobmon_tool(package)) is not template
+    assert FakeTool.instances == 3
+
+
+def test_jobmon_service_aliases_structlog(monkeypatch):
+    import logging
+
+    monkeypatch.delitem(sys.modules, "structlog", raising=False)
+    utilities.get_jobmon_service.cache_clear()
+    try:
+        utilities.get_jobmon_service()
+    finally:
+        utilities.get_jobmon_service.cache_clear()
+    # Aliased before jobmon could be imported.
+    assert sys.modules["structlog"] is logging
+
+
+def test_clear_jobmon_handles(package, tmp_path):
+    template = _get_template(utilities.get_jobmon_tool(package))
+    utilities.clear_jobmon_handles()
+    assert _get_template(utilities.get_jobmon_tool(package)) is not template
+    assert FakeTool.instances == 2
+    # Nothing is cached across processes.
+    assert not list(tmp_path.iterdir())
+
+
+class FakeJobmonTask(dict):
+    """Hashable stand in for a jobmon Task."""
+
+    __hash__ = object.__hash__
+
+
+class FakeJobmonTemplate:
+    def __init__(self):
+        self.calls = []
+
+    def create_task(self, **kwargs):
+        self.calls.append(kwargs)
+        return FakeJobmonTask(kwargs)
+
+
+@pytest.fixture
+def task_template():
+    from covid_shared.workflow.specification import TaskSpecification
+    from covid_shared.workflow.template import TaskTemplate
+
+    class FakeTaskSpecification(TaskSpecification):
+        default_max_runtime_seconds = 100
+        default_m_mem_free = "1G"
+        default_num_cores = 1
+
+    class StageTaskTemplate(TaskTemplate):
+        task_name_template = "stage_{location_id}_{draw_id}"
+        command_template = "stage --location-id {location_id} --draw-id {draw_id}"
+        node_args = ["location_id", "draw_id"]
+        task_args = []
+        tool = types.SimpleNamespace(get_task_template=lambda **_: FakeJobmonTemplate())
+
+    return StageTaskTemplate("stage", FakeTaskSpecification({"queue": "all.q"}))
+
+
+def test_get_tasks_from_columns(task_template):
+    import numpy as np
+    import pandas as pd
+
+    columns = {"location_id": np.array([1, 1, 2]), "draw_id": np.array([0, 1, 0])}
+    for task_args in [columns, pd.DataFrame(columns)]:
+        tasks = task_template.get_tasks(task_args)
+        assert [t["name"] for t in tasks] == ["stage_1_0", "stage_1_1", "stage_2_0"]
+        assert type(tasks[0]["location_id"]) is int
+        assert all(t["compute_resources"] is task_template.params for t in tasks)
+        assert tasks[-1] == task_template.get_task(location_id=2, draw_id=0)
+
+    task_template.max_attempts = 3
+    assert task_template.get_tasks(columns)[0]["max_attempts"] == 3
+
+
+def test_enable_packing_fits_bounds(task_template, tmp_path):
+    from covid_shared.workflow.packing import TaskPacking
+
+    # Runtimes of 100 seconds and one core per task.
+    task_template.enable_packing(TaskPacking(size=100000, workers=100), tmp_path)
+    assert task_template.packing == TaskPacking(size=864 * 79, workers=79)
+
+
+def test_get_tasks_column_lengths(task_template):
+    with pytest.raises(ValueError):
+        task_template.get_tasks({"location_id": [1, 2], "draw_id": [0]})
+
+
+@pytest.fixture
+def local_template():
+    from covid_shared.workflow.local import LocalTaskTemplate
+
+    return LocalTaskTemplate(
+        "write",
+        command_template="sleep {sleep} && echo {label} >> {log}",
+        node_args=["label"],
+    )
+
+
+def _local_task(template, name, log, sleep=0, **resources):
+    return template.create_task(
+        compute_resources={"cores": 1, "memory": "1G", **resources},
+        name=name,
+        label=name,
+        sleep=sleep,
+        log=log,
+    )
+
+
+def test_local_workflow_respects_dependencies(local_template, tmp_path):
+    from covid_shared.workflow.local import LocalWorkflow, LocalWorkflowRunStatus
+
+    log = tmp_path / "order.txt"
+    workflow = LocalWorkflow("test", max_cores=4, max_memory_gb=8)
+    first = _local_task(local_template, "first", log, sleep=0.2)
+    middle = [_local_task(local_template, f"middle_{i}", log) for i in range(3)]
+    last = _local_task(local_template, "last", log)
+    for task in middle:
+        task.add_upstream(first)
+        last.add_upstream(task)
+    workflow.add_tasks([last] + middle)
+    workflow.add_task(first)
+
+    assert workflow.run() == LocalWorkflowRunStatus.DONE
+    order = log.read_text().split()
+    assert order[0] == "first"
+    assert order[-1] == "last"
+    assert workflow.summary()["done"] == 5
+
+
+def test_local_workflow_respects_cores(local_template, tmp_path):
+    from covid_shared.workflow.local import LocalWorkflow, LocalWorkflowRunStatus
+
+    log = tmp_path / "log.txt"
+    workflow = LocalWorkflow("test", max_cores=2, max_memory_gb=8)
+    # The second task needs more cores than are left while the first runs.
+    tasks = [
+        _local_task(local_template, "a", log, sleep=0.2, cores=1),
+        _local_task(local_template, "b", log, sleep=0.2, cores=2),
+    ]
+    workflow.add_tasks(tasks)
+
+    assert workflow.run() == LocalWorkflowRunStatus.DONE
+    assert tasks[1].start_time >= tasks[0].end_time
+
+
+def test_local_workflow_failures(local_template, tmp_path):
+    from covid_shared.workflow.local import (
+        LocalTaskTemplate,
+        LocalWorkflow,
+        LocalWorkflowRunStatus,
+    )
+
+    log = tmp_path / "log.txt"
+    failing_template = LocalTaskTemplate("fail", command_template="exit 3")
+
+    for fail_fast, expected_done in [(True, 0), (False, 1)]:
+        workflow = LocalWorkflow("test", max_cores=1, max_memory_gb=8)
+        failing = failing_template.create_task(name="fail", max_attempts=2)
+        downstream = _local_task(local_template, "downstream", log)
+        downstream.add_upstream(failing)
+        independent = _local_task(local_template, "independent", log)
+        workflow.add_tasks([failing, downstream, independent])
+
+        assert workflow.run(fail_fast=fail_fast) == LocalWorkflowRunStatus.ERROR
+        assert failing.attempts == 2
+        assert downstream.attempts == 0
+        assert workflow.summary()["done"] == expected_done
+
+
+def test_local_workflow_timeouts(local_template, tmp_path):
+    from covid_shared.workflow.local import LocalWorkflow, LocalWorkflowRunStatus
+
+    log = tmp_path / "log.txt"
+    workflow = LocalWorkflow("test", max_cores=2, max_memory_gb=8)
+    workflow.add_task(_local_task(local_template, "slow", log, sleep=10, runtime=0.2))
+    assert workflow.run() == LocalWorkflowRunStatus.ERROR
+
+    workflow = LocalWorkflow("test", max_cores=2, max_memory_gb=8)
+    workflow.add_task(_local_task(local_template, "slow", log, sleep=10))
+    assert workflow.run(seconds_until_timeout=0.2) == LocalWorkflowRunStatus.ERROR
+    assert not log.exists()
+
+
+def test_local_workflow_missing_upstream(local_template, tmp_path):
+    from covid_shared.workflow.local import LocalWorkflow
+
+    workflow = LocalWorkflow("test")
+    task = _local_task(local_template, "task", tmp_path / "log.txt")
+    task.add_upstream(_local_task(local_template, "missing", tmp_path / "log.txt"))
+    workflow.add_task(task)
+    with pytest.raises(ValueError):
+        workflow.run()
+
+
+def test_workflow_template_local_backend(tmp_path, mocker):
+    from covid_shared.workflow.specification import (
+        TaskSpecification,
+        WorkflowSpecification,
+    )
+    from covid_shared.workflow.template import TaskTemplate, WorkflowTemplate
+
+    get_cluster_name = mocker.patch("covid_shared.workflow.template.get_cluster_name")
+
+    class TouchSpecification(TaskSpecification):
+        default_max_runtime_seconds = 100
+        default_m_mem_free = "1G"
+        default_num_cores = 1
+
+    class TouchWorkflowSpecification(WorkflowSpecification):
+        tasks = {"touch": TouchSpecification}
+
+    class TouchTaskTemplate(TaskTemplate):
+        task_name_template = "touch_{label}"
+        command_template = "touch {path}"
+        node_args = ["label", "path"]
+        task_args = []
+        tool = None
+
+    class TouchWorkflowTemplate(WorkflowTemplate):
+        tool = None
+        workflow_name_template = "touch_{version}"
+        task_template_classes = {"touch": TouchTaskTemplate}
+
+        def attach_tasks(self, names):
+            tasks = self.task_templates["touch"].get_tasks(
+                {"label": names, "path": [str(tmp_path / name) for name in names]}
+            )
+            self.workflow.add_tasks(tasks)
+
+    workflow = TouchWorkflowTemplate(
+        str(tmp_path / "version"), TouchWorkflowSpecification(), backend="local"
+    )
+    workflow.attach_tasks(["a", "b"])
+    workflow.run()
+
+    get_cluster_name.assert_not_called()
+    assert (tmp_path / "a").exists() and (tmp_path / "b").exists()
+    assert (tmp_path / "version" / "logs" / "output" / "touch_a.o1").exists()
+
+    workflow.attach_tasks(["bad/name"])
+    with pytest.raises(RuntimeError):
+        workflow.run()
+
+
+def test_resource_usage_parsing():
+    from covid_shared.workflow import sizing
+
+    assert sizing.parse_duration("1-02:03:04") == 93784
+    assert sizing.parse_duration("03:04.500") == 184.5
+    assert sizing.parse_memory_gb("2048K") == 2 / 1024
+    assert sizing.parse_memory_gb("1.5G") == 1.5
+    assert sizing.parse_memory_gb("") is None
+    assert sizing.quantile([4, 1, 3, 2], 0.5) == 2.5
+    assert sizing.task_name_pattern("stage_{location_id}_{draw}").match("stage_1_2")
+    assert not sizing.task_name_pattern("stage_{location_id}").match("other_1")
+
+
+def test_resource_usage_estimates(tmp_path):
+    from covid_shared.workflow.sizing import ResourceUsage
+
+    usage = ResourceUsage(quantile=1.0, margin=1.5, min_observations=3)
+    sacct = tmp_path / "sacct.txt"
+    sacct.write_text(
+        "JobID|JobName|State|Elapsed|TotalCPU|MaxRSS\n"
+        "1|fit_1|COMPLETED|00:10:00|00:20:00|\n"
+        "1.batch|batch|COMPLETED|00:10:00|00:20:00|2G\n"
+        "2|fit_2|COMPLETED|00:20:00|00:40:00|\n"
+        "2.batch|batch|COMPLETED|00:20:00|00:40:00|4096M\n"
+        "3|fit_3|TIMEOUT|01:00:00|01:00:00|\n"
+        "3.batch|batch|CANCELLED|01:00:00|01:00:00|100G\n"
+        "4|unknown_1|COMPLETED|00:10:00|00:10:00|\n"
+        "4.batch|batch|COMPLETED|00:10:00|00:10:00|1G\n"
+    )
+    usage.add_sacct(sacct, {"fit": "fit_{draw}"})
+    assert usage.observations("fit") == 2
+    assert usage.estimate("fit") is None
+
+    usage.add_run_metadata(
+        "fit", {"resource_usage": {"wall_seconds": 600, "max_rss_gb": 1, "cpu_seconds": 600}}
+    )
+    assert usage.estimate("fit") == {
+        "max_runtime_seconds": 1800,
+        "memory_gb": 6,
+        "num_cores": 3,
+    }
+    assert usage.expected_runtime("fit") == 600
+    assert usage.expected_runtime("predict") is None
+
+    csv_path = tmp_path / "usage.csv"
+    csv_path.write_text("task_template,runtime_seconds,memory_gb\n" + "predict,100,2\n" * 3)
+    usage.add_csv(csv_path)
+    assert usage.estimate("predict") == {"max_runtime_seconds": 150, "memory_gb": 3}
+
+
+def test_task_specification_sized_from_usage():
+    from covid_shared.workflow.sizing import ResourceUsage
+    from covid_shared.workflow.specification import (
+        TaskSpecification,
+        WorkflowSpecification,
+    )
+
+    class FitSpecification(TaskSpecification):
+        default_max_runtime_seconds = 1000
+        default_m_mem_free = "10G"
+        default_num_cores = 4
+
+    class FitWorkflowSpecification(WorkflowSpecification):
+        tasks = {"fit": FitSpecification, "predict": FitSpecification}
+
+    usage = ResourceUsage(quantile=1.0, margin=1.0, min_observations=1)
+    usage.add("fit", runtime_seconds=10, memory_gb=2000.5, cpu_seconds=15)
+
+    specification = FitWorkflowSpecification(
+        tasks={"fit": {"cores": 8}}, resource_usage=usage
+    ).task_specifications
+    fit, predict = specification["fit"], specification["predict"]
+
+    # Estimates are rounded up and clipped to bounds.
+    assert fit.max_runtime_seconds == FitSpecification._runtime_bounds[0]
+    assert fit.m_mem_free == f"{FitSpecification._mem_bounds_gb[1]}G"
+    # Explicit values win over estimates.
+    assert fit.num_cores == 8
+    # Templates without usage keep their defaults.
+    assert predict.to_dict() == {
+        "runtime": 1000,
+        "memory": "10G",
+        "cores": 4,
+        "queue": "d.q",
+    }
+
+
+def test_run_metadata_records_resource_usage(tmp_path):
+    import yaml
+
+    from covid_shared.cli_tools.metadata import RunMetadata
+
+    metadata = RunMetadata()
+    metadata.dump(tmp_path / "metadata.yaml")
+    with (tmp_path / "metadata.yaml").open() as metadata_file:
+        usage = yaml.full_load(metadata_file)["resource_usage"]
+    assert set(usage) == {
+        "wall_seconds",
+        "cpu_seconds",
+        "max_rss_gb",
+        "max_rss_source",
+        "max_rss_lower_bound",
+    }
+    assert usage["max_rss_gb"] > 0
+
+
+def test_resource_usage_counts_child_memory(monkeypatch):
+    import subprocess
+
+    from covid_shared.cli_tools import metadata
+
+    # Without a cgroup peak, memory is sampled across the process tree.
+    monkeypatch.setattr(metadata, "get_memory_peak_gb", lambda: None)
+    child = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys, time; x = bytearray(300 * 1024 ** 2); "
+            "print('ready', flush=True); time.sleep(30)",
+        ],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        child.stdout.readline()
+        usage = metadata.get_resource_usage(time.time())
+    finally:
+        child.kill()
+        child.wait()
+    assert usage["max_rss_gb"] >= 0.3
+    assert usage["max_rss_source"] == "process_tree_samples"
+    assert usage["max_rss_lower_bound"]
+
+
+def test_memory_sampler_starts_with_entry_point(monkeypatch):
+    from covid_shared.cli_tools import decorators, metadata
+
+    monkeypatch.setattr(metadata, "get_memory_peak_gb", lambda: None)
+    monkeypatch.setattr(metadata, "_MEMORY_SAMPLER", None)
+    # Run metadata is created at import time as a decorator default, so it
+    # mustn't start the sampler.
+    run_metadata = metadata.RunMetadata()
+    assert metadata._MEMORY_SAMPLER is None
+
+    @decorators.pass_run_metadata(run_metadata)
+    def entry_point(run_metadata):
+        return metadata._MEMORY_SAMPLER
+
+    sampler = entry_point()
+    try:
+        assert sampler is not None
+    finally:
+        sampler.stop()
+
+
+def test_run_packed_tasks(tmp_path):
+    from covid_shared.workflow import packing
+
+    flag = tmp_path / "flag"
+    manifest = tmp_path / "pack.json"
+    tasks = [
+        {"name": "ok", "command": f"echo ok >> {tmp_path / 'ok.txt'}"},
+        # Fails until the flag file exists.
+        {"name": "flaky", "command": f"test -e {flag}"},
+    ]
+    packing.write_manifest(manifest, tasks, packing.TaskPacking(size=2, max_attempts=2))
+
+    assert not packing.run_packed_tasks(manifest)
+    status = packing.read_status(manifest)
+    assert status["ok"]["status"] == packing.DONE
+    assert status["flaky"] == {**status["flaky"], "status": packing.FAILED, "attempts": 2}
+
+    # Reruns only run the tasks that haven't succeeded.
+    flag.touch()
+    assert packing.run_packed_tasks(manifest, workers=2)
+    status = packing.read_status(manifest)
+    assert status["flaky"]["status"] == packing.DONE
+    assert status["flaky"]["attempts"] == 3
+    assert (tmp_path / "ok.txt").read_text() == "ok\n"
+
+
+def test_packed_resources():
+    from covid_shared.workflow.specification import TaskSpecification
+
+    class ShortSpecification(TaskSpecification):
+        default_max_runtime_seconds = 600
+        default_m_mem_free = "2G"
+        default_num_cores = 1
+
+    specification = ShortSpecification({"queue": "all.q"})
+    assert specification.to_packed_dict(10, workers=4) == {
+        "runtime": 1800,
+        "memory": "8G",
+        "cores": 4,
+        "queue": "all.q",
+    }
+    # Jobs that would exceed the bounds aren't silently shortened.
+    with pytest.raises(ValueError, match="ShortSpecification"):
+        specification.to_packed_dict(1000)
+    with pytest.raises(ValueError):
+        specification.to_packed_dict(1000, workers=1000)
+
+    # At most 144 rounds of 600 seconds, 500 workers of 2G, and 79 of 1 core.
+    assert specification.fit_packing(1000) == (144, 1)
+    assert specification.fit_packing(10, workers=4) == (10, 4)
+    size, workers = specification.fit_packing(100000, workers=1000)
+    assert (size, workers) == (144 * 79, 79)
+    specification.to_packed_dict(size, workers)
+
+
+def test_workflow_template_packing(tmp_path):
+    from covid_shared.workflow import packing
+    from covid_shared.workflow.specification import (
+        TaskSpecification,
+        WorkflowSpecification,
+    )
+    from covid_shared.workflow.template import TaskTemplate, WorkflowTemplate
+
+    class TouchSpecification(TaskSpecification):
+        default_max_runtime_seconds = 100
+        default_m_mem_free = "1G"
+        default_num_cores = 1
+
+    class TouchWorkflowSpecification(WorkflowSpecification):
+        tasks = {"touch": TouchSpecification}
+
+    class TouchTaskTemplate(TaskTemplate):
+        task_name_template = "touch_{label}"
+        command_template = "touch {path}"
+        node_args = ["label", "path"]
+        task_args = []
+        tool = None
+
+    class TouchWorkflowTemplate(WorkflowTemplate):
+        tool = None
+        workflow_name_template = "touch_{version}"
+        task_template_classes = {"touch": TouchTaskTemplate}
+        packed_task_templates = {"touch": packing.TaskPacking(size=3, workers=2)}
+
+        def attach_tasks(self, labels):
+            tasks = self.task_templates["touch"].get_tasks(
+                {"label": labels, "path": [str(tmp_path / label) for label in labels]}
+            )
+            self.add_tasks(tasks)
+            return tasks
+
+    labels = [str(i) for i in range(7)]
+    workflow = TouchWorkflowTemplate(
+        str(tmp_path / "version"), TouchWorkflowSpecification(), backend="local"
+    )
+    tasks = workflow.attach_tasks(labels)
+
+    assert len(tasks) == 7
+    assert tasks[0] is tasks[2] and tasks[2] is not tasks[3]
+    assert tasks[0].compute_resources["cores"] == 2
+    assert tasks[-1].compute_resources["cores"] == 1
+    packed_task_names = workflow.task_templates["touch"].packed_task_names
+    assert packed_task_names["touch_2"] == "touch_pack_00000"
+    assert packed_task_names["touch_3"] == "touch_pack_00001"
+
+    workflow.run()
+    assert len(workflow.workflow.tasks) == 3
+    assert all((tmp_path / label).exists() for label in labels)
+    manifest = tmp_path / "version" / "logs" / "packing" / "touch_pack_00000.json"
+    assert set(packing.read_status(manifest)) == {"touch_0", "touch_1", "touch_2"}
+
+
+def test_topological_sort():
+    from covid_shared.workflow.graph import topological_sort
+    from covid_shared.workflow.local import LocalTask
+
+    a, b, c = (LocalTask(name, "true", {}) for name in "abc")
+    c.add_upstream(b)
+    b.add_upstream(a)
+    assert topological_sort([c, b, a]) == [a, b, c]
+    # Edges to tasks outside the given tasks are ignored.
+    assert topological_sort([c, b]) == [b, c]
+
+    a.add_upstream(c)
+    with pytest.raises(ValueError):
+        topological_sort([a, b, c])
+
+
+@pytest.fixture
+def copy_workflow(tmp_path):
+    from covid_shared.workflow.specification import (
+        TaskSpecification,
+        WorkflowSpecification,
+    )
+    from covid_shared.workflow.template import TaskTemplate, WorkflowTemplate
+
+    class CopySpecification(TaskSpecification):
+        default_max_runtime_seconds = 100
+        default_m_mem_free = "1G"
+        default_num_cores = 1
+
+    class CopyWorkflowSpecification(WorkflowSpecification):
+        tasks = {"copy": CopySpecification}
+
+    class CopyTaskTemplate(TaskTemplate):
+        task_name_template = "copy_{dst}"
+        command_template = "cp {root}/{src} {root}/{dst}"
+        node_args = ["src", "dst"]
+        task_args = ["root"]
+        tool = None
+        inputs = ["{root}/{src}"]
+        outputs = ["{root}/{dst}"]
+
+    class CopyWorkflowTemplate(WorkflowTemplate):
+        tool = None
+        workflow_name_template = "copy_{version}"
+        task_template_classes = {"copy": CopyTaskTemplate}
+        incremental = True
+
+        def attach_tasks(self):
+            # A chain a -> b -> c -> d.
+            tasks = self.task_templates["copy"].get_tasks(
+                {"src": ["a", "b", "c"], "dst": ["b", "c", "d"], "root": [str(tmp_path)] * 3}
+            )
+            for upstream, task in zip(tasks, tasks[1:]):
+                task.add_upstream(upstream)
+            self.add_tasks(tasks)
+
+    def _make(fingerprint="mtime"):
+        CopyWorkflowTemplate.fingerprint = fingerprint
+        workflow = CopyWorkflowTemplate(
+            str(tmp_path / "version"), CopyWorkflowSpecification(), backend="local"
+        )
+        workflow.attach_tasks()
+        return workflow
+
+    (tmp_path / "a").write_text("a")
+    return _make
+
+
+def _ran(workflow):
+    return sorted(task.name for task in workflow.workflow.tasks)
+
+
+def test_incremental_workflow(copy_workflow, tmp_path):
+    workflow = copy_workflow()
+    workflow.run()
+    assert _ran(workflow) == ["copy_b", "copy_c", "copy_d"]
+    assert (tmp_path / "d").read_text() == "a"
+
+    workflow = copy_workflow()
+    workflow.run()
+    assert _ran(workflow) == []
+
+    # Updating an input reruns everything downstream of it.
+    c_mtime = (tmp_path / "c").stat().st_mtime
+    os.utime(tmp_path / "b", (c_mtime + 10, c_mtime + 10))
+    workflow = copy_workflow()
+    workflow.run()
+    assert _ran(workflow) == ["copy_c", "copy_d"]
+
+
+def test_incremental_workflow_hash_fingerprints(copy_workflow, tmp_path):
+    copy_workflow("hash").run()
+
+    # Touching an input without changing it doesn't invalidate outputs.
+    c_mtime = (tmp_path / "c").stat().st_mtime
+    os.utime(tmp_path / "b", (c_mtime + 10, c_mtime + 10))
+    workflow = copy_workflow("hash")
+    workflow.run()
+    assert _ran(workflow) == []
+
+    (tmp_path / "b").write_text("changed")
+    os.utime(tmp_path / "b", (c_mtime + 20, c_mtime + 20))
+    workflow = copy_workflow("hash")
+    workflow.run()
+    assert _ran(workflow) == ["copy_c", "copy_d"]
+    assert (tmp_path / "d").read_text() == "changed"
+
+
+def test_incremental_workflow_direct_tasks(copy_workflow, tmp_path):
+    from loguru import logger
+
+    copy_workflow().run()
+
+    workflow = copy_workflow()
+    # A task added straight to the jobmon-style workflow bypasses add_tasks.
+    extra = workflow.task_templates["copy"].get_task(src="d", dst="e", root=str(tmp_path))
+    d = next(t for t in workflow._tasks if t.name == "copy_d")
+    extra.add_upstream(d)
+    workflow.workflow.add_task(extra)
+
+    messages = []
+    sink_id = logger.add(messages.append, level="WARNING", format="{message}")
+    try:
+        workflow.run()
+    finally:
+        logger.remove(sink_id)
+
+    assert any("added directly to the workflow" in m for m in messages)
+    # The direct task still runs, but doesn't wait on the pruned task.
+    assert _ran(workflow) == ["copy_e"]
+    assert not extra.upstream_tasks
+    assert (tmp_path / "e").read_text() == "a"
+
+    # Adding tasks directly is fine when nothing would be pruned.
+    workflow = copy_workflow()
+    workflow.incremental = False
+    workflow.workflow.add_task(
+        workflow.task_templates["copy"].get_task(src="a", dst="f", root=str(tmp_path))
+    )
+    messages = []
+    sink_id = logger.add(messages.append, level="WARNING", format="{message}")
+    try:
+        workflow.run()
+    finally:
+        logger.remove(sink_id)
+    assert not messages
+    assert _ran(workflow) == ["copy_b", "copy_c", "copy_d", "copy_f"]
+
+
+def test_critical_path():
+    from covid_shared.workflow.graph import (
+        critical_path,
+        critical_path_lengths,
+        topological_sort,
+    )
+    from covid_shared.workflow.local import LocalTask
+
+    # A short chain a -> b and a long chain c -> d -> e, joined at f.
+    tasks = {name: LocalTask(name, "true", {}) for name in "abcdef"}
+    for upstream, downstream in ["ab", "cd", "de", "bf", "ef"]:
+        tasks[downstream].add_upstream(tasks[upstream])
+    runtimes = {task: 10.0 for task in tasks.values()}
+    runtimes[tasks["a"]] = 25.0
+
+    lengths = critical_path_lengths(tasks.values(), runtimes)
+    assert lengths[tasks["f"]] == 10
+    assert lengths[tasks["a"]] == 45
+    assert lengths[tasks["c"]] == 40
+    path = critical_path(tasks.values(), lengths)
+    assert [task.name for task in path] == ["a", "b", "f"]
+
+    ordered = topological_sort(tasks.values(), lengths)
+    assert [task.name for task in ordered] == ["a", "c", "d", "b", "e", "f"]
+
+
+def test_local_workflow_priorities(local_template, tmp_path):
+    from covid_shared.workflow.local import LocalWorkflow, LocalWorkflowRunStatus
+
+    log = tmp_path / "order.txt"
+    workflow = LocalWorkflow("test", max_cores=1, max_memory_gb=8)
+    tasks = [_local_task(local_template, name, log) for name in "abc"]
+    tasks[2].priority = 1.0
+    workflow.add_tasks(tasks)
+
+    assert workflow.run() == LocalWorkflowRunStatus.DONE
+    assert log.read_text().split() == ["c", "a", "b"]
+
+
+def test_simulate():
+    from covid_shared.workflow.local import LocalTask
+    from covid_shared.workflow.simulation import simulate
+
+    def _task(name, cores=1, memory="1G"):
+        return LocalTask(name, "true", {"cores": cores, "memory": memory})
+
+    # Four independent 10 second fits feeding a 5 second summary.
+    fits = [_task(f"fit_{i}") for i in range(4)]
+    summary = _task("summary", cores=2)
+    for fit in fits:
+        summary.add_upstream(fit)
+    tasks = fits + [summary]
+    runtimes = {fit: 10.0 for fit in fits}
+    runtimes[summary] = 5.0
+    templates = {fit: "fit" for fit in fits}
+    templates[summary] = "summary"
+
+    result = simulate(tasks, runtimes, max_cores=2, templates=templates)
+    assert result.makespan == 25
+    assert result.critical_path_seconds == 15
+    assert result.capacity_bound_seconds == 25
+    assert result.core_utilization == 1
+    assert result.memory_utilization is None
+    assert result.templates["fit"].wait_seconds == 20
+    assert result.templates["summary"].critical_seconds == 5
+    assert result.bottlenecks == ["fit", "summary"]
+
+    result = simulate(tasks, runtimes, max_cores=4, templates=templates)
+    assert result.makespan == 15
+
+    # Memory limits concurrency too.
+    result = simulate(tasks, runtimes, max_cores=4, max_memory_gb=2)
+    assert result.makespan == 25
+    assert result.memory_utilization == pytest.approx(45 / 50)
+    assert list(result.templates) == ["unknown"]
+
+    # Large graphs with a mix of task sizes schedule in priority order and
+    # backfill small tasks around big ones.
+    big = [_task(f"big_{i}", cores=3) for i in range(1000)]
+    small = [_task(f"small_{i}") for i in range(5000)]
+    runtimes = {task: 1.0 for task in big + small}
+    result = simulate(big + small, runtimes, max_cores=4)
+    assert result.makespan == 2000
+    assert result.core_utilization == 1
+
+
+def test_workflow_template_simulate(copy_workflow):
+    workflow = copy_workflow()
+    result = workflow.simulate(max_cores=4)
+    assert result.makespan == 3 * 100
+    result = workflow.simulate(max_cores=4, runtimes={"copy": 60})
+    assert result.makespan == 3 * 60
+    assert result.templates["copy"].tasks == 3
+
+    # The attached tasks can still be simulated after the workflow runs.
+    workflow.run()
+    assert workflow.simulate(max_cores=4).makespan == 3 * 100
+
+    # Templates without a runtime estimate can't be rescaled.
+    workflow.task_templates["copy"].runtime_estimate = 0
+    result = workflow.simulate(max_cores=4, runtimes={"copy": 60})
+    assert result.makespan == 3 * 100
+
+
+def test_straggler_detector():
+    from covid_shared.workflow.stragglers import StragglerDetector, StragglerPolicy
+
+    detector = StragglerDetector(StragglerPolicy(quantile=0.5, multiplier=2, min_siblings=3))
+    for runtime in [10, 20]:
+        detector.record("fit", runtime)
+    assert detector.threshold("fit") is None
+    assert not detector.is_straggler("fit", 1000)
+
+    detector.record("fit", 30)
+    assert detector.threshold("fit") == 40
+    assert detector.is_straggler("fit", 41)
+    assert not detector.is_straggler("fit", 39)
+    assert not detector.is_straggler("predict", 1000)
+
+    with pytest.raises(ValueError):
+        StragglerDetector(StragglerPolicy(quantile=2))
+
+
+def test_straggler_policy_with_jobmon(copy_workflow, tmp_path):
+    from covid_shared.workflow.stragglers import StragglerPolicy
+
+    workflow = copy_workflow()
+    template_class = type(workflow)
+    template_class.straggler_policy = StragglerPolicy()
+    with pytest.raises(ValueError, match="requires trace=True"):
+        template_class(
+            str(tmp_path / "version"), workflow_specification=None, backend="jobmon"
+        )
+    template_class.trace = True
+    template_class.straggler_policy = StragglerPolicy(speculate=True)
+    with pytest.raises(ValueError, match="only supported by the local backend"):
+        template_class(
+            str(tmp_path / "version"), workflow_specification=None, backend="jobmon"
+        )
+
+
+def test_speculation_requires_atomic_outputs(copy_workflow):
+    from loguru import logger
+
+    from covid_shared.workflow.stragglers import StragglerPolicy
+
+    template_class = type(copy_workflow())
+    template_class.straggler_policy = StragglerPolicy(speculate=True)
+    messages = []
+    sink_id = logger.add(messages.append, level="WARNING", format="{message}")
+    try:
+        workflow = copy_workflow()
+    finally:
+        logger.remove(sink_id)
+    assert workflow.workflow.speculative_templates == set()
+    assert any("no task template sets atomic_outputs" in m for m in messages)
+
+    type(workflow.task_templates["copy"]).atomic_outputs = True
+    workflow = copy_workflow()
+    assert workflow.workflow.speculative_templates == {"copy"}
+
+
+def test_local_workflow_speculation(tmp_path):
+    from covid_shared.workflow.local import (
+        LocalTaskTemplate,
+        LocalWorkflow,
+        LocalWorkflowRunStatus,
+    )
+    from covid_shared.workflow.stragglers import StragglerPolicy
+
+    # The first copy of a task to start hangs, later copies finish at once.
+    template = LocalTaskTemplate(
+        "write",
+        command_template=(
+            "if mkdir {root}/{label}.lock 2>/dev/null; then sleep {sleep}; fi; "
+            "echo {label} >> {root}/log.txt"
+        ),
+    )
+    policy = StragglerPolicy(
+        quantile=0.5, multiplier=2, min_siblings=3, speculate=True, check_interval=0.05
+    )
+    workflow = LocalWorkflow("test", max_cores=8, max_memory_gb=8, straggler_policy=policy)
+    for label, sleep in [("a", 0), ("b", 0), ("c", 0), ("slow", 60)]:
+        workflow.add_task(
+            template.create_task(
+                compute_resources={"cores": 1, "memory": "1G"},
+                name=label,
+                label=label,
+                sleep=sleep,
+                root=tmp_path,
+            )
+        )
+
+    start = time.time()
+    assert workflow.run() == LocalWorkflowRunStatus.DONE
+    assert time.time() - start < 30
+    assert workflow.stragglers == ["slow"]
+    assert sorted((tmp_path / "log.txt").read_text().split()) == ["a", "b", "c", "slow"]
+
+
+def test_local_workflow_speculative_templates(tmp_path):
+    from loguru import logger
+
+    from covid_shared.workflow.local import (
+        LocalTaskTemplate,
+        LocalWorkflow,
+        LocalWorkflowRunStatus,
+    )
+    from covid_shared.workflow.stragglers import StragglerPolicy
+
+    template = LocalTaskTemplate("write", command_template="sleep {sleep}")
+    policy = StragglerPolicy(
+        quantile=0.5, multiplier=2, min_siblings=3, speculate=True, check_interval=0.05
+    )
+    workflow = LocalWorkflow(
+        "test",
+        max_cores=8,
+        max_memory_gb=8,
+        straggler_policy=policy,
+        speculative_templates=["other"],
+    )
+    for label, sleep in [("a", 0), ("b", 0), ("c", 0), ("slow", 2)]:
+        workflow.add_task(
+            template.create_task(
+                compute_resources={"cores": 1, "memory": "1G"}, name=label, sleep=sleep
+            )
+        )
+
+    messages = []
+    sink_id = logger.add(messages.append, level="INFO", format="{message}")
+    try:
+        assert workflow.run() == LocalWorkflowRunStatus.DONE
+    finally:
+        logger.remove(sink_id)
+    # Flagged, but not copied.
+    assert workflow.stragglers == ["slow"]
+    assert not any("speculative copy" in m for m in messages)
+
+
+def test_workflow_template_tracing(tmp_path, monkeypatch):
+    import json
+
+    from loguru import logger
+
+    from covid_shared.cli_tools import tracing
+    from covid_shared.workflow.specification import (
+        TaskSpecification,
+        WorkflowSpecification,
+    )
+    from covid_shared.workflow.template import TaskTemplate, WorkflowTemplate
+
+    script = tmp_path / "app.py"
+    script.write_text(
+        "import sys\n"
+        "from loguru import logger\n"
+        "from covid_shared.cli_tools import monitor_application\n"
+        "def main(app_metadata, label):\n"
+        "    pass\n"
+        "monitor_application(main, logger, False)(sys.argv[1])\n"
+    )
+
+    class AppSpecification(TaskSpecification):
+        default_max_runtime_seconds = 100
+        default_m_mem_free = "1G"
+        default_num_cores = 1
+
+    class AppWorkflowSpecification(WorkflowSpecification):
+        tasks = {"app": AppSpecification}
+
+    class AppTaskTemplate(TaskTemplate):
+        task_name_template = "app_{label}"
+        command_template = f"{sys.executable} {script} {{label}}"
+        node_args = ["label"]
+        task_args = []
+        tool = None
+
+    class AppWorkflowTemplate(WorkflowTemplate):
+        tool = None
+        workflow_name_template = "app_{version}"
+        task_template_classes = {"app": AppTaskTemplate}
+        trace = True
+
+        def attach_tasks(self):
+            first, second = self.task_templates["app"].get_tasks({"label": ["a", "b"]})
+            second.add_upstream(first)
+            self.add_tasks([first, second])
+
+    workflow = AppWorkflowTemplate(
+        str(tmp_path / "version"), AppWorkflowSpecification(), backend="local"
+    )
+    workflow.attach_tasks()
+    workflow.run()
+
+    trace = json.loads((tmp_path / "version" / "logs" / "trace.json").read_text())
+    tasks = {e["name"]: e for e in trace["traceEvents"] if e["ph"] == "X"}
+    assert set(tasks) == {"app_a", "app_b"}
+    assert tasks["app_b"]["ts"] >= tasks["app_a"]["ts"] + tasks["app_a"]["dur"]
+    assert tasks["app_a"]["args"]["trace_id"] == workflow.trace_id
+
+    # A broken report doesn't fail the run.
+    def _fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(tracing, "write_trace_report", _fail)
+    workflow = AppWorkflowTemplate(
+        str(tmp_path / "version"), AppWorkflowSpecification(), backend="local"
+    )
+    workflow.attach_tasks()
+    messages = []
+    sink_id = logger.add(messages.append, level="WARNING", format="{message}")
+    try:
+        workflow.run()
+    finally:
+        logger.remove(sink_id)
+    assert any("Failed to write trace report" in m for m in messages)
+
+
+def test_progress_reporter(tmp_path):
+    import json
+
+    from covid_shared.workflow import progress
+
+    reporter = progress.ProgressReporter(interval=3600, status_path=tmp_path / "status.json")
+    for i in range(4):
+        reporter.add_task(f"fit_{i}", "fit")
+    reporter.add_task("summary", "summary")
+    reporter.start()
+    assert progress.get_active_reporter() is reporter
+
+    reporter.set_status("fit_0", progress.RUNNING)
+    reporter.set_status("fit_0", progress.DONE)
+    reporter.set_status("fit_1", progress.RUNNING)
+    reporter.set_status("fit_2", progress.FAILED)
+    with pytest.raises(ValueError):
+        reporter.set_status("fit_3", "lost")
+    status = reporter.stop()
+    assert progress.get_active_reporter() is None
+
+    assert (status["done"], status["running"], status["queued"], status["failed"]) == (
+        1,
+        1,
+        2,
+        1,
+    )
+    assert status["templates"]["fit"] == {"queued": 1, "running": 1, "done": 1, "failed": 1}
+    assert status["throughput_per_minute"] > 0
+    assert status["eta_seconds"] is not None
+    assert json.loads((tmp_path / "status.json").read_text())["done"] == 1
+
+
+def test_trace_status_poller(tmp_path):
+    from covid_shared.cli_tools import tracing
+    from covid_shared.workflow import progress
+
+    context = {"trace_id": "abc", "trace_dir": str(tmp_path)}
+
+    def record(name, start, **fields):
+        tracing.record_task_trace({**context, "task_name": name}, {"start": start, **fields})
+
+    now = time.time()
+    # Done before this run, a failure from the last run now queued again,
+    # a retry that is running, and a pack with one of two tasks done.
+    record("fit_0", now - 100, end=now - 90, success=True)
+    record("fit_1", now - 100, end=now - 90, success=False)
+    record("fit_2", now + 1, end=now + 2, success=False)
+    record("fit_2", now + 3)
+    record("summary", now + 1, end=now + 2, success=False)
+    record("pack_a", now + 1, end=now + 2, success=True)
+    record("unknown", now + 1)
+
+    reporter = progress.ProgressReporter(interval=3600, window=3600)
+    for i in range(3):
+        reporter.add_task(f"fit_{i}", "fit")
+    reporter.add_task("summary", "summary")
+    reporter.add_task("pack", "packed")
+    poller = progress.TraceStatusPoller(
+        tmp_path, "abc", aliases={"pack_a": "pack", "pack_b": "pack"}, since=now
+    )
+    reporter._start = now
+    poller.poll(reporter)
+
+    statuses = {name: reporter.get_status(name) for name in reporter._tasks}
+    assert statuses == {
+        "fit_0": progress.DONE,
+        "fit_1": progress.QUEUED,
+        "fit_2": progress.RUNNING,
+        "summary": progress.FAILED,
+        "pack": progress.RUNNING,
+    }
+    # Tasks done before the run don't count toward the throughput.
+    assert reporter.status()["throughput_per_minute"] == 0
+
+    record("pack_b", now + 2, end=now + 4, success=True)
+    poller.poll(reporter)
+    assert reporter.get_status("pack") == progress.DONE
+    assert reporter.status()["throughput_per_minute"] > 0
+
+
+def test_trace_status_poller_stragglers(tmp_path):
+    from loguru import logger
+
+    from covid_shared.cli_tools import tracing
+    from covid_shared.workflow import progress
+    from covid_shared.workflow.stragglers import StragglerDetector, StragglerPolicy
+
+    context = {"trace_id": "abc", "trace_dir": str(tmp_path)}
+    now = time.time()
+    for i in range(3):
+        tracing.record_task_trace(
+            {**context, "task_name": f"fit_{i}"},
+            {"start": now - 100, "end": now - 90, "success": True},
+        )
+    tracing.record_task_trace({**context, "task_name": "fit_3"}, {"start": now - 100})
+    tracing.record_task_trace({**context, "task_name": "fit_4"}, {"start": now - 1})
+
+    reporter = progress.ProgressReporter(interval=3600)
+    for i in range(5):
+        reporter.add_task(f"fit_{i}", "fit")
+    detector = StragglerDetector(StragglerPolicy(min_siblings=3))
+    poller = progress.TraceStatusPoller(tmp_path, "abc", detector=detector)
+    messages = []
+    sink_id = logger.add(messages.append, level="WARNING", format="{message}")
+    try:
+        poller.poll(reporter)
+        poller.poll(reporter)
+    finally:
+        logger.remove(sink_id)
+
+    assert poller.stragglers == ["fit_3"]
+    assert len(messages) == 1 and "fit_3" in messages[0]
+    # Finished tasks are only recorded once.
+    assert detector.threshold("fit") == pytest.approx(15)
+    assert len(detector._runtimes["fit"]) == 3
+
+
+def test_workflow_template_progress(copy_workflow, tmp_path):
+    import json
+
+    workflow = copy_workflow()
+    workflow.progress_status = True
+    workflow.run()
+
+    status = json.loads((tmp_path / "version" / "logs" / "progress.json").read_text())
+    assert status["done"] == 3
+    assert status["templates"] == {
+        "copy": {"queued": 0, "running": 0, "done": 3, "failed": 0}
+    }